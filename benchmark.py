@@ -0,0 +1,238 @@
+"""Benchmark the parsers and importers on synthetic data (otudb.synthetic)
+    against a local SQLite stand-in of the otu db.
+
+    Each stage runs in a fresh process so its peak RSS is its own. Results
+    (rows/sec, peak RSS and timings per stage) are written as JSON to be
+    compared run over run.
+"""
+import os
+import sys
+import json
+import time
+import platform
+import resource
+import subprocess
+import multiprocessing
+
+# the per-row and per-batch log records would dominate the timings
+os.environ.setdefault('OTUDB_LOG_LEVEL', 'WARNING')
+
+from clize import run, parameters
+
+from otudb import __version__, synthetic
+from otudb.utils import log_it
+
+log = log_it(logname='benchmark')
+
+def peak_rss_kb():
+    """peak resident set size of this process, in KB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def generate_inputs(workdir, n_otus, n_samples, density, seed=0, compress=False):
+    """write the synthetic input files; return {name: (path, rows, seconds)}"""
+    ext = '.gz' if compress else ''
+    jobs = [
+        ('samples', f'sample_info.csv{ext}', synthetic.write_samples, (n_samples,)),
+        ('fasta', f'otus.fasta{ext}', synthetic.write_fasta, (n_otus,)),
+        ('count', f'otu_table.tsv{ext}', synthetic.write_count_table,
+         (n_otus, n_samples, density)),
+        ('taxa_rdp', f'taxa_rdp.txt{ext}', synthetic.write_rdp_taxa, (n_otus,)),
+        ('taxa_gg', f'taxa_gg.txt{ext}', synthetic.write_gg_taxa, (n_otus,)),
+    ]
+    inputs = {}
+    for name, filename, write, args in jobs:
+        path = os.path.join(workdir, filename)
+        started = time.perf_counter()
+        rows = write(path, *args, seed=seed)
+        inputs[name] = (path, rows, time.perf_counter() - started)
+    return inputs
+
+
+def create_staging_db(db_path):
+    """empty SQLite stand-in of the otu db, tables as defined in otudb.models"""
+    from peewee import SqliteDatabase
+    from otudb.models import base_models, package_models
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    db = SqliteDatabase(db_path)
+    with db.bind_ctx(base_models + package_models):
+        db.create_tables(base_models + package_models)
+    db.close()
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Stages ~~~~~
+# run in the child processes; each returns the number of rows handled
+
+def parse_csv(filepath, **options):
+    from otudb.parsers import CSVParser
+    tp = CSVParser(filepath, mode='r', delimiter='\t')
+    tp.get_fieldnames()
+    return sum(1 for _ in tp.load_data())
+
+
+def parse_fasta(filepath, **options):
+    from otudb.parsers import FastaParser
+    return sum(1 for _ in FastaParser(filepath, mode='r').load_data())
+
+
+def parse_indexed_fasta(filepath, **options):
+    from otudb.parsers import IndexedFasta
+    with IndexedFasta(filepath) as fasta:
+        return sum(len(record.sequence) > 0 for record in fasta)
+
+
+def import_stage(importer):
+    def stage(filepath, **options):
+        import import_data
+        return getattr(import_data, importer)(filepath, **options)
+    return stage
+
+
+stages = {
+    'parse_count_table':  parse_csv,
+    'parse_fasta':        parse_fasta,
+    'parse_indexed_fasta': parse_indexed_fasta,
+    'import_samples':     import_stage('sample_import'),
+    'import_fasta':       import_stage('fasta_import'),
+    'import_count_table': import_stage('count_table_import'),
+    'import_taxa_rdp':    import_stage('taxa_import'),
+    'import_taxa_gg':     import_stage('taxa_import'),
+}
+
+
+def stage_worker(stage, filepath, db_path, cache_dir, options, bulk=False):
+    """run one stage in this (child) process against the SQLite db"""
+    import contextlib
+    from peewee import SqliteDatabase
+    from otudb.bulk import bulk_load, sqlite_pragmas
+    from otudb.database import otudb, tables
+    otudb.initialize(SqliteDatabase(db_path, pragmas=sqlite_pragmas))
+    tables.cache_dir = cache_dir
+    tables.models
+    started = time.perf_counter()
+    with (bulk_load(otudb) if bulk else contextlib.nullcontext()):
+        rows = stages[stage](filepath, **options)
+    seconds = time.perf_counter() - started
+    otudb.close()
+    return dict(rows=rows, seconds=round(seconds, 4),
+                rows_per_sec=round(rows / seconds if seconds else 0, 1),
+                peak_rss_kb=peak_rss_kb())
+
+
+def run_stage(stage, filepath, db_path, cache_dir, bulk=False, **options):
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(1) as pool:
+        result = pool.apply(stage_worker, (stage, filepath, db_path, cache_dir, options,
+                                           bulk and stage.startswith('import')))
+    log.warning('%-20s %9s rows %8.2fs %10.0f rows/sec %8s KB peak', stage,
+                result['rows'], result['seconds'], result['rows_per_sec'],
+                result['peak_rss_kb'])
+    return dict(stage=stage, file=os.path.basename(filepath), **result)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(workdir, n_otus, n_samples, density, seed=0, compress=False,
+                   batch_size=1000, only=None, bulk=False):
+    """generate the inputs, run the stages, return the results dict"""
+    started = time.strftime('%Y-%m-%dT%H:%M:%S')
+    os.makedirs(workdir, exist_ok=True)
+    db_path = os.path.join(workdir, 'otudb.sqlite')
+    cache_dir = os.path.join(workdir, 'cache')
+    create_staging_db(db_path)
+
+    inputs = generate_inputs(workdir, n_otus, n_samples, density, seed, compress)
+    generated = [dict(stage=f'generate_{name}', file=os.path.basename(path), rows=rows,
+                      seconds=round(seconds, 4))
+                 for name, (path, rows, seconds) in inputs.items()]
+
+    batch = dict(batch_size=batch_size)
+    plan = [
+        ('parse_count_table', 'count', {}),
+        ('parse_fasta', 'fasta', {}),
+        ('parse_indexed_fasta', 'fasta', {}),
+        ('import_samples', 'samples', batch),
+        ('import_fasta', 'fasta', batch),
+        ('import_count_table', 'count', dict(batch, create_samples=True)),
+        ('import_taxa_rdp', 'taxa_rdp', dict(batch, set_id=1)),
+        ('import_taxa_gg', 'taxa_gg', dict(batch, set_id=2)),
+    ]
+    results = []
+    for stage, name, options in plan:
+        if only and stage not in only:
+            continue
+        if stage == 'parse_indexed_fasta' and compress:
+            continue # cannot index compressed files
+        results.append(run_stage(stage, inputs[name][0], db_path, cache_dir, bulk,
+                                 **options))
+
+    return dict(
+        started=started,
+        version=__version__,
+        commit=git_commit(),
+        python=platform.python_version(),
+        platform=platform.platform(),
+        params=dict(otus=n_otus, samples=n_samples, density=density, seed=seed,
+                    compress=compress, batch_size=batch_size, bulk_load=bulk),
+        generate=generated,
+        stages=results,
+    )
+
+
+sizes = parameters.one_of(*[(name, f'{otus} otus x {samples} samples, {density} dense')
+                            for name, (otus, samples, density) in synthetic.scales.items()])
+
+def benchmark(*,
+              scale:['s', sizes]='small',
+              otus:int=None,
+              samples:int=None,
+              density:float=None,
+              seed:int=0,
+              compress=False,
+              batch_size:['b', int]=1000,
+              bulk_load=False,
+              stage:['S', parameters.multi()]=None,
+              workdir:['w', str]='benchmark_data',
+              output:['o', str]=None,
+             ):
+    """Benchmark parsers and importers on synthetic data, results as JSON.
+
+    :param scale: named size of the inputs (tiny, small, medium, large)
+    :param otus: number of OTUs, overrides the scale's
+    :param samples: number of samples, overrides the scale's
+    :param density: fraction of non-zero count cells, overrides the scale's
+    :param seed: random seed of the generators; equal seeds, equal files
+    :param compress: write gzip compressed inputs
+    :param batch_size: number of rows written per INSERT statement
+    :param bulk_load: run the imports with the bulk load settings (otudb.bulk)
+    :param stage: only run these stages (repeatable)
+    :param workdir: directory of the generated files and SQLite db
+    :param output: JSON results file (default: print them)
+    """
+    default_otus, default_samples, default_density = synthetic.scales[scale]
+    results = run_benchmarks(workdir,
+                             otus or default_otus,
+                             samples or default_samples,
+                             density or default_density,
+                             seed, compress, batch_size, stage, bulk_load)
+    results['params']['scale'] = scale
+    if output:
+        with open(output, 'w') as fh:
+            json.dump(results, fh, indent=2)
+        log.warning(f'Results written to {output}')
+    else:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    run(benchmark)
@@ -0,0 +1,53 @@
+"""Copy a staging SQLite otu db into the configured (production) otu db.
+    Load files into the staging db first, e.g.
+
+        OTUDB_URL=staging.sqlite python import_data.py --bulk-load -m manifest.tsv
+        python copy_db.py -s staging.sqlite
+"""
+import os
+
+from clize import run
+from peewee import SqliteDatabase
+
+from otudb.bulk import bulk_load as bulk_load_db
+from otudb.database import otudb, tables
+from otudb.export import FETCH_SIZE
+from otudb.staging import copy_database, COPY_BATCH_SIZE
+from otudb.utils import log_it
+
+log = log_it(logname='copy_db')
+
+
+def parse_copy(*,
+               source:['s', str]=None,
+               batch_size:['b', int]=COPY_BATCH_SIZE,
+               fetch_size:int=FETCH_SIZE,
+               bulk_load=False,
+              ):
+    """Copy the tables of a staging SQLite db into OTUdb.
+
+    :param source: path of the staging SQLite db (REQUIRED)
+    :param batch_size: number of rows written per INSERT statement
+    :param fetch_size: rows read from the staging db at a time
+    :param bulk_load: skip unique/foreign key checks and rebuild the indexes
+        of the big tables at the end (the target is unusable meanwhile)
+    """
+    if not source or not os.path.exists(source):
+        log.error(f'    Whoops! The staging db to copy is required, {source!r} not found...')
+        return
+    staging = SqliteDatabase(source)
+    models = tables.models
+    try:
+        if bulk_load:
+            with bulk_load_db(otudb):
+                copied = copy_database(staging, models, batch_size, fetch_size)
+        else:
+            copied = copy_database(staging, models, batch_size, fetch_size)
+    finally:
+        staging.close()
+    for table, rows in copied.items():
+        log.info(f'{table:24} {rows:>12} rows')
+
+
+if __name__ == '__main__':
+    run(parse_copy)
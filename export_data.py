@@ -0,0 +1,88 @@
+"""Export otu db data of an analysis set to CSV/TSV files.
+    The counterpart of import_data.
+"""
+import time
+
+from clize import run, parameters
+
+from otudb.database import otudb, tables
+from otudb.export import export_long, export_wide, FETCH_SIZE
+from otudb.parsers import CSVParser
+from otudb.parsers.csv import BLOCK_ROWS
+from otudb.utils import log_it
+
+log = log_it(logname='export_data')
+
+
+def export_table(outfile, table, set_id=None, layout='long', delimiter=None,
+                 fetch_size=FETCH_SIZE, block_rows=BLOCK_ROWS):
+    """stream `table` of analysis set `set_id` into outfile, return rows written"""
+    if layout == 'wide' and table != 'count':
+        raise ValueError(f'Only count tables have a wide layout, not {table}')
+    if delimiter is None:
+        delimiter = ',' if outfile.endswith('.csv') else '\t'
+    log.info(f'Exporting {table} of set {set_id} to {outfile} ({layout})')
+    started = time.perf_counter()
+    try:
+        db = otudb.get_database()
+        if layout == 'wide':
+            headers, rows = export_wide(db, tables.models, set_id, fetch_size)
+        else:
+            headers, rows = export_long(db, tables.models, table, set_id, fetch_size)
+        out = CSVParser(outfile, mode='w', delimiter=delimiter)
+        with out.fh:
+            row_count = out.write_rows(rows, headers, block_rows)
+    except Exception as e:
+        log.error(f'Whoops while exporting {table} to {outfile}.')
+        raise e
+    elapsed = time.perf_counter() - started
+    log.info('Exported %s rows to %s in %.2fs (%.0f rows/sec)',
+             row_count, outfile, elapsed, row_count / elapsed if elapsed else 0)
+    return row_count
+
+
+types_of_exports = parameters.one_of(
+    ('count', "otu count table, pct abundance per sample"),
+    ('taxa', "otu annotations (taxonomy)"),
+    ('sample', "sample metadata"),
+    )
+
+layouts = parameters.one_of(
+    ('long', "one row per value (OTU, sample, abundance)"),
+    ('wide', "OTU x sample matrix (count tables)"),
+    )
+
+def parse_export(*,
+                 outfile:['o', str]=None,
+                 table:['t', types_of_exports]=None,
+                 set_id:['s', int]=None,
+                 layout:['l', layouts]='long',
+                 delimiter:['d', str]=None,
+                 fetch_size:int=FETCH_SIZE,
+                 block_rows:int=BLOCK_ROWS,
+                ):
+    """Export data of an analysis set from OTUdb to a file.
+
+    :param outfile: path of the file to write (REQUIRED)
+    :param table: which data are you exporting?
+
+        Possible types (-t) of data to export are:
+
+        .    count:    otu count table, pct abundance per sample\n
+        .    taxa:     otu annotations (taxonomy)\n
+        .    sample:   sample metadata
+
+    :param set_id: analysis set to export (default: rows imported without a set)
+    :param layout: long (one row per value) or wide (OTU x sample, counts only)
+    :param delimiter: field delimiter (default: ',' for .csv files, else tab)
+    :param fetch_size: rows fetched from the db cursor at a time
+    :param block_rows: rows formatted per write to the file
+    """
+    if not outfile or not table:
+        log.error('    Whoops! Output file *and* table to be exported are required...')
+        return
+    export_table(outfile, table, set_id, layout, delimiter, fetch_size, block_rows)
+
+
+if __name__ == '__main__':
+    run(parse_export)
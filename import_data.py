@@ -2,14 +2,38 @@
     This module encompasses all the techniques.
 """
 import os
+import time
+import itertools
+import contextlib
+from collections import Counter
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 import attr
+import numpy as np
 from clize import run, parameters
+from peewee import JOIN, fn, SqliteDatabase
 
+from otudb.batch import BatchInserter, DEFAULT_BATCH_SIZE
+from otudb.bulk import bulk_load as bulk_load_db, set_bulk_session, real_database
+from otudb.checkpoint import Checkpoint, DEFAULT_COMMIT_ROWS
 from otudb.database import otudb, tables
-from otudb.parsers import CSVParser, FastaParser
-from otudb.utils import log_it
+from otudb.ledger import ImportLedger, file_digest
+from otudb.manifest import read_manifest, scan_directory, schedule
+from otudb.matrix_cache import bump_generation, refresh_matrix_cache
+from otudb.pipeline import Pipeline, source_rows, PIPELINE_ROWS
+from otudb.pool import retrying, pool_stats
+from otudb.parsers import CSVParser, FastaParser, TextParser
+from otudb.resolver import NameResolver, sample_resolver, otu_resolver, chunked
+from otudb.rollup import TaxonRollup, rebuild_rollups
+from otudb.search import update_search_index
+from otudb.sequences import seq_digest
+from otudb.taxonomy import LineageIndex, parse_gg_lineage, parse_rdp_lineage
+from otudb.utils import log_it, ProgressLog, ROWS
 
 log = log_it(logname='import_data')
+# per-row records are costly in the import loops; only made at log level ROWS
+log_rows = log.isEnabledFor(ROWS)
 
 otu_data_file_imports = {
     # sample_info
@@ -31,29 +55,109 @@ otu_data_file_imports = {
 }
 
 
-def sample_import(filepath):
+def read_rows(tp, checkpoint):
+    """rows of CSV parser `tp` after those committed by `checkpoint`:
+    seeking to its byte offset, or skipping rows of compressed files
+    """
+    if tp.compression:
+        return itertools.islice(tp.load_data(), checkpoint.rows, None)
+    return tp.load_data(offset=checkpoint.offset or 0)
+
+
+def commit_checkpoint(txn, checkpoint, rows, offset, *batches, rollup=None, **state):
+    """write out the buffered `batches`, add them to the taxon `rollup`,
+    commit and record the checkpoint
+    """
+    for batch in batches:
+        batch.flush()
+    if rollup is not None:
+        rollup.update()
+    txn.commit()
+    checkpoint.save(rows, offset, **state)
+
+
+def delete_rows(id_field, ids):
+    """delete the rows of id_field's table with these ids, a chunk at a time"""
+    for chunk in chunked(ids):
+        id_field.model.delete().where(id_field.in_(chunk)).execute()
+    return len(ids)
+
+
+def log_changes(filepath, changes):
+    """log the Counter of added/changed/deleted/unchanged rows of a diff"""
+    log.info('Applied changes of %s: %s added, %s changed, %s deleted, %s unchanged',
+             filepath, changes['added'], changes['changed'], changes['deleted'],
+             changes['unchanged'])
+    return changes['added'] + changes['changed'] + changes['deleted']
+
+
+sample_fields = ('sample_name', 'sample_type', 'study', 'sex', 'cage', 'time')
+
+
+def sample_import(filepath, batch_size=DEFAULT_BATCH_SIZE, batch_bytes=None,
+                  commit_rows=DEFAULT_COMMIT_ROWS, resume=False, pipeline=None):
     """import sample metadata into the db"""
     log.info('Starting to import sample metadata')
     try:
         si = CSVParser(filepath, mode='r', delimiter=',')
         sample_info = tables.models.sample_info
-        with otudb.transaction():
-            row_count = 0
-            for row in si.load_data():
-                row_count+=1
-                log.info('Importing: %s',row['sample_name'])
-                res = sample_info.create(sample_name=row['sample_name'],
-                                         sample_type=row['sample_type'],
-                                         study=row['study'],
-                                         sex=row['sex'],
-                                         cage=row['cage'],
-                                         time=row['time'],
-                                        )
+        checkpoint = Checkpoint(filepath, 'sample')
+        checkpoint.begin(resume)
+        with otudb.transaction() as txn:
+            row_count = checkpoint.rows
+            progress = ProgressLog(log, f'Importing {filepath}')
+            rows = source_rows(read_rows(si, checkpoint), si, pipeline)
+            with BatchInserter(sample_info, batch_size, batch_bytes) as batch:
+                for chunk in rows.chunks(commit_rows):
+                    for row in chunk:
+                        row_count+=1
+                        progress.update()
+                        if log_rows:
+                            log.log(ROWS, 'Importing: %s',row['sample_name'])
+                        batch.add({field: row[field] for field in sample_fields})
+                    commit_checkpoint(txn, checkpoint, row_count, rows.position(), batch)
+        checkpoint.clear()
+        rows.report()
         log.info('Completed importing %s rows from: %s', row_count, filepath)
+        return batch.report()
     except Exception as e:
         log.error(f'Whoops while importing {filepath}.')
         raise e
-    pass
+
+
+def sample_diff(filepath, batch_size=DEFAULT_BATCH_SIZE, batch_bytes=None):
+    """apply a changed sample metadata file, keyed by sample_name: new
+    samples are inserted and changed fields of stored ones updated.
+    Samples no longer in the file are kept; counts may refer to them.
+    """
+    log.info('Applying changes of sample metadata')
+    try:
+        si = CSVParser(filepath, mode='r', delimiter=',')
+        sample_info = tables.models.sample_info
+        stored = {sample.sample_name: sample for sample in sample_info.select()}
+        changes = Counter()
+        with otudb.transaction():
+            with BatchInserter(sample_info, batch_size, batch_bytes) as batch:
+                for row in si.load_data():
+                    fields = {field: row[field] for field in sample_fields}
+                    old = stored.pop(fields['sample_name'], None)
+                    if old is None:
+                        batch.add(fields)
+                        changes['added'] += 1
+                    elif any(str(getattr(old, field) or '') != (fields[field] or '')
+                             for field in sample_fields):
+                        (sample_info.update(**fields)
+                                    .where(sample_info.sample_id == old.sample_id)
+                                    .execute())
+                        changes['changed'] += 1
+                    else:
+                        changes['unchanged'] += 1
+        if stored:
+            log.info('%s stored samples not in %s were kept', len(stored), filepath)
+        return log_changes(filepath, changes)
+    except Exception as e:
+        log.error(f'Whoops while applying changes of {filepath}.')
+        raise e
 
 
 def analysis_import(filepath):
@@ -63,110 +167,815 @@ def analysis_import(filepath):
     pass
 
 
-def fasta_import(filepath):
-    """import a fasta file into the db"""
+def import_seq_chunk(records, digests, set_id=None,
+                     batch_size=DEFAULT_BATCH_SIZE, batch_bytes=None):
+    """write a chunk of (otu_name, sequence) records into otu_seq, storing
+    each distinct sequence once.
+
+    `digests` resolves seq_digest -> seq_id of the rows holding a sequence.
+    An OTU whose sequence is already stored gets a row without the sequence,
+    linked to the stored row through otu_xref (method 'seq_digest').
+    Return counts of (new, reused) sequences.
+    """
+    seq_table = tables.models.otu_seq
+    last_id = seq_table.select(fn.MAX(seq_table.seq_id)).scalar() or 0
+    keyed = [(name, seq, seq_digest(seq)) for name, seq in records]
+    digests.load(digest for _, _, digest in keyed)
+
+    new_digests = set()
+    reused = {}
+    with BatchInserter(seq_table, batch_size, batch_bytes) as batch:
+        for name, seq, digest in keyed:
+            row = dict(otu_name=name, sequence=seq, seq_length=len(seq), seq_digest=digest)
+            if digest in digests or digest in new_digests:
+                reused[name] = digest
+                row.update(sequence=None, seq_digest=None)
+            else:
+                new_digests.add(digest)
+            batch.add(row)
+
+    if reused:
+        digests.load(new_digests)
+        aliases = NameResolver(seq_table, 'otu_name', 'seq_id',
+                               where=(seq_table.seq_id > last_id) &
+                                     seq_table.sequence.is_null())
+        aliases.load(reused)
+        with BatchInserter(tables.models.otu_xref, batch_size) as xrefs:
+            for name, digest in reused.items():
+                xrefs.add(dict(set_id_1=0,
+                               otu_id_1=digests[digest],
+                               set_id_2=set_id or 0,
+                               otu_id_2=aliases[name],
+                               method='seq_digest',
+                              ))
+    return len(new_digests), len(reused)
+
+
+def fasta_import(filepath, batch_size=DEFAULT_BATCH_SIZE, batch_bytes=None,
+                 set_id=None, commit_rows=DEFAULT_COMMIT_ROWS, resume=False, pipeline=None):
+    """import a fasta file into the db
+
+        Sequences are keyed by the SHA-1 of their normalized bases
+        (otu_seq.seq_digest); each distinct sequence is stored once,
+        see import_seq_chunk.
+
+        Records are committed `commit_rows` at a time; resuming skips the
+        records already committed.
+    """
     log.info('Starting to import FASTA')
     try:
         fp = FastaParser(filepath, mode='r')
         seq_table = tables.models.otu_seq
-        row_count = 0
-        # fields = [seq_table.otu_name, seq_table.sequence, seq_table.sequence]
-        with otudb.transaction():
-            for head, seq in fp.load_data():
-                row_count+=1
-                log.info('Importing: %s',head)
-                res = seq_table.create(otu_name=head,
-                                       sequence=seq,
-                                       seq_length=len(seq)
-                                      )
+        digests = NameResolver(seq_table, 'seq_digest', 'seq_id',
+                               where=seq_table.sequence.is_null(False))
+        checkpoint = Checkpoint(filepath, 'fasta')
+        checkpoint.begin(resume)
+        row_count = checkpoint.rows
+        new_count = checkpoint.state.get('new_count', 0)
+        reused_count = checkpoint.state.get('reused_count', 0)
+        with otudb.transaction() as txn:
+            records = fp.count_records(b'\n>')
+            progress = ProgressLog(log, f'Importing {filepath}',
+                                   total=records + 1 if records is not None else None)
+            remaining = itertools.islice(fp.load_data(), checkpoint.rows, None)
+            rows = source_rows(remaining, None, pipeline)
+            for commit_chunk in rows.chunks(commit_rows):
+                chunk = []
+                for head, seq in commit_chunk:
+                    row_count+=1
+                    progress.update()
+                    if log_rows:
+                        log.log(ROWS, 'Importing: %s',head)
+                    chunk.append((head, seq))
+                    if len(chunk) >= batch_size:
+                        new, reused = import_seq_chunk(chunk, digests, set_id,
+                                                       batch_size, batch_bytes)
+                        new_count += new
+                        reused_count += reused
+                        chunk = []
+                if chunk:
+                    new, reused = import_seq_chunk(chunk, digests, set_id,
+                                                   batch_size, batch_bytes)
+                    new_count += new
+                    reused_count += reused
+                commit_checkpoint(txn, checkpoint, row_count, None,
+                                  new_count=new_count, reused_count=reused_count)
+        checkpoint.clear()
+        rows.report()
         log.info('Completed importing %s rows from: %s', row_count, filepath)
+        log.info('%s new sequences stored, %s OTUs reused a stored sequence',
+                 new_count, reused_count)
+        return row_count
     except Exception as e:
         log.error(f'Whoops while importing {filepath}.')
         raise e
-    # else:
-        
 
 
-def count_table_import(filepath):
+def stored_digests(seq_table, xref):
+    """{otu_name: seq_digest} of the stored OTUs; an OTU sharing the
+    sequence of another (see import_seq_chunk) has the digest of that one
+    """
+    shared = seq_table.alias()
+    query = (seq_table.select(seq_table.otu_name,
+                              fn.COALESCE(seq_table.seq_digest, shared.seq_digest))
+                      .join(xref, JOIN.LEFT_OUTER,
+                            on=((xref.otu_id_2 == seq_table.seq_id) &
+                                (xref.method == 'seq_digest')))
+                      .join(shared, JOIN.LEFT_OUTER, on=(shared.seq_id == xref.otu_id_1)))
+    return dict(query.tuples())
+
+
+def fasta_diff(filepath, batch_size=DEFAULT_BATCH_SIZE, batch_bytes=None,
+               set_id=None):
+    """apply a changed fasta file: OTUs not stored yet are imported (see
+    import_seq_chunk), stored ones are kept as they are. Counts, xrefs and
+    other OTUs sharing a sequence refer to stored rows, so a changed
+    sequence of a stored OTU is only reported.
+    """
+    log.info('Applying changes of FASTA')
+    try:
+        fp = FastaParser(filepath, mode='r')
+        seq_table = tables.models.otu_seq
+        digests = NameResolver(seq_table, 'seq_digest', 'seq_id',
+                               where=seq_table.sequence.is_null(False))
+        stored = stored_digests(seq_table, tables.models.otu_xref)
+        changes = Counter()
+        changed_otus = []
+        with otudb.transaction():
+            chunk = []
+            for head, seq in itertools.chain(fp.load_data(), [(None, None)]):
+                if head in stored:
+                    if stored[head] and stored[head] != seq_digest(seq):
+                        changed_otus.append(head)
+                    changes['unchanged'] += 1
+                elif head is not None:
+                    chunk.append((head, seq))
+                if chunk and (len(chunk) >= batch_size or head is None):
+                    import_seq_chunk(chunk, digests, set_id, batch_size, batch_bytes)
+                    changes['added'] += len(chunk)
+                    chunk = []
+        if changed_otus:
+            log.warning('%s stored OTUs have a different sequence in %s, kept the stored one: %s',
+                        len(changed_otus), filepath, changed_otus)
+        return log_changes(filepath, changes)
+    except Exception as e:
+        log.error(f'Whoops while applying changes of {filepath}.')
+        raise e
+
+
+def parse_abundance(value):
+    """abundance cell as a float; blank cells are zero"""
+    value = value.strip() if value else ''
+    return float(value) if value else 0.0
+
+
+def count_table_samples(tp, create_samples=False, batch_size=DEFAULT_BATCH_SIZE):
+    """[(sample name, sample_id)] of the columns of count table parser `tp`.
+    Unknown samples are created if `create_samples`, else left out.
+    """
+    sample_names = tp.get_fieldnames()[1:] # first field is OTUId
+    log.info(f'{tp.filename} sample list: {sample_names}')
+
+    samples = sample_resolver(tables.models)
+    unknown = samples.load(sample_names)
+    if unknown and create_samples:
+        samples.create_missing(batch_size)
+    elif unknown:
+        log.warning('%s samples not found in sample_info table, skipping them: %s',
+                    len(unknown), unknown)
+    return [(sample, samples[sample]) for sample in sample_names
+            if sample in samples]
+
+
+def write_sample_totals(totals, nonzero, otu_count, set_id=None,
+                        batch_size=DEFAULT_BATCH_SIZE):
+    """store (replace) the otu_sample_totals of a count table's samples"""
+    with BatchInserter(tables.models.otu_sample_totals, batch_size,
+                       replace=True) as sample_totals:
+        for sample_id, total in totals.items():
+            sample_totals.add(dict(set_id=set_id or 0,
+                                   sample_id=sample_id,
+                                   total_abundance=total,
+                                   nonzero_otus=nonzero[sample_id],
+                                   total_otus=otu_count,
+                                  ))
+
+
+def table_reads(tp, otus, positions):
+    """(totals of the abundance columns at `positions` over the rows of
+    known OTUs, True if all their cells are whole numbers) of count table
+    parser `tp`, read in a pass of their own and rewound
+    """
+    totals = np.zeros(len(positions))
+    whole = True
+    for (otu_name,), abundances in tp.load_arrays(columns=positions):
+        if otus.get(otu_name) is None:
+            continue
+        totals += abundances
+        whole = whole and bool((abundances == np.rint(abundances)).all())
+    tp.rewind()
+    return totals, whole
+
+
+def count_cells(abundances, reads, whole):
+    """otu_counts fields of the cells `abundances` of a row: read counts
+    (a `whole` table) as counts and percent of their sample's `reads`,
+    relative abundances as they are
+    """
+    if not whole:
+        return [dict(percent_abundance=value) for value in abundances.tolist()]
+    percents = np.round(100.0 * abundances / np.where(reads > 0, reads, 1), 3)
+    return [dict(counts=int(value), percent_abundance=percent)
+            for value, percent in zip(abundances.tolist(), percents.tolist())]
+
+
+def read_arrays(tp, checkpoint, columns=None):
+    """(keys, values) rows (CSVParser.load_arrays) of `tp` after those
+    committed by `checkpoint`, as read_rows
+    """
+    if tp.compression:
+        return itertools.islice(tp.load_arrays(columns=columns), checkpoint.rows, None)
+    return tp.load_arrays(offset=checkpoint.offset or 0, columns=columns)
+
+
+def sample_blocks(sample_ids, positions, sample_block=None):
+    """[(sample_ids, column positions)] of blocks of `sample_block` samples
+    (one block of all if None)
+    """
+    size = sample_block or len(sample_ids) or 1
+    return [(sample_ids[i:i+size], positions[i:i+size])
+            for i in range(0, len(sample_ids), size)] or [([], [])]
+
+
+def count_table_import(filepath, batch_size=DEFAULT_BATCH_SIZE, batch_bytes=None,
+                       create_samples=False, set_id=None, keep_zeros=False,
+                       commit_rows=DEFAULT_COMMIT_ROWS, resume=False, sample_block=None,
+                       pipeline=None):
     """import an OTU table of OTUid and Sample Name(s)
-        as a matrix of percent abundance values as a 
+        as a matrix of read counts or percent abundance values as a 
         csv file into the db
+
+        Sample names (column headers) and OTU names are resolved to
+        sample_info.sample_id and otu_seq.seq_id before the rows are read.
+        Unknown samples are created if `create_samples`, else their columns
+        are skipped; rows of OTUs not in otu_seq are skipped.
+
+        A table of whole numbers holds read counts: they are stored as
+        counts, with percent_abundance their percentage of the sample's
+        total, read in a first pass over the file. Other tables hold
+        relative abundances, stored as percent_abundance only.
+
+        Only non-zero cells are stored unless `keep_zeros`. The total
+        abundance and OTU counts of each sample are stored in
+        otu_sample_totals so the dense matrix can be rebuilt exactly.
+
+        Rows are read as arrays of abundances (CSVParser.load_arrays). Wide
+        tables can be imported `sample_block` sample columns at a time, one
+        pass over the file per block, keeping running totals of only those.
+
+        Rows are committed `commit_rows` at a time, each commit saving a
+        checkpoint; with `resume` the import carries on from the last one.
+        With a `pipeline` (otudb.pipeline.Pipeline), rows are parsed by a
+        thread of their own while the rows before them are written.
     """
     log.info('Starting to import OTU count table')
     try:
         tp = CSVParser(filepath, mode='r', delimiter='\t')
         counts = tables.models.otu_counts
-        sample_info = tables.models.sample_info
-        sample_names = tp.get_fieldnames()[1:] # first field is OTUId
-        log.info(f'{tp.filename} sample list: {sample_names}')
-        with otudb.transaction():
-            row_count = 0
-            for row in tp.load_data():
-                row_count+=1
-                log.info('Importing: %s',row['OTUId'])
-                sample_id = 0 #TODO implement sample_info imports for relationship
-                for sample in sample_names:
-                    # sample_id = sample_info.get('sample_name' == sample).sample_id
-                    sample_id += 1
-                    if sample_id:
-                        log.info('Importing: %s of %s with %s%%',row['OTUId'],sample,row[sample])
-                        res = counts.create(otu_id=row['OTUId'],
-                                            sample_id=sample_id,
-                                            percent_abundance=row[sample]
-                                            )
-                    else:
-                        log.info('"%s" not found in sample_info table.',sample)
+        sample_ids = count_table_samples(tp, create_samples, batch_size)
+        # positions of the known samples among the abundance columns
+        positions = [i - 1 for i in tp.column_index([sample for sample, _ in sample_ids])]
+        blocks = sample_blocks(sample_ids, positions, sample_block)
+        otus = otu_resolver(tables.models)
+        otus.load()
+
+        set_fields = {} if set_id is None else {'set_id': set_id}
+        checkpoint = Checkpoint(filepath, 'count')
+        checkpoint.begin(resume)
+        first_block = checkpoint.state.get('block', 0)
+        lines = tp.count_records()
+        zero_count = 0
+        rollup = TaxonRollup(tables.models, set_id, 'otu_counts', batch_size)
+        with otudb.transaction() as txn:
+            rollup.begin()
+            with BatchInserter(counts, batch_size, batch_bytes) as batch:
+                for block in range(first_block, len(blocks)):
+                    block_samples, block_positions = blocks[block]
+                    if block > first_block:
+                        checkpoint.rows, checkpoint.offset, checkpoint.state = 0, None, {}
+                        tp.rewind()
+                    if len(blocks) > 1:
+                        log.info('Sample block %s of %s: %s samples',
+                                 block + 1, len(blocks), len(block_samples))
+                    state = checkpoint.state
+                    block_ids = np.array([sample_id for _, sample_id in block_samples],
+                                         dtype=np.int64)
+                    reads, whole = table_reads(tp, otus, block_positions)
+                    # json keys are strings
+                    totals = np.array([state.get('totals', {}).get(str(sample_id), 0.0)
+                                       for sample_id in block_ids.tolist()], dtype=np.float64)
+                    nonzero = np.array([state.get('nonzero', {}).get(str(sample_id), 0)
+                                        for sample_id in block_ids.tolist()], dtype=np.int64)
+                    row_count = checkpoint.rows
+                    otu_count = state.get('otu_count', 0)
+                    block_zeros = state.get('zero_count', 0)
+                    skipped_otus = state.get('skipped_otus', [])
+                    progress = ProgressLog(log, f'Importing {filepath}',
+                                           total=lines - 1 if lines is not None else None)
+                    rows = source_rows(read_arrays(tp, checkpoint, block_positions), tp,
+                                       pipeline)
+                    for chunk in rows.chunks(commit_rows):
+                        for (otu_name,), abundances in chunk:
+                            row_count+=1
+                            progress.update()
+                            otu_id = otus.get(otu_name)
+                            if otu_id is None:
+                                skipped_otus.append(otu_name)
+                                continue
+                            otu_count+=1
+                            if log_rows:
+                                log.log(ROWS, 'Importing: %s',otu_name)
+                            present = abundances != 0
+                            totals += abundances
+                            nonzero += present
+                            stored = (np.arange(len(abundances)) if keep_zeros
+                                      else np.flatnonzero(present))
+                            block_zeros += len(abundances) - len(stored)
+                            cells = count_cells(abundances[stored], reads[stored], whole)
+                            for sample_id, cell in zip(block_ids[stored].tolist(), cells):
+                                if log_rows:
+                                    log.log(ROWS, 'Importing: %s of %s with %s',otu_name,sample_id,cell)
+                                batch.add(dict(set_fields,
+                                               otu_id=otu_id,
+                                               sample_id=sample_id,
+                                               **cell
+                                              ))
+                        bump_generation(tables.models, set_id)
+                        commit_checkpoint(txn, checkpoint, row_count, rows.position(), batch,
+                                          rollup=rollup, block=block,
+                                          totals=dict(zip(block_ids.tolist(), totals.tolist())),
+                                          nonzero=dict(zip(block_ids.tolist(), nonzero.tolist())),
+                                          otu_count=otu_count, zero_count=block_zeros,
+                                          skipped_otus=skipped_otus)
+                    write_sample_totals(dict(zip(block_ids.tolist(), totals.tolist())),
+                                        dict(zip(block_ids.tolist(), nonzero.tolist())),
+                                        otu_count, set_id, batch_size)
+                    zero_count += block_zeros
+                    rows.report()
+        checkpoint.clear()
+        if skipped_otus:
+            log.warning('%s OTUs not found in otu_seq table were skipped: %s',
+                        len(skipped_otus), skipped_otus)
+        if zero_count:
+            log.info('Skipped %s zero cells of %s (%.1f%% sparse)', zero_count,
+                     otu_count * len(sample_ids),
+                     100.0 * zero_count / (otu_count * len(sample_ids)))
         log.info('Completed importing %s rows from: %s', row_count, filepath)
+        return batch.report()
     except Exception as e:
         log.error(f'Whoops while importing {filepath}.')
         raise e
 
 
-def taxa_import_rdp(filepath):
-    """import a taxa annotation file into the db"""
-    log.info('Importing RDP taxonomy.')
-    fieldnames = otu_data_file_imports['otu_taxa_rdp']
+def count_table_diff(filepath, batch_size=DEFAULT_BATCH_SIZE, batch_bytes=None,
+                     create_samples=False, set_id=None, keep_zeros=False):
+    """apply a changed OTU count table as a diff of the stored cells.
+
+        Cells are keyed by (OTU, sample), within the analysis set and the
+        samples of the table: new cells are inserted, changed ones replaced
+        and stored cells no longer in the table (or now zero) deleted.
+        Unchanged cells are not written. otu_sample_totals are rewritten.
+        Read counts are stored as by count_table_import: the percentages
+        of a sample's cells change with its total.
+    """
+    log.info('Applying changes of OTU count table')
     try:
-        tp = CSVParser(filepath, mode='r', delimiter='\t', fieldnames=fieldnames)
+        tp = CSVParser(filepath, mode='r', delimiter='\t')
+        counts = tables.models.otu_counts
+        sample_ids = count_table_samples(tp, create_samples, batch_size)
+        otus = otu_resolver(tables.models)
+        otus.load()
+        positions = [i - 1 for i in tp.column_index([sample for sample, _ in sample_ids])]
+        reads, whole = table_reads(tp, otus, positions)
+
+        in_set = counts.set_id.is_null() if set_id is None else counts.set_id == set_id
+        stored = {}
+        for chunk in chunked(sample_id for _, sample_id in sample_ids):
+            query = (counts.select(counts.counts_id, counts.otu_id, counts.sample_id,
+                                   counts.counts, counts.percent_abundance)
+                           .where(in_set & counts.sample_id.in_(chunk))
+                           .tuples())
+            stored.update(((otu_id, sample_id), (counts_id, read_count, abundance))
+                          for counts_id, otu_id, sample_id, read_count, abundance in query)
+        log.info('%s stored cells of %s samples', len(stored), len(sample_ids))
+
+        set_fields = {} if set_id is None else {'set_id': set_id}
+        totals = {sample_id: 0.0 for _, sample_id in sample_ids}
+        nonzero = {sample_id: 0 for _, sample_id in sample_ids}
+        otu_count = 0
+        skipped_otus = []
+        deleted = []
+        changes = Counter()
         with otudb.transaction():
+            with BatchInserter(counts, batch_size, batch_bytes) as batch:
+                for row in tp.load_data():
+                    otu_id = otus.get(row['OTUId'])
+                    if otu_id is None:
+                        skipped_otus.append(row['OTUId'])
+                        continue
+                    otu_count+=1
+                    abundances = np.array([parse_abundance(row[sample])
+                                           for sample, _ in sample_ids])
+                    cells = count_cells(abundances, reads, whole)
+                    for (_, sample_id), abundance, cell in zip(sample_ids,
+                                                               abundances.tolist(), cells):
+                        if abundance:
+                            totals[sample_id] += abundance
+                            nonzero[sample_id] += 1
+                        store = abundance or keep_zeros
+                        old = stored.pop((otu_id, sample_id), None)
+                        if old is not None:
+                            # percent_abundance is stored with 3 decimals
+                            if (store and old[1] == cell.get('counts') and
+                                    round(float(old[2] or 0), 3) ==
+                                    round(cell['percent_abundance'], 3)):
+                                changes['unchanged'] += 1
+                                continue
+                            deleted.append(old[0])
+                            changes['changed' if store else 'deleted'] += 1
+                        elif store:
+                            changes['added'] += 1
+                        if store:
+                            batch.add(dict(set_fields,
+                                           otu_id=otu_id,
+                                           sample_id=sample_id,
+                                           **cell
+                                          ))
+            # what is left was not in the table anymore
+            changes['deleted'] += len(stored)
+            deleted.extend(counts_id for counts_id, *_ in stored.values())
+            delete_rows(counts.counts_id, deleted)
+            write_sample_totals(totals, nonzero, otu_count, set_id, batch_size)
+            rebuild_rollups(tables.models, set_id or 0, batch_size)
+            if changes['added'] or changes['changed'] or changes['deleted']:
+                bump_generation(tables.models, set_id)
+        if skipped_otus:
+            log.warning('%s OTUs not found in otu_seq table were skipped: %s',
+                        len(skipped_otus), skipped_otus)
+        return log_changes(filepath, changes)
+    except Exception as e:
+        log.error(f'Whoops while applying changes of {filepath}.')
+        raise e
+
+
+def annotation_import(tp, parse_lineage, method, batch_size=DEFAULT_BATCH_SIZE,
+                      batch_bytes=None, set_id=None, commit_rows=DEFAULT_COMMIT_ROWS,
+                      resume=False, pipeline=None):
+    """write otu_annotation rows for the rows of parser `tp`.
+
+    `parse_lineage(row)` gives each row's lineage tuple. Lineages are
+    interned into otu_lineage (one row per distinct lineage) a chunk of
+    rows at a time, and annotations refer to them by lineage_id.
+    """
+    annotations = tables.models.otu_annotation
+    lineages = LineageIndex(tables.models.otu_lineage, batch_size)
+    lineages.load()
+    otus = otu_resolver(tables.models)
+    otus.load()
+    checkpoint = Checkpoint(tp.filename, 'taxa')
+    checkpoint.begin(resume)
+
+    def add_annotations(chunk):
+        lineage_ids = lineages.resolve([lineage for _, lineage in chunk])
+        for (otu_id, _), lineage_id in zip(chunk, lineage_ids):
+            batch.add(dict(set_id=set_id or 0,
+                           otu_id=otu_id,
+                           lineage_id=lineage_id,
+                           method=method,
+                          ))
+
+    row_count = checkpoint.rows
+    skipped_otus = checkpoint.state.get('skipped_otus', [])
+    progress = ProgressLog(log, f'Importing {tp.filename}')
+    rollup = TaxonRollup(tables.models, set_id, 'otu_annotation', batch_size)
+    with otudb.transaction() as txn:
+        rollup.begin()
+        rows = source_rows(read_rows(tp, checkpoint), tp, pipeline)
+        with BatchInserter(annotations, batch_size, batch_bytes) as batch:
+            for commit_chunk in rows.chunks(commit_rows):
+                chunk = []
+                for row in commit_chunk:
+                    row_count+=1
+                    if not row['otu_name']:
+                        continue # header line
+                    progress.update()
+                    otu_id = otus.get(row['otu_name'])
+                    if otu_id is None:
+                        skipped_otus.append(row['otu_name'])
+                        continue
+                    chunk.append((otu_id, parse_lineage(row)))
+                    if len(chunk) >= batch_size:
+                        add_annotations(chunk)
+                        chunk = []
+                if chunk:
+                    add_annotations(chunk)
+                commit_checkpoint(txn, checkpoint, row_count, rows.position(), batch,
+                                  rollup=rollup, skipped_otus=skipped_otus)
+    checkpoint.clear()
+    rows.report()
+    if skipped_otus:
+        log.warning('%s OTUs not found in otu_seq table were skipped: %s',
+                    len(skipped_otus), skipped_otus)
+    log.info('Completed importing %s rows from: %s; %s distinct lineages, %s new',
+             row_count, tp.filename, len(lineages.ids), lineages.created)
+    return batch.report()
+
+
+def annotation_diff(tp, parse_lineage, method, batch_size=DEFAULT_BATCH_SIZE,
+                    batch_bytes=None, set_id=None):
+    """apply the rows of parser `tp` as a diff of the stored otu_annotation
+    rows of the same analysis set and method, keyed by OTU: new annotations
+    are inserted, changed lineages replaced and annotations of OTUs no
+    longer in the file deleted.
+    """
+    annotations = tables.models.otu_annotation
+    lineages = LineageIndex(tables.models.otu_lineage, batch_size)
+    lineages.load()
+    otus = otu_resolver(tables.models)
+    otus.load()
+    query = (annotations.select(annotations.otu_id, annotations.annot_id,
+                                annotations.lineage_id)
+                        .where((annotations.set_id == (set_id or 0)) &
+                               (annotations.method == method))
+                        .tuples())
+    stored = {otu_id: (annot_id, lineage_id) for otu_id, annot_id, lineage_id in query}
+
+    deleted = []
+    changes = Counter()
+    skipped_otus = []
+
+    def apply_annotations(chunk):
+        lineage_ids = lineages.resolve([lineage for _, lineage in chunk])
+        for (otu_id, _), lineage_id in zip(chunk, lineage_ids):
+            old = stored.pop(otu_id, None)
+            if old is not None:
+                if old[1] == lineage_id:
+                    changes['unchanged'] += 1
+                    continue
+                deleted.append(old[0])
+                changes['changed'] += 1
+            else:
+                changes['added'] += 1
+            batch.add(dict(set_id=set_id or 0,
+                           otu_id=otu_id,
+                           lineage_id=lineage_id,
+                           method=method,
+                          ))
+
+    with otudb.transaction():
+        with BatchInserter(annotations, batch_size, batch_bytes) as batch:
+            chunk = []
             for row in tp.load_data():
-                pass
+                if not row['otu_name']:
+                    continue # header line
+                otu_id = otus.get(row['otu_name'])
+                if otu_id is None:
+                    skipped_otus.append(row['otu_name'])
+                    continue
+                chunk.append((otu_id, parse_lineage(row)))
+                if len(chunk) >= batch_size:
+                    apply_annotations(chunk)
+                    chunk = []
+            if chunk:
+                apply_annotations(chunk)
+        # what is left was not in the file anymore
+        changes['deleted'] += len(stored)
+        deleted.extend(annot_id for annot_id, _ in stored.values())
+        delete_rows(annotations.annot_id, deleted)
+        rebuild_rollups(tables.models, set_id or 0, batch_size)
+    if skipped_otus:
+        log.warning('%s OTUs not found in otu_seq table were skipped: %s',
+                    len(skipped_otus), skipped_otus)
+    return log_changes(tp.filename, changes)
+
+
+def taxa_parser(filepath, method):
+    """(CSVParser, parse_lineage function) of a taxa file in `method` format"""
+    if method == 'GreenGenes':
+        fieldnames = otu_data_file_imports['otu_taxa_gg']
+        taxa_field = fieldnames[-1]
+        parse_lineage = lambda row: parse_gg_lineage(row[taxa_field] or '')
+    else:
+        fieldnames = otu_data_file_imports['otu_taxa_rdp']
+        parse_lineage = parse_rdp_lineage
+    tp = CSVParser(filepath, mode='r', delimiter='\t', fieldnames=fieldnames)
+    return tp, parse_lineage
+
+
+def taxa_format(filepath):
+    """'GreenGenes' if the first line has its rank prefixes, else 'RDP'"""
+    with TextParser(filepath, mode='r').fh as fh:
+        line = fh.readline()
+    log.info('Determing Taxa file source...')
+    return 'GreenGenes' if 'k__' in line else 'RDP'
+
+
+def taxa_import_rdp(filepath, batch_size=DEFAULT_BATCH_SIZE, batch_bytes=None,
+                    set_id=None, commit_rows=DEFAULT_COMMIT_ROWS, resume=False,
+                    pipeline=None):
+    """import a taxa annotation file into the db"""
+    log.info('Importing RDP taxonomy.')
+    try:
+        tp, parse_lineage = taxa_parser(filepath, 'RDP')
+        return annotation_import(tp, parse_lineage, 'RDP',
+                                 batch_size, batch_bytes, set_id, commit_rows, resume,
+                                 pipeline)
     except Exception as e:
         log.error(f'Whoops while importing {filepath} in RDP format.')
         raise e
 
 
-def taxa_import_gg(filepath):
+def taxa_import_gg(filepath, batch_size=DEFAULT_BATCH_SIZE, batch_bytes=None,
+                   set_id=None, commit_rows=DEFAULT_COMMIT_ROWS, resume=False,
+                   pipeline=None):
     """import a taxa annotation file into the db"""
     log.info('Importing GreenGenes taxonomy.')
-    fieldnames = otu_data_file_imports['otu_taxa_gg']
     try:
-        tp = CSVParser(filepath, mode='r', delimiter='\t', fieldnames=fieldnames)
-        with otudb.transaction():
-            for row in tp.load_data():
-                pass
+        tp, parse_lineage = taxa_parser(filepath, 'GreenGenes')
+        return annotation_import(tp, parse_lineage, 'GreenGenes', batch_size, batch_bytes, set_id,
+                                 commit_rows, resume, pipeline)
     except Exception as e:
         log.error(f'Whoops while importing {filepath} in GG format.')
         raise e
 
 
-
-def taxa_import(filepath):
+def taxa_import(filepath, batch_size=DEFAULT_BATCH_SIZE, batch_bytes=None,
+                set_id=None, commit_rows=DEFAULT_COMMIT_ROWS, resume=False, pipeline=None):
     """import a taxa annotation file into the db"""
     log.info('Starting to import taxonomy annotations.')
     try:
-        fh = open(filepath, mode='r')
-        line = fh.readline()
-        log.info('Determing Taxa file source...')
-        if 'k__' in line:
-            return taxa_import_gg(filepath)
+        if taxa_format(filepath) == 'GreenGenes':
+            return taxa_import_gg(filepath, batch_size, batch_bytes, set_id,
+                                  commit_rows, resume, pipeline)
         else:
-            return taxa_import_rdp(filepath)
+            return taxa_import_rdp(filepath, batch_size, batch_bytes, set_id,
+                                   commit_rows, resume, pipeline)
     except Exception as e:
         log.error(f'Whoops while importing {filepath}.')
         raise e
 
 
+def taxa_diff(filepath, batch_size=DEFAULT_BATCH_SIZE, batch_bytes=None,
+              set_id=None):
+    """apply a changed taxa annotation file, see annotation_diff"""
+    log.info('Applying changes of taxonomy annotations.')
+    try:
+        method = taxa_format(filepath)
+        tp, parse_lineage = taxa_parser(filepath, method)
+        return annotation_diff(tp, parse_lineage, method, batch_size, batch_bytes, set_id)
+    except Exception as e:
+        log.error(f'Whoops while applying changes of {filepath}.')
+        raise e
+
+
+def diff_file(filepath, filetype, batch_size=DEFAULT_BATCH_SIZE, batch_bytes=None,
+              create_samples=False, set_id=None, keep_zeros=False):
+    """apply the changes of a file imported before, return rows changed"""
+    batch = dict(batch_size=batch_size, batch_bytes=batch_bytes)
+    if   filetype == 'sample':   return sample_diff(filepath, **batch)
+    elif filetype == 'fasta':    return fasta_diff(filepath, **batch, set_id=set_id)
+    elif filetype == 'count':    return count_table_diff(filepath, **batch,
+                                                         create_samples=create_samples,
+                                                         set_id=set_id,
+                                                         keep_zeros=keep_zeros)
+    elif filetype == 'taxa':     return taxa_diff(filepath, **batch, set_id=set_id)
+
+
+def load_file(ledger, filepath, filetype, batch_size=DEFAULT_BATCH_SIZE, batch_bytes=None,
+              create_samples=False, set_id=None, keep_zeros=False,
+              commit_rows=DEFAULT_COMMIT_ROWS, resume=False, force=False, sample_block=None,
+              pipeline=None):
+    """import a file, or apply its changes as a diff; return rows written"""
+    previous = None
+    if not force and not (resume and Checkpoint(filepath, filetype).exists()):
+        previous = ledger.previous(filepath, filetype, set_id)
+
+    if previous is not None and filetype != 'analysis':
+        log.info('%s changed since imported on %s, applying the changes',
+                 filepath, previous.imported_at)
+        return diff_file(filepath, filetype, batch_size, batch_bytes,
+                         create_samples, set_id, keep_zeros)
+    batch = dict(batch_size=batch_size, batch_bytes=batch_bytes,
+                 commit_rows=commit_rows, resume=resume, pipeline=pipeline)
+    if   filetype == 'sample':   return sample_import(filepath, **batch)
+    elif filetype == 'analysis': return analysis_import(filepath)
+    elif filetype == 'fasta':    return fasta_import(filepath, **batch, set_id=set_id)
+    elif filetype == 'count':    return count_table_import(filepath, **batch,
+                                                           create_samples=create_samples,
+                                                           set_id=set_id,
+                                                           keep_zeros=keep_zeros,
+                                                           sample_block=sample_block)
+    elif filetype == 'taxa':     return taxa_import(filepath, **batch, set_id=set_id)
+
+
+def import_file(filepath, filetype, batch_size=DEFAULT_BATCH_SIZE, batch_bytes=None,
+                create_samples=False, set_id=None, keep_zeros=False,
+                commit_rows=DEFAULT_COMMIT_ROWS, resume=False, force=False,
+                bulk_load=False, sample_block=None, pipeline=None):
+    """import one file with the importer of its filetype, return rows written.
+
+    Imports are recorded in the import_ledger table (otudb.ledger). Unless
+    `force`, a file whose content was already imported as the same type
+    into the same set is skipped, and a changed version of a file imported
+    before is applied as a diff (see diff_file) rather than loaded again.
+
+    If the db connection is lost, the import is retried (otudb.pool.retrying)
+    from its last committed checkpoint; a diff, one transaction, is rerun.
+
+    `bulk_load` switches this connection to the bulk load settings
+    (otudb.bulk); the indexes are deferred by the caller (parse_import).
+    With a `pipeline` (otudb.pipeline.Pipeline) rows are parsed in a
+    thread of their own while the importer writes.
+
+    The cached matrix of the set (otudb.matrix_cache) is brought up to
+    date after a count table, unless bulk loading a staging db.
+    """
+    ledger = ImportLedger(tables.models.import_ledger)
+    if bulk_load:
+        set_bulk_session(otudb)
+    digest = file_digest(filepath)
+    if not force and ledger.is_imported(digest, filetype, set_id):
+        log.info('Skipping %s, already imported as %s into set %s',
+                 filepath, filetype, set_id or 0)
+        return 0
+
+    attempts = itertools.count()
+    def load():
+        # a retry carries on from what the failed attempt committed
+        retry = next(attempts) > 0
+        if retry and bulk_load:
+            set_bulk_session(otudb)
+        return load_file(ledger, filepath, filetype, batch_size, batch_bytes,
+                         create_samples, set_id, keep_zeros, commit_rows,
+                         resume or retry, force, sample_block, pipeline)
+
+    started = time.perf_counter()
+    rows = retrying(otudb, load)
+    elapsed = time.perf_counter() - started
+    if rows:
+        log.info('Imported %s rows from %s in %.2fs (%.0f rows/sec)',
+                 rows, filepath, elapsed, rows / elapsed)
+    if rows is not None:
+        ledger.record(filepath, filetype, set_id, digest, rows)
+    if filetype == 'fasta' and rows:
+        update_search_index(otudb.get_database(), tables.models)
+    if filetype == 'count' and rows is not None and not bulk_load:
+        refresh_matrix_cache(otudb.get_database(), tables.models, set_id)
+    return rows
+
+
+def import_many(entries, jobs=None, **options):
+    """import many files (ManifestEntry list) in a pool of `jobs` processes.
+
+    Files are run in stages (see otudb.manifest.import_stages): all samples,
+    analysis sets and FASTA files are imported before any count table or
+    taxa file is started. A failed file stops the later stages.
+    """
+    stages = schedule(entries)
+    if isinstance(real_database(otudb), SqliteDatabase) and jobs != 1:
+        # SQLite takes one writer at a time, the others would wait on its lock
+        log.info('SQLite db: importing one file at a time')
+        jobs = 1
+    log.info('Importing %s files in %s stages with %s processes',
+             len(entries), len(stages), jobs or os.cpu_count())
+    started = time.perf_counter()
+    total_rows = 0
+    # spawn, not fork: each worker opens its own db connection
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=context) as pool:
+        for stage in stages:
+            futures = {}
+            for entry in stage:
+                file_options = dict(options)
+                if entry.set_id is not None:
+                    file_options['set_id'] = entry.set_id
+                futures[pool.submit(import_file, entry.filepath, entry.filetype,
+                                    **file_options)] = entry
+            failed = []
+            for future in as_completed(futures):
+                entry = futures[future]
+                try:
+                    total_rows += future.result() or 0
+                except Exception as e:
+                    log.error(f'Whoops while importing {entry.filepath}: {e!s}')
+                    failed.append(entry.filepath)
+            if failed:
+                raise RuntimeError(f'{len(failed)} files failed to import: {failed}')
+    elapsed = time.perf_counter() - started
+    log.info('Imported %s rows from %s files in %.2fs (%.0f rows/sec)',
+             total_rows, len(entries), elapsed, total_rows / elapsed if elapsed else 0)
+    return total_rows
+
 
 types_of_imports = parameters.one_of(
     ('sample', "sample metadata"),
@@ -179,10 +988,25 @@ types_of_imports = parameters.one_of(
 def parse_import(*,
                  filepath:['p', str]=None,
                  filetype:['t', types_of_imports]=None,
+                 manifest:['m', str]=None,
+                 directory:['d', str]=None,
+                 jobs:['j', int]=None,
+                 batch_size:['b', int]=DEFAULT_BATCH_SIZE,
+                 batch_bytes:int=None,
+                 create_samples=False,
+                 set_id:['s', int]=None,
+                 keep_zeros=False,
+                 commit_rows:int=DEFAULT_COMMIT_ROWS,
+                 resume=False,
+                 force=False,
+                 bulk_load=False,
+                 sample_block:int=None,
+                 pipeline_depth:int=0,
+                 pipeline_rows:int=PIPELINE_ROWS,
                 ):
     """Perform imports of files into OTUdb, as indicated.
 
-    :param filepath: path to file to be imported (REQUIRED)
+    :param filepath: path to file to be imported (REQUIRED, or manifest/directory)
     :param filetype: which type of file are you importing?
         
         Possible types (-t) of files to import are:
@@ -193,15 +1017,43 @@ def parse_import(*,
         .    fasta:    otu seq fasta\n
         .    taxa:     otu annotations (taxonomy)
 
+    :param manifest: JSON or TSV list of files (filepath, filetype, set_id) to import
+    :param directory: import all files in directory, types detected per file
+    :param jobs: number of files imported in parallel (default: number of cores)
+    :param batch_size: number of rows written per INSERT statement
+    :param batch_bytes: also flush a batch once its values reach this many bytes
+    :param create_samples: add samples missing from sample_info (count tables)
+    :param set_id: analysis set the imported counts, sequences or taxa belong to
+    :param keep_zeros: also store zero abundance cells (count tables)
+    :param commit_rows: rows read from a file per commit (and checkpoint)
+    :param resume: carry on importing files from their last checkpoint
+    :param force: import files in full even if already in the import ledger
+    :param bulk_load: fast, unsafe load settings and index builds deferred to
+        the end (best for loading a staging SQLite db, see copy_db.py)
+    :param sample_block: import count tables this many sample columns at a
+        time, one pass over the file each, for very wide tables
+    :param pipeline_depth: parse rows in a thread of their own, at most this
+        many batches ahead of the db writes (0: parse and write in turn)
+    :param pipeline_rows: rows per batch handed from the parser to the writer
     """
-    if not filepath or not filetype:
+    options = dict(batch_size=batch_size, batch_bytes=batch_bytes,
+                   create_samples=create_samples, set_id=set_id,
+                   keep_zeros=keep_zeros, commit_rows=commit_rows,
+                   resume=resume, force=force, bulk_load=bulk_load,
+                   sample_block=sample_block,
+                   pipeline=Pipeline(pipeline_depth, pipeline_rows) if pipeline_depth else None)
+    if not (manifest or directory) and (not filepath or not filetype):
         log.error('    Whoops! Path *and* type of file to be imported are required...')
         return
-    elif filetype == 'sample':   return sample_import(filepath)
-    elif filetype == 'analysis': return analysis_import(filepath)
-    elif filetype == 'fasta':    return fasta_import(filepath)
-    elif filetype == 'count':    return count_table_import(filepath)
-    elif filetype == 'taxa':     return taxa_import(filepath)
+    tables.models # create/reflect the tables before their indexes are dropped
+    with (bulk_load_db(otudb) if bulk_load else contextlib.nullcontext()):
+        if manifest or directory:
+            entries = read_manifest(manifest) if manifest else scan_directory(directory)
+            import_many(entries, jobs, **options)
+        else:
+            import_file(filepath, filetype, **options)
+    log.debug('Connection pool: %s', pool_stats(otudb))
 
 
-run(parse_import)
+if __name__ == '__main__':
+    run(parse_import)
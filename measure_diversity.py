@@ -0,0 +1,58 @@
+"""Alpha diversity of the samples of an analysis set, or beta diversity
+    (distances) between them, from the stored counts (see otudb.diversity).
+"""
+import time
+
+from clize import run, parameters
+
+from otudb.database import otudb, tables
+from otudb.diversity import diversity, metrics, DIVERSITY_MEMORY
+from otudb.parsers import CSVParser
+from otudb.utils import log_it
+
+log = log_it(logname='measure_diversity')
+
+diversity_metrics = parameters.one_of(
+    ('richness', "OTUs present per sample"),
+    ('shannon', "Shannon index per sample"),
+    ('simpson', "Gini-Simpson index per sample"),
+    ('braycurtis', "Bray-Curtis distances between samples"),
+    ('jaccard', "Jaccard distances between samples"),
+    )
+
+
+def parse_diversity(*,
+                    set_id:['s', int]=None,
+                    metric:['m', diversity_metrics]=None,
+                    outfile:['o', str]=None,
+                    jobs:['j', int]=None,
+                    memory_mb:int=DIVERSITY_MEMORY // 2**20,
+                    refresh=False,
+                   ):
+    """Diversity of the samples of an analysis set.
+
+    The counts are read from the local matrix cache while no import has
+    changed them, as are metrics computed before.
+
+    :param set_id: analysis set (default: counts imported without a set)
+    :param metric: richness, shannon, simpson (per sample), braycurtis or
+        jaccard (between samples) (REQUIRED)
+    :param outfile: TSV file of the values, or the distance matrix (REQUIRED)
+    :param jobs: number of threads computing distances (default: number of cores)
+    :param memory_mb: memory the distance computations may take at once
+    :param refresh: compute the metric anew rather than use a cached result
+    """
+    if not metric or not outfile:
+        log.error('    Whoops! Metric *and* output file are required...')
+        return
+    started = time.perf_counter()
+    result = diversity(otudb.get_database(), tables.models, set_id, metric,
+                       memory_mb * 2**20, jobs, refresh)
+    out = CSVParser(outfile, mode='w', delimiter='\t')
+    with out.fh:
+        rows = out.write_rows(result.rows(), result.headers())
+    log.info('Wrote %s %s rows in %.2fs', rows, metric, time.perf_counter() - started)
+
+
+if __name__ == '__main__':
+    run(parse_diversity)
@@ -0,0 +1,112 @@
+"""Buffered bulk-insert of rows into the otu db tables"""
+
+import time
+
+import attr
+
+from .utils import log_it
+
+
+log = log_it(logname='otudb.batch')
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Classes ~~~~~
+
+@attr.s
+class BatchInserter(object):
+    """Buffer rows for a model and write them with `insert_many` in chunks.
+
+    A chunk is flushed when it holds `batch_size` rows or, if `batch_bytes`
+    is set, when the (approximate) size of its values reaches that many bytes.
+    Use as a context manager so the last partial chunk is always written:
+
+        with otudb.transaction():
+            with BatchInserter(tables.models.otu_seq) as batch:
+                batch.add({'otu_name': name, 'sequence': seq})
+
+    With `replace`, rows whose unique keys already exist overwrite them.
+    """
+    model = attr.ib(repr=False)
+    batch_size: int = attr.ib(default=DEFAULT_BATCH_SIZE)
+    batch_bytes: int = attr.ib(default=None)
+    replace: bool = attr.ib(default=False)
+    rows: list = attr.ib(init=False, default=attr.Factory(list), repr=False)
+    buffered_bytes: int = attr.ib(init=False, default=0)
+    row_count: int = attr.ib(init=False, default=0)
+    flush_count: int = attr.ib(init=False, default=0)
+    started: float = attr.ib(init=False, default=attr.Factory(time.perf_counter), repr=False)
+
+    @batch_size.validator
+    def check_batch_size(self, attribute, value):
+        if not value or value < 1:
+            raise ValueError(f'batch_size must be a positive number of rows, not {value!r}')
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+        return False
+
+
+    def add(self, row: dict):
+        """buffer one row (dict of field: value), flushing if the chunk is full"""
+        self.rows.append(row)
+        if self.batch_bytes:
+            self.buffered_bytes += sum(len(str(v)) for v in row.values())
+            if self.buffered_bytes >= self.batch_bytes:
+                return self.flush()
+        if len(self.rows) >= self.batch_size:
+            return self.flush()
+        return 0
+
+
+    def extend(self, rows):
+        """buffer many rows"""
+        for row in rows:
+            self.add(row)
+
+
+    def flush(self):
+        """write all buffered rows in one INSERT; return number written"""
+        if not self.rows:
+            return 0
+        count = len(self.rows)
+        try:
+            query = self.model.insert_many(self.rows)
+            if self.replace:
+                query = query.on_conflict_replace()
+            query.execute()
+        except Exception as e:
+            log.error(f'Whoops flushing {count} rows into {self.model._meta.table_name}.')
+            raise e
+        self.row_count += count
+        self.flush_count += 1
+        self.rows = []
+        self.buffered_bytes = 0
+        return count
+
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+    @property
+    def rate(self):
+        """rows per second written so far"""
+        elapsed = self.elapsed
+        return self.row_count / elapsed if elapsed else 0.0
+
+
+    def report(self):
+        """log a summary of rows written and throughput"""
+        log.info('Inserted %s rows into %s in %s batches, %.2fs (%.0f rows/sec)',
+                 self.row_count, self.model._meta.table_name, self.flush_count,
+                 self.elapsed, self.rate)
+        return self.row_count
@@ -0,0 +1,135 @@
+"""Database settings for bulk loading.
+
+A SQLite db runs with WAL and a larger page cache (`sqlite_pragmas`). While
+loading (`bulk_load`) it also stops syncing to disk and keeps temporary
+b-trees in memory; MySQL sessions skip unique and foreign key checks. The
+secondary indexes of the big tables are dropped for the load and built
+once at the end, which is much faster than updating them row by row.
+"""
+
+from contextlib import contextmanager
+
+from peewee import MySQLDatabase, SqliteDatabase
+
+from .utils import log_it
+
+
+log = log_it(logname='otudb.bulk')
+
+# always, for SQLite dbs (negative cache_size: KiB)
+sqlite_pragmas = (
+    ('journal_mode', 'wal'),
+    ('cache_size', -64 * 1024),
+    ('synchronous', 'normal'),
+)
+
+# while bulk loading; a crash mid-load may corrupt the db, so load a copy
+bulk_sqlite_pragmas = (
+    ('synchronous', 'off'),
+    ('cache_size', -512 * 1024),
+    ('temp_store', 'memory'),
+)
+
+bulk_mysql_session = (
+    ('unique_checks', 0),
+    ('foreign_key_checks', 0),
+)
+
+# the tables loaded row per otu (and sample); their indexes are deferred
+bulk_tables = ('otu_counts', 'otu_annotation', 'otu_xref')
+
+
+def real_database(db):
+    """the database behind a (lazy) proxy"""
+    return db.get_database() if hasattr(db, 'get_database') else db
+
+
+def set_bulk_session(db, on=True):
+    """switch the bulk load settings of the connection on (or back off)"""
+    db = real_database(db)
+    if isinstance(db, SqliteDatabase):
+        for key, value in (bulk_sqlite_pragmas if on else sqlite_pragmas):
+            db.pragma(key, value)
+    elif isinstance(db, MySQLDatabase):
+        for key, value in bulk_mysql_session:
+            db.execute_sql(f'SET SESSION {key} = {value if on else 1}')
+    log.info(f'Bulk load settings {"on" if on else "off"}')
+
+
+def quoted(db, name):
+    """identifier quoted for the db ('"name"' or `name`)"""
+    return f'{db.quote[0]}{name}{db.quote[1]}'
+
+
+def secondary_indexes(db, table_names):
+    """the non-unique indexes of the tables, those safe to drop and rebuild"""
+    indexes = []
+    for table in table_names:
+        if not db.table_exists(table):
+            continue
+        for index in db.get_indexes(table):
+            if index.unique or index.name == 'PRIMARY':
+                continue
+            if isinstance(db, SqliteDatabase) and not index.sql:
+                continue # sqlite_autoindex_*, made by constraints
+            indexes.append(index)
+    return indexes
+
+
+def create_index_sql(db, index):
+    if index.sql:
+        return index.sql
+    columns = ', '.join(quoted(db, column) for column in index.columns)
+    return (f'CREATE INDEX {quoted(db, index.name)} '
+            f'ON {quoted(db, index.table)} ({columns})')
+
+
+def drop_index_sql(db, index):
+    if isinstance(db, MySQLDatabase):
+        return f'DROP INDEX {quoted(db, index.name)} ON {quoted(db, index.table)}'
+    return f'DROP INDEX {quoted(db, index.name)}'
+
+
+@contextmanager
+def deferred_indexes(db, table_names=bulk_tables):
+    """drop the secondary indexes of the tables, rebuild them on exit.
+    Indexes that cannot be dropped (e.g. needed by a foreign key) are kept.
+    """
+    db = real_database(db)
+    dropped = []
+    for index in secondary_indexes(db, table_names):
+        try:
+            db.execute_sql(drop_index_sql(db, index))
+            dropped.append(index)
+        except Exception as e:
+            log.warning(f'Keeping index {index.name} of {index.table}: {e!s}')
+    if dropped:
+        log.info(f'Deferred indexes: {", ".join(index.name for index in dropped)}')
+    try:
+        yield dropped
+    finally:
+        for index in dropped:
+            try:
+                log.info(f'Building index {index.name} of {index.table}')
+                db.execute_sql(create_index_sql(db, index))
+            except Exception as e:
+                log.error(f'Whoops rebuilding index {index.name} of {index.table}.')
+                raise e
+
+
+@contextmanager
+def bulk_load(db, table_names=bulk_tables):
+    """bulk load settings and deferred indexes for the duration:
+
+        with bulk_load(otudb):
+            ... # imports
+    """
+    db = real_database(db)
+    set_bulk_session(db)
+    try:
+        with deferred_indexes(db, table_names):
+            yield db
+    finally:
+        set_bulk_session(db, on=False)
+        if isinstance(db, SqliteDatabase):
+            db.execute_sql('PRAGMA optimize')
@@ -0,0 +1,145 @@
+"""Checkpoints of partly imported files, so a failed import can resume
+from its last committed chunk instead of starting over.
+"""
+
+import os
+import json
+import hashlib
+
+import attr
+
+from . import db_config
+from .utils import log_it
+
+
+log = log_it(logname='otudb.checkpoint')
+
+# rows read from a file between commits (and checkpoints)
+DEFAULT_COMMIT_ROWS = 100000
+
+
+def checkpoint_dir():
+    """directory of the checkpoint files, under the configured cache_dir"""
+    return os.path.join(db_config.get_db_config()['cache_dir'], 'checkpoints')
+
+
+def file_fingerprint(filepath):
+    """(size, mtime) of filepath; a checkpoint only applies to an unchanged file"""
+    stat = os.stat(filepath)
+    return stat.st_size, stat.st_mtime
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Classes ~~~~~
+
+@attr.s
+class Checkpoint(object):
+    """Progress of importing one file, saved as JSON after each commit.
+
+    `rows` is the number of rows of the file read and committed so far,
+    `offset` the byte offset just past them (None if the file cannot be
+    seeked, e.g. compressed: resuming then skips `rows` rows instead).
+    `state` holds whatever else the importer needs to carry on (running
+    totals and such). It must be JSON serializable.
+
+        checkpoint = Checkpoint(filepath, 'count')
+        checkpoint.begin(resume)
+        ...
+        txn.commit()
+        checkpoint.save(rows, offset)
+        ...
+        checkpoint.clear()
+    """
+    filepath: str = attr.ib()
+    filetype: str = attr.ib()
+    directory: str = attr.ib(default=None, repr=False)
+    size: int = attr.ib(init=False)
+    mtime: float = attr.ib(init=False, repr=False)
+    rows: int = attr.ib(init=False, default=0)
+    offset: int = attr.ib(init=False, default=None)
+    state: dict = attr.ib(init=False, default=attr.Factory(dict), repr=False)
+
+    @size.default
+    def get_size(self):
+        return file_fingerprint(self.filepath)[0]
+
+    @mtime.default
+    def get_mtime(self):
+        return file_fingerprint(self.filepath)[1]
+
+
+    @property
+    def path(self):
+        """checkpoint file of this (absolute) filepath and filetype"""
+        key = f'{os.path.abspath(self.filepath)}\t{self.filetype}'
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory or checkpoint_dir(), f'{name}.json')
+
+
+    def begin(self, resume=False):
+        """load the checkpoint to resume from, or warn of one left over by an
+        earlier failed import (starting over imports its rows again)
+        """
+        if resume:
+            return self.load()
+        if self.exists():
+            log.warning(f'{self.filepath} has a checkpoint of an unfinished import, '
+                        'starting over; use --resume to continue it instead.')
+        return False
+
+
+    def exists(self):
+        """is there a saved checkpoint of filepath?"""
+        return os.path.exists(self.path)
+
+
+    def load(self):
+        """read the saved checkpoint, if any, of this unchanged file.
+        Return True if there was one to resume from.
+        """
+        try:
+            with open(self.path, 'r') as fh:
+                saved = json.load(fh)
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            log.warning(f'Ignoring unreadable checkpoint {self.path}: {e!s}')
+            return False
+        if (saved['size'], saved['mtime']) != (self.size, self.mtime):
+            log.warning(f'{self.filepath} changed since its checkpoint, starting over.')
+            return False
+        self.rows = saved['rows']
+        self.offset = saved['offset']
+        self.state = saved['state']
+        log.info(f'Resuming {self.filepath} after row {self.rows} (offset {self.offset})')
+        return True
+
+
+    def save(self, rows, offset=None, **state):
+        """record `rows` (and `offset`, `state`) as committed"""
+        self.rows = rows
+        self.offset = offset
+        self.state.update(state)
+        saved = dict(filepath=os.path.abspath(self.filepath), filetype=self.filetype,
+                     size=self.size, mtime=self.mtime,
+                     rows=self.rows, offset=self.offset, state=self.state)
+        path = self.path
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_file = f'{path}.{os.getpid()}'
+            with open(tmp_file, 'w') as fh:
+                json.dump(saved, fh)
+            os.replace(tmp_file, path)
+        except OSError as e:
+            log.warning(f'Cannot save checkpoint {path}: {e!s}')
+        log.debug(f'Checkpoint of {self.filepath} at row {rows} (offset {offset})')
+
+
+    def clear(self):
+        """forget the checkpoint once the file is fully imported"""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        self.rows = 0
+        self.offset = None
+        self.state = {}
@@ -2,18 +2,36 @@ from pprint import pprint
 
 import attr
 
-from playhouse.db_url import connect as db_connect
-from playhouse.reflection import Introspector
+from peewee import SqliteDatabase
 
 from munch import Munch
 
 from .utils import log_it, now
-from .db_config import db_config
+from .db_config import get_db_config, is_sqlite
+from .models import (db_proxy, create_base_tables, create_package_tables,
+                     add_package_columns)
+from .bulk import sqlite_pragmas, real_database
+from .pool import pooled_database
+from .schema_cache import CachedIntrospector
 
 log = log_it(logname='otudb.database')
 
-otudb = db_connect(db_config['url'])
-# pprint(otudb.__dict__)
+
+def connect_db():
+    """connect to the db named in db_auth.json (or OTUDB_URL), through a
+    pool of connections (otudb.pool) shared by the threads of this process
+    """
+    log.info('Connecting to the otu db')
+    config = get_db_config()
+    url = config['url']
+    if is_sqlite(url):
+        return pooled_database(url, **config['pool'], pragmas=sqlite_pragmas)
+    return pooled_database(url, **config['pool'])
+
+
+# nothing is read or connected until the db is first used
+otudb = db_proxy
+otudb.factory = connect_db
 
 db_table_names = ['sample_info',
                   'otu_seq',
@@ -22,30 +40,104 @@ db_table_names = ['sample_info',
                   'otu_counts',
                   'otu_annotation',
                   'otu_xref',
+                  'otu_sample_totals',
+                  'otu_lineage',
+                  'import_ledger',
+                  'otu_taxon_rollup',
+                  'otu_count_generation',
                  ]
 
 @attr.s(cmp=False)
 class OTUTables(object):
-    """set of table names as reflections of existing OTU tables in the database"""
+    """set of table names as reflections of existing OTU tables in the database.
+    The tables are reflected on first access of `models`.
+    """
     db = attr.ib(repr=False)
-    models: Munch = attr.ib(init=False)
+    cache_dir: str = attr.ib(default=None)
+    create_schema: bool = attr.ib(default=None)
+    _models: Munch = attr.ib(init=False, default=None, repr=False)
+    package_models: dict = attr.ib(init=False, default=attr.Factory(dict), repr=False)
 
-    def __attrs_post_init__(self):
+    @property
+    def models(self):
+        if self._models is None:
+            self.load_models()
+        return self._models
+
+    def load_models(self):
+        self.add_base_models()
+        self.add_package_models()
         self.instrospect_models()
+        self.add_package_columns()
+        self.models.update(self.package_models)
         self.column_names_to_model()
 
     def instrospect_models(self):
         try:
-            introspect = Introspector.from_database(self.db)
+            db = real_database(self.db)
+            cache_dir = self.cache_dir or get_db_config()['cache_dir']
+            introspect = CachedIntrospector.from_database(db, cache_dir=cache_dir)
             models = introspect.generate_models()
-            self.models = Munch.fromDict(models)
+            self._models = Munch.fromDict(models)
         except Exception as e:
             log.error(f'Whoops in introspect db.')
             raise
 
+    def add_base_models(self):
+        """create the base otu tables from code (otudb.models), by default
+        only in SQLite dbs; the MySQL schema is managed outside the package
+        """
+        create = self.create_schema
+        if create is None:
+            create = isinstance(real_database(self.db), SqliteDatabase)
+        if not create:
+            return
+        try:
+            create_base_tables()
+        except Exception as e:
+            log.error(f'Whoops creating base tables.')
+            raise
+
+    def add_package_models(self):
+        """create and use the code-defined package tables (otudb.models)"""
+        try:
+            self.package_models = create_package_tables()
+        except Exception as e:
+            log.error(f'Whoops creating package tables.')
+            raise
+
+    def add_package_columns(self):
+        """add the package's own columns to reflected tables (otudb.models)"""
+        try:
+            if add_package_columns(self._models):
+                log.info('Added package columns to the otu db tables.')
+        except Exception as e:
+            log.error(f'Whoops adding package columns.')
+            raise
+
+    def get_abundance_matrix(self, set_id=None, samples=None, taxa_rank=None,
+                             sparse=False, value='percent_abundance', cached=False):
+        """OTU (or taxon at taxa_rank) x sample matrix of a set as NumPy
+        arrays (otudb.matrix.AbundanceMatrix). With `cached`, the OTU x
+        sample percent abundances of all samples of the set are taken from
+        the local matrix cache (otudb.matrix_cache) while it is current.
+        """
+        from .matrix import abundance_matrix, AbundanceMatrix
+        from .matrix_cache import MatrixCache
+        try:
+            if cached and samples is None and taxa_rank is None and value == 'percent_abundance':
+                matrix = MatrixCache().matrix(real_database(self.db), self.models, set_id)
+                if sparse:
+                    return matrix
+                return AbundanceMatrix(matrix.dense(), matrix.rows, matrix.columns)
+            return abundance_matrix(real_database(self.db), self.models, set_id,
+                                    samples, taxa_rank, sparse, value)
+        except Exception as e:
+            log.error(f'Whoops getting the abundance matrix of set {set_id}.')
+            raise
+
     def column_names_to_model(self):
         for mdl in self.models:
             self.models[mdl].columns = list(self.models[mdl]._meta.columns.keys())
 
 tables = OTUTables(otudb)
-
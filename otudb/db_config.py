@@ -1,6 +1,7 @@
 import os
 import types
 import json
+from functools import lru_cache
 from inspect import currentframe, getframeinfo
 from pathlib import Path
 
@@ -8,13 +9,57 @@ this_file = getframeinfo(currentframe()).filename
 parent_dir = str(Path(this_file).resolve().parent.parent)
 
 auth_file = os.path.join(parent_dir,'db_auth.json')
-db_fp = open(auth_file, 'r')
-# types.SimpleNamespace to use "obj.atrr"
-_db = json.load(db_fp, object_hook=lambda d: types.SimpleNamespace(**d))
-
-db_config = {
-    'url':
-        f'{_db.dbtype}{_db.user}:{_db.password}@{_db.host}:{_db.port}/{_db.database}',
-    'charset': _db.charset,
-}
-# print(db_config['url'])
+
+# local caches (e.g. reflected schema) live here
+cache_dir = os.environ.get('OTUDB_CACHE_DIR',
+                           os.path.join(str(Path.home()), '.cache', 'otudb'))
+# bytes the cached count matrices (otudb.matrix_cache) may take in cache_dir
+matrix_cache_bytes = int(os.environ.get('OTUDB_MATRIX_CACHE_BYTES', 4 * 2**30))
+
+# connection pool settings db_auth.json may set (see otudb.pool)
+pool_settings = ('max_connections', 'stale_timeout', 'wait_timeout')
+
+
+def sqlite_url(path):
+    """sqlite db url of a file path (urls are returned as they are)"""
+    if '://' in path:
+        return path
+    return f'sqlite:///{os.path.abspath(os.path.expanduser(path))}'
+
+
+def is_sqlite(url):
+    return url.startswith('sqlite')
+
+
+@lru_cache(maxsize=None)
+def get_db_config(auth_file=auth_file):
+    """read the db connection settings; only done on first use.
+
+    The OTUDB_URL environment variable (a db url, or the path of a SQLite
+    file) overrides db_auth.json, as do its own `url` or `path` keys;
+    otherwise the MySQL url is built from its parts. `pool` holds the
+    connection pool settings it gives (max_connections, stale_timeout,
+    wait_timeout).
+    """
+    env_url = os.environ.get('OTUDB_URL')
+    if env_url and not os.path.exists(auth_file):
+        return {'url': sqlite_url(env_url), 'charset': None, 'cache_dir': cache_dir,
+                'pool': {}}
+
+    with open(auth_file, 'r') as db_fp:
+        # types.SimpleNamespace to use "obj.atrr"
+        _db = json.load(db_fp, object_hook=lambda d: types.SimpleNamespace(**d))
+
+    if env_url:
+        url = sqlite_url(env_url)
+    elif getattr(_db, 'url', None) or getattr(_db, 'path', None):
+        url = sqlite_url(getattr(_db, 'url', None) or _db.path)
+    else:
+        url = f'{_db.dbtype}{_db.user}:{_db.password}@{_db.host}:{_db.port}/{_db.database}'
+
+    return {
+        'url': url,
+        'charset': getattr(_db, 'charset', None),
+        'cache_dir': getattr(_db, 'cache_dir', cache_dir),
+        'pool': {key: getattr(_db, key) for key in pool_settings if hasattr(_db, key)},
+    }
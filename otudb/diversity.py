@@ -0,0 +1,313 @@
+"""Alpha and beta diversity of the samples of an analysis set.
+
+Computed with NumPy over the set's cached count matrix (otudb.matrix_cache):
+
+    richness     OTUs present in a sample
+    shannon      -sum(p * ln p) of the relative abundances p of a sample
+    simpson      1 - sum(p ** 2), the Gini-Simpson index
+    braycurtis   1 - 2 * sum(min(x, y)) / (sum(x) + sum(y)), between samples
+    jaccard      1 - shared OTUs / OTUs of either sample
+
+Alpha metrics are read off the non-zero cells of the sparse matrix. The
+pairwise distances are computed in square tiles of samples by a pool of
+`jobs` threads (the tile kernels are NumPy calls that release the GIL,
+and the threads share one copy of the matrix). Each tile densifies only
+its two blocks of samples, so the tiles in flight and their blocks stay
+within `memory` bytes; on top of that come the distance matrix itself
+and a copy of the matrix's cells in sample order. Bray-Curtis distances
+of a sparse matrix are summed from the pairs of non-zero cells of each
+OTU instead, in slabs of samples. Empty samples have diversity 0 and
+distance 0 to each other.
+
+Results are kept next to the cached matrix they were computed from, one
+per (set_id, metric), until an import moves the set's counts on.
+
+    result = diversity(db, tables.models, set_id=3, metric='braycurtis')
+    result.samples, result.values     # names, (samples x samples) ndarray
+"""
+
+import os
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import attr
+import numpy as np
+
+from .matrix_cache import MatrixCache
+from .utils import log_it
+
+
+log = log_it(logname='otudb.diversity')
+
+alpha_metrics = ('richness', 'shannon', 'simpson')
+beta_metrics = ('braycurtis', 'jaccard')
+metrics = alpha_metrics + beta_metrics
+
+# bytes the pairwise tiles in flight may take
+DIVERSITY_MEMORY = 256 * 2**20
+# bytes of the arrays built per pair of cells by shared_minima
+PAIR_BYTES = 48
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Classes ~~~~~
+
+@attr.s(cmp=False)
+class Diversity(object):
+    """`values` of a metric for each of `samples` (alpha), or between each
+    pair of them (beta, a square matrix)
+    """
+    metric: str = attr.ib()
+    samples: list = attr.ib(repr=False)
+    values = attr.ib(repr=False)
+
+    @property
+    def pairwise(self):
+        return self.metric in beta_metrics
+
+
+    def rows(self):
+        """(sample, value) rows of an alpha metric, or (sample, *distances)
+        rows of a beta one
+        """
+        if self.pairwise:
+            return ((sample, *row) for sample, row in zip(self.samples, self.values.tolist()))
+        return zip(self.samples, self.values.tolist())
+
+
+    def headers(self):
+        return ['sample_name'] + (list(self.samples) if self.pairwise else [self.metric])
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Alpha ~~~~~
+
+def present_cells(values):
+    """(column, value) arrays of the positive cells of a SparseMatrix"""
+    present = values.data > 0
+    return np.asarray(values.indices)[present], np.asarray(values.data)[present]
+
+
+def relative_cells(values):
+    """(column, relative abundance) of the positive cells: each cell over
+    the total of its sample (column)
+    """
+    columns, data = present_cells(values)
+    totals = np.bincount(columns, weights=data, minlength=values.shape[1])
+    return columns, data / totals[columns]
+
+
+def richness(values):
+    columns, _ = present_cells(values)
+    return np.bincount(columns, minlength=values.shape[1]).astype(np.float64)
+
+
+def shannon(values):
+    columns, p = relative_cells(values)
+    return -np.bincount(columns, weights=p * np.log(p), minlength=values.shape[1])
+
+
+def simpson(values):
+    columns, p = relative_cells(values)
+    squares = np.bincount(columns, weights=p * p, minlength=values.shape[1])
+    present = np.bincount(columns, minlength=values.shape[1]) > 0
+    return np.where(present, 1 - squares, 0.0)
+
+
+alpha_functions = dict(richness=richness, shannon=shannon, simpson=simpson)
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Beta ~~~~~
+
+def sample_cells(values):
+    """(pointers, OTU rows, values) of the cells of a SparseMatrix (OTUs x
+    samples) in sample order: the cells of samples i to j are those from
+    pointers[i] to pointers[j]
+    """
+    columns = np.asarray(values.indices)
+    order = np.argsort(columns, kind='stable')
+    rows = np.repeat(np.arange(values.shape[0]), np.diff(values.indptr))[order]
+    pointers = np.searchsorted(columns[order], np.arange(values.shape[1] + 1))
+    return pointers, rows, np.asarray(values.data)[order]
+
+
+def sample_block(cells, n_otus, a, dtype=np.float64):
+    """dense (samples of slice a x OTUs) array of sample_cells"""
+    pointers, rows, data = cells
+    start, stop, _ = a.indices(len(pointers) - 1)
+    first, last = pointers[start], pointers[stop]
+    block = np.zeros((stop - start, n_otus), dtype=dtype)
+    block[np.repeat(np.arange(stop - start), np.diff(pointers[start:stop + 1])),
+          rows[first:last]] = data[first:last]
+    return block
+
+
+def tile_size(n_samples, n_otus, memory=DIVERSITY_MEMORY, jobs=1, cubic=True):
+    """samples per side of a tile, so `jobs` tiles and the two (tile x OTUs)
+    blocks of samples each is computed from fit in `memory` bytes. A
+    `cubic` kernel (Bray-Curtis) makes (tile x tile x OTUs) float64
+    temporaries, others (Jaccard's float32 product) a few (tile x tile).
+    """
+    per_job = memory / max(jobs, 1)
+    otus = max(n_otus, 1)
+    if cubic:
+        # side ** 2 + 2 * side <= per_job / (8 * OTUs)
+        side = int(math.sqrt(per_job / (8 * otus) + 1) - 1)
+    else:
+        # 24 * side ** 2 + 8 * OTUs * side <= per_job
+        side = int((math.sqrt(64 * otus ** 2 + 96 * per_job) - 8 * otus) / 48)
+    return max(1, min(side, n_samples))
+
+
+def braycurtis_tile(x, y, x_totals, y_totals):
+    """Bray-Curtis distances between the samples of blocks x and y"""
+    # OTUs missing from either block add nothing to the minima
+    present = x.any(axis=0) & y.any(axis=0)
+    shared_min = np.minimum(x[:, None, present], y[None, :, present]).sum(axis=2)
+    sums = x_totals[:, None] + y_totals[None, :]
+    return 1 - np.divide(2 * shared_min, sums, out=np.ones_like(sums), where=sums > 0)
+
+
+def sparse_enough(values):
+    """True if pairing the cells of each OTU (shared_minima) takes fewer
+    steps than dense tiles: below about a quarter of the cells non-zero
+    """
+    lengths = np.diff(values.indptr).astype(np.float64)
+    n_otus, n_samples = values.shape
+    return (lengths ** 2).sum() < n_samples ** 2 * n_otus / 16
+
+
+def pair_chunks(counts, size):
+    """slices of `counts` summing to about `size` each (at least one item)"""
+    ends = np.cumsum(counts)
+    start = 0
+    while start < len(counts):
+        base = ends[start - 1] if start else 0
+        end = max(start + 1, int(np.searchsorted(ends, base + size, side='right')))
+        yield slice(start, end)
+        start = end
+
+
+def shared_minima(values, memory=DIVERSITY_MEMORY, jobs=1):
+    """(samples x samples) sums over the OTUs of min(x, y), from the pairs
+    of non-zero cells of each OTU (row) of a SparseMatrix. Each thread adds
+    up the rows of a slab of samples, in pair arrays of bounded length.
+    """
+    n_samples = values.shape[1]
+    indptr = np.asarray(values.indptr, dtype=np.int64)
+    columns = np.asarray(values.indices, dtype=np.int64)
+    data = np.asarray(values.data)
+    lengths = np.diff(indptr)
+    cell_rows = np.repeat(np.arange(len(lengths)), lengths)
+    minima = np.zeros((n_samples, n_samples))
+    # half of a thread's share for its slab sums, half for the pair arrays
+    share = memory / max(jobs, 1) / 2
+    slab = max(1, min(n_samples, int(share / (16 * n_samples))))
+    chunk_pairs = max(n_samples, int(share / PAIR_BYTES))
+
+    def fill(start):
+        end = min(start + slab, n_samples)
+        left = np.flatnonzero((columns >= start) & (columns < end))
+        counts = lengths[cell_rows[left]]
+        sums = np.zeros((end - start) * n_samples)
+        for chunk in pair_chunks(counts, chunk_pairs):
+            cells, repeats = left[chunk], counts[chunk]
+            # each left cell is paired with every cell of its OTU's row
+            offsets = indptr[cell_rows[cells]] - (np.cumsum(repeats) - repeats)
+            right = np.arange(repeats.sum()) + np.repeat(offsets, repeats)
+            keys = np.repeat((columns[cells] - start) * n_samples, repeats) + columns[right]
+            weights = np.minimum(np.repeat(data[cells], repeats), data[right])
+            sums += np.bincount(keys, weights, minlength=len(sums))
+        minima[start:end] = sums.reshape(end - start, n_samples)
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        for _ in pool.map(fill, range(0, n_samples, slab)):
+            pass
+    return minima
+
+
+def jaccard_tile(x, y, x_counts, y_counts):
+    """Jaccard distances between the samples of presence blocks x and y"""
+    shared = x @ y.T
+    union = x_counts[:, None] + y_counts[None, :] - shared
+    return 1 - np.divide(shared, union, out=np.ones_like(union), where=union > 0)
+
+
+def distance_matrix(values, metric, memory=DIVERSITY_MEMORY, jobs=None):
+    """(samples x samples) distances of a SparseMatrix (OTUs x samples),
+    computed a tile of samples at a time by `jobs` threads (default: cores),
+    each densifying the two blocks of samples of its tile
+    """
+    jobs = jobs or os.cpu_count()
+    n_samples, n_otus = values.shape[1], values.shape[0]
+    totals = np.bincount(np.asarray(values.indices), weights=values.data,
+                         minlength=n_samples)
+    if metric == 'braycurtis' and sparse_enough(values):
+        sums = totals[:, None] + totals[None, :]
+        distances = 1 - np.divide(2 * shared_minima(values, memory, jobs), sums,
+                                  out=np.ones_like(sums), where=sums > 0)
+        np.fill_diagonal(distances, 0)
+        return distances
+    cells = sample_cells(values)
+    if metric == 'braycurtis':
+        kernel, sums, dtype, cubic = braycurtis_tile, totals, np.float64, True
+    elif metric == 'jaccard':
+        pointers, rows, data = cells
+        cells = (pointers, rows, (data > 0).astype(np.float32))
+        sums = np.bincount(np.asarray(values.indices), weights=values.data > 0,
+                           minlength=n_samples)
+        kernel, dtype, cubic = jaccard_tile, np.float32, False
+    else:
+        raise ValueError(f'Unknown beta metric {metric!r}, not one of {beta_metrics}')
+
+    side = tile_size(n_samples, n_otus, memory, jobs, cubic)
+    starts = range(0, n_samples, side)
+    tiles = [(slice(i, i + side), slice(j, j + side))
+             for i in starts for j in starts if j >= i]
+    distances = np.zeros((n_samples, n_samples))
+
+    def fill(tile):
+        a, b = tile
+        x = sample_block(cells, n_otus, a, dtype)
+        y = x if a == b else sample_block(cells, n_otus, b, dtype)
+        block = kernel(x, y, sums[a], sums[b])
+        distances[a, b] = block
+        distances[b, a] = block.T
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        for _ in pool.map(fill, tiles):
+            pass
+    np.fill_diagonal(distances, 0)
+    return distances
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Sets ~~~~~
+
+def compute(values, metric, memory=DIVERSITY_MEMORY, jobs=None):
+    """values of a metric for a SparseMatrix (OTUs x samples)"""
+    if metric in alpha_functions:
+        return alpha_functions[metric](values)
+    if metric in beta_metrics:
+        return distance_matrix(values, metric, memory, jobs)
+    raise ValueError(f'Unknown metric {metric!r}, not one of {metrics}')
+
+
+def diversity(db, models, set_id=None, metric='shannon', memory=DIVERSITY_MEMORY,
+              jobs=None, refresh=False, cache=None):
+    """Diversity of a metric over the samples of a set, from the cached
+    matrix of its counts, and cached with it (computed anew if `refresh`)
+    """
+    if metric not in metrics:
+        raise ValueError(f'Unknown metric {metric!r}, not one of {metrics}')
+    cache = cache or MatrixCache()
+    matrix = cache.matrix(db, models, set_id)
+    if not refresh and matrix.version is not None:
+        values = cache.load_result(set_id, matrix.version, metric)
+        if values is not None:
+            return Diversity(metric, matrix.columns, values)
+    started = time.perf_counter()
+    values = compute(matrix.values, metric, memory, jobs)
+    log.info(f'{metric} of {len(matrix.columns)} samples of set {set_id or 0} '
+             f'in {time.perf_counter() - started:.2f}s')
+    if matrix.version is not None:
+        cache.save_result(set_id, matrix.version, metric, values)
+    return Diversity(metric, matrix.columns, values)
@@ -0,0 +1,156 @@
+"""Stream otu db tables of an analysis set out to CSV/TSV files.
+
+Query results are read through server-side (unbuffered) cursors a block
+at a time and written in blocks, so memory use does not grow with the
+size of the result.
+"""
+
+import itertools
+
+from peewee import JOIN, MySQLDatabase, fn
+
+from .utils import log_it
+
+
+log = log_it(logname='otudb.export')
+
+# rows fetched from the cursor at a time
+FETCH_SIZE = 10000
+
+lineage_columns = ('kingdom', 'phylum', 'class', 'order', 'family', 'genus', 'species')
+
+
+def server_side_cursor(db):
+    """cursor reading rows from the server as they are fetched, instead of
+    buffering the whole result in the client (pymysql's SSCursor on MySQL;
+    sqlite cursors already step through the result).
+    """
+    if isinstance(db, MySQLDatabase):
+        from pymysql.cursors import SSCursor
+        return db.connection().cursor(SSCursor)
+    return db.cursor()
+
+
+def stream_rows(db, query, fetch_size=FETCH_SIZE):
+    """yield the row tuples of a peewee `query`, fetched `fetch_size` at a
+    time from a server-side cursor
+    """
+    sql, params = query.sql()
+    cursor = server_side_cursor(db)
+    try:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        cursor.close()
+
+
+def in_set(field, set_id):
+    """where clause of the count rows of analysis set `set_id` (None: rows
+    imported without a set, whose set_id is NULL)
+    """
+    return field.is_null() if set_id is None else field == set_id
+
+
+def column(model, name):
+    """field of model by its column name ('class' is the field class_)"""
+    return model._meta.columns[name]
+
+
+def lineage_rank(models, name):
+    """expression of the rank `name` of an annotation: from its otu_lineage
+    row, or from otu_annotation for rows stored before otu_lineage
+    """
+    annotations, lineages = models.otu_annotation, models.otu_lineage
+    rank = column(lineages, name)
+    if name in annotations._meta.columns:
+        rank = fn.COALESCE(rank, column(annotations, name))
+    return rank
+
+
+def count_query(models, set_id=None):
+    """(query, headers) of the otu counts of a set in long layout"""
+    counts, seqs, samples = models.otu_counts, models.otu_seq, models.sample_info
+    query = (counts.select(counts.set_id, seqs.otu_name, samples.sample_name,
+                           counts.percent_abundance)
+                   .join(seqs, on=(counts.otu_id == seqs.seq_id))
+                   .switch(counts)
+                   .join(samples, on=(counts.sample_id == samples.sample_id))
+                   .where(in_set(counts.set_id, set_id)))
+    return query, ['set_id', 'otu_name', 'sample_name', 'percent_abundance']
+
+
+def annotation_query(models, set_id=None):
+    """(query, headers) of the otu annotations of a set with their lineages.
+    Ranks of annotations stored before otu_lineage come from otu_annotation.
+    """
+    annotations, seqs, lineages = models.otu_annotation, models.otu_seq, models.otu_lineage
+    ranks = [lineage_rank(models, name).alias(name) for name in lineage_columns]
+    query = (annotations.select(annotations.set_id, seqs.otu_name,
+                                annotations.method, *ranks)
+                        .join(seqs, on=(annotations.otu_id == seqs.seq_id))
+                        .switch(annotations)
+                        .join(lineages, JOIN.LEFT_OUTER,
+                              on=(annotations.lineage_id == lineages.lineage_id))
+                        # annotations imported without a set are stored in set 0
+                        .where(annotations.set_id == (set_id or 0)))
+    return query, ['set_id', 'otu_name', 'method', *lineage_columns]
+
+
+def sample_query(models, set_id=None):
+    """(query, headers) of the sample_info rows of the samples counted in a set"""
+    samples, counts = models.sample_info, models.otu_counts
+    fields = list(samples._meta.sorted_fields)
+    in_counts = (counts.select(counts.sample_id).distinct()
+                       .where(in_set(counts.set_id, set_id)))
+    query = samples.select(*fields).where(samples.sample_id.in_(in_counts))
+    return query, [field.column_name for field in fields]
+
+
+export_queries = {
+    'count': count_query,
+    'taxa': annotation_query,
+    'sample': sample_query,
+}
+
+
+def export_long(db, models, table, set_id=None, fetch_size=FETCH_SIZE):
+    """(headers, row iterator) of `table` ('count', 'taxa', 'sample') of a set"""
+    query, headers = export_queries[table](models, set_id)
+    return headers, stream_rows(db, query, fetch_size)
+
+
+def export_wide(db, models, set_id=None, fetch_size=FETCH_SIZE):
+    """(headers, row iterator) of the otu counts of a set as an OTU x sample
+    matrix, zeros filled in. Counts are streamed in otu order, so only one
+    OTU's row is held at a time.
+    """
+    counts, seqs, samples = models.otu_counts, models.otu_seq, models.sample_info
+    sample_query = (samples.select(samples.sample_id, samples.sample_name)
+                           .where(samples.sample_id.in_(
+                               counts.select(counts.sample_id).distinct()
+                                     .where(in_set(counts.set_id, set_id))))
+                           .order_by(samples.sample_id)
+                           .tuples())
+    sample_ids, sample_names = zip(*sample_query) if sample_query.exists() else ((), ())
+    positions = {sample_id: i for i, sample_id in enumerate(sample_ids)}
+    log.info('Exporting counts of %s samples', len(sample_ids))
+
+    query = (counts.select(counts.otu_id, seqs.otu_name, counts.sample_id,
+                           counts.percent_abundance)
+                   .join(seqs, on=(counts.otu_id == seqs.seq_id))
+                   .where(in_set(counts.set_id, set_id))
+                   .order_by(counts.otu_id))
+
+    def matrix_rows():
+        rows = stream_rows(db, query, fetch_size)
+        for (_, otu_name), cells in itertools.groupby(rows, key=lambda r: r[:2]):
+            values = [0] * len(sample_ids)
+            for _, _, sample_id, abundance in cells:
+                values[positions[sample_id]] = abundance
+            yield (otu_name, *values)
+
+    return ['OTUId', *sample_names], matrix_rows()
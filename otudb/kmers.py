@@ -0,0 +1,113 @@
+"""k-mers of OTU sequences as 2-bit packed integers, and an array-backed
+index of them.
+
+A k-mer of k <= 32 bases packs into one uint64 (A=0, C=1, G=2, T=3), so a
+k-mer is its own hash and an index is a few NumPy arrays sorted by k-mer,
+searched with `searchsorted`: no dict of Python objects per k-mer.
+k-mers with any other character (N, IUPAC codes) are left out.
+"""
+
+import attr
+import numpy as np
+
+from .utils import log_it
+
+
+log = log_it(logname='otudb.kmers')
+
+DEFAULT_K = 24
+# index every stride-th k-mer of the indexed sequences
+DEFAULT_STRIDE = 8
+
+INVALID = 255
+base_codes = np.full(256, INVALID, dtype=np.uint8)
+for code, bases in enumerate(('Aa', 'Cc', 'Gg', 'TtUu')):
+    for base in bases:
+        base_codes[ord(base)] = code
+
+
+def encode(sequence):
+    """array of the 2-bit codes of the bases of sequence (INVALID: not ACGT)"""
+    return base_codes[np.frombuffer(sequence.encode('ascii', 'replace'), dtype=np.uint8)]
+
+
+def kmer_array(sequence, k=DEFAULT_K):
+    """(k-mers, valid) of every position of sequence: uint64 packed k-mers
+    and a mask of those made only of ACGT bases
+    """
+    if not 0 < k <= 32:
+        raise ValueError(f'k must be 1..32 to pack a k-mer into 64 bits, not {k}')
+    codes = encode(sequence)
+    n = len(codes) - k + 1
+    if n < 1:
+        return np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=bool)
+    bad = np.concatenate(([0], np.cumsum(codes == INVALID)))
+    valid = (bad[k:] - bad[:-k]) == 0
+    values = np.where(codes == INVALID, 0, codes).astype(np.uint64)
+    kmers = np.zeros(n, dtype=np.uint64)
+    for j in range(k):
+        kmers <<= np.uint64(2)
+        kmers |= values[j:j+n]
+    return kmers, valid
+
+
+def kmer_set(sequence, k=DEFAULT_K):
+    """distinct valid k-mers of sequence, sorted"""
+    kmers, valid = kmer_array(sequence, k)
+    return np.unique(kmers[valid])
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Classes ~~~~~
+
+@attr.s(cmp=False)
+class KmerIndex(object):
+    """Postings of the k-mers of a list of sequences: every `stride`-th
+    k-mer of sequence `seqs[i]` at position `positions[i]`, sorted by
+    k-mer.
+
+        index = KmerIndex.build(sequences, k=24, stride=8)
+        start, end = index.lookup(kmers)  # postings of kmers[j]: start[j]:end[j]
+        index.seqs[start[0]:end[0]]
+    """
+    kmers = attr.ib(repr=False)
+    seqs = attr.ib(repr=False)
+    positions = attr.ib(repr=False)
+    k: int = attr.ib(default=DEFAULT_K)
+    stride: int = attr.ib(default=DEFAULT_STRIDE)
+
+    @classmethod
+    def build(cls, sequences, k=DEFAULT_K, stride=DEFAULT_STRIDE):
+        """index of the sequences (list of str); postings refer to them by
+        their position in the list
+        """
+        kmers, seqs, positions = [], [], []
+        for i, sequence in enumerate(sequences):
+            values, valid = kmer_array(sequence, k)
+            sampled = np.flatnonzero(valid[::stride]) * stride
+            kmers.append(values[sampled])
+            seqs.append(np.full(len(sampled), i, dtype=np.int32))
+            positions.append(sampled.astype(np.int32))
+        if not kmers:
+            return cls(np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.int32),
+                       np.zeros(0, dtype=np.int32), k, stride)
+        kmers = np.concatenate(kmers)
+        order = np.argsort(kmers, kind='stable')
+        log.info(f'Indexed {len(kmers)} {k}-mers of {len(sequences)} sequences')
+        return cls(kmers[order], np.concatenate(seqs)[order],
+                   np.concatenate(positions)[order], k, stride)
+
+
+    def __len__(self):
+        return len(self.kmers)
+
+
+    def lookup(self, kmers):
+        """(start, end) arrays: the postings of kmers[j] are start[j]:end[j]"""
+        return (np.searchsorted(self.kmers, kmers, side='left'),
+                np.searchsorted(self.kmers, kmers, side='right'))
+
+
+    def counts(self, kmers):
+        """number of postings of each of kmers"""
+        start, end = self.lookup(kmers)
+        return end - start
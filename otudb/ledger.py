@@ -0,0 +1,81 @@
+"""Ledger of imported files, so re-running an import skips unchanged files
+and applies changed ones as a diff instead of loading them twice.
+"""
+
+import os
+import hashlib
+
+import attr
+
+from .utils import log_it
+
+
+log = log_it(logname='otudb.ledger')
+
+READ_SIZE = 1 << 20
+
+
+def file_digest(filepath, chunk_size=READ_SIZE):
+    """SHA-1 hex digest of the file's bytes (as stored, i.e. compressed)"""
+    digest = hashlib.sha1()
+    with open(filepath, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def path_digest(filepath):
+    """SHA-1 hex digest of the absolute filepath"""
+    return hashlib.sha1(os.path.abspath(filepath).encode('utf-8')).hexdigest()
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Classes ~~~~~
+
+@attr.s
+class ImportLedger(object):
+    """Look up and record files in the import_ledger table.
+
+        ledger = ImportLedger(tables.models.import_ledger)
+        digest = file_digest(filepath)
+        if ledger.is_imported(digest, 'count', set_id):
+            ...  # same content already loaded: skip
+        previous = ledger.previous(filepath, 'count', set_id)
+        ...  # None: import in full, else apply the changes
+        ledger.record(filepath, 'count', set_id, digest, rows)
+
+    set_id None is stored as 0, as for otu_sample_totals.
+    """
+    model = attr.ib(repr=False)
+
+    def is_imported(self, digest, filetype, set_id=None):
+        """has a file of this content been imported as filetype into set_id?"""
+        ledger = self.model
+        query = ledger.select().where((ledger.content_digest == digest) &
+                                      (ledger.filetype == filetype) &
+                                      (ledger.set_id == (set_id or 0)))
+        return query.exists()
+
+
+    def previous(self, filepath, filetype, set_id=None):
+        """ledger row of the last import of filepath as filetype into set_id"""
+        ledger = self.model
+        return ledger.get_or_none((ledger.path_digest == path_digest(filepath)) &
+                                  (ledger.filetype == filetype) &
+                                  (ledger.set_id == (set_id or 0)))
+
+
+    def record(self, filepath, filetype, set_id, digest, row_count):
+        """record (or replace) the import of filepath"""
+        try:
+            self.model.insert(filepath=os.path.abspath(filepath),
+                              path_digest=path_digest(filepath),
+                              filetype=filetype,
+                              set_id=set_id or 0,
+                              content_digest=digest,
+                              row_count=row_count or 0,
+                             ).on_conflict_replace().execute()
+        except Exception as e:
+            log.error(f'Whoops recording {filepath} in {self.model._meta.table_name}.')
+            raise e
+        log.info(f'Recorded import of {filepath} ({filetype}, set {set_id or 0}): '
+                 f'{row_count or 0} rows, digest {digest}')
@@ -0,0 +1,135 @@
+"""Lists of files to import: read from a manifest, or found in a directory.
+
+A manifest is either JSON, a list of objects:
+
+    [{"filepath": "samples.csv", "filetype": "sample"},
+     {"filepath": "otu_table.tsv", "filetype": "count", "set_id": 2}]
+
+or a tab-delimited file with a header line of the same field names.
+Relative paths are relative to the manifest's own directory.
+"""
+
+import os
+import json
+
+import attr
+
+from .parsers import CSVParser
+from .parsers.compressed import detect_compression, open_decompressed
+from .utils import log_it
+
+
+log = log_it(logname='otudb.manifest')
+
+# files of a lower stage are imported before any file of a higher stage;
+# counts and annotations need the samples and otu_seq rows to resolve against.
+import_stages = {
+    'sample': 0,
+    'analysis': 0,
+    'fasta': 0,
+    'count': 1,
+    # after the counts: a count table and a taxa file of one set loaded at
+    # once would each miss the other's rows in the taxon rollups
+    'taxa': 2,
+}
+
+fasta_extensions = ('.fa', '.fasta', '.fna', '.fas')
+compressed_extensions = ('.gz', '.xz', '.bz2')
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Classes ~~~~~
+
+@attr.s(frozen=True)
+class ManifestEntry(object):
+    """one file to import"""
+    filepath: str = attr.ib()
+    filetype: str = attr.ib()
+    set_id: int = attr.ib(default=None, converter=attr.converters.optional(int))
+
+    @filetype.validator
+    def check_filetype(self, attribute, value):
+        if value not in import_stages:
+            raise ValueError(f'Unknown filetype "{value}" for {self.filepath}')
+
+    @property
+    def stage(self):
+        return import_stages[self.filetype]
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Functions ~~~~~
+
+def read_manifest(manifest):
+    """return list of ManifestEntry from a JSON or TSV manifest file"""
+    base_dir = os.path.dirname(os.path.abspath(manifest))
+    try:
+        if manifest.endswith('.json'):
+            with open(manifest, 'r') as fh:
+                rows = json.load(fh)
+        else:
+            rows = list(CSVParser(manifest, mode='r', delimiter='\t').load_data())
+        entries = []
+        for row in rows:
+            filepath = os.path.join(base_dir, row['filepath'])
+            set_id = row.get('set_id') or None
+            entries.append(ManifestEntry(filepath, row['filetype'], set_id))
+    except Exception as e:
+        log.error(f'Whoops reading manifest {manifest}.')
+        raise e
+    log.info('Read %s files to import from manifest %s', len(entries), manifest)
+    return entries
+
+
+def detect_filetype(filepath):
+    """guess the import type of a file from its name and first line.
+    Return None if it does not look like anything importable.
+    """
+    name = os.path.basename(filepath).lower()
+    compression = detect_compression(filepath)
+    if compression:
+        name = os.path.splitext(name)[0] if name.endswith(compressed_extensions) else name
+    if name.endswith(fasta_extensions):
+        return 'fasta'
+    try:
+        if compression:
+            fh = open_decompressed(filepath, compression, threaded=False)
+        else:
+            fh = open(filepath, 'r')
+        with fh:
+            line = fh.readline()
+    except (OSError, EOFError, UnicodeDecodeError):
+        return None
+    if line.startswith('>'):
+        return 'fasta'
+    if line.startswith('OTUId') or 'otu_table' in name:
+        return 'count'
+    if 'k__' in line or 'taxa' in name or 'taxonomy' in name:
+        return 'taxa'
+    if line.startswith('sample_name'):
+        return 'sample'
+    if line.startswith('set_name'):
+        return 'analysis'
+    return None
+
+
+def scan_directory(directory):
+    """return list of ManifestEntry for the importable files in directory"""
+    entries = []
+    for name in sorted(os.listdir(directory)):
+        filepath = os.path.join(directory, name)
+        if not os.path.isfile(filepath) or name.startswith('.'):
+            continue
+        filetype = detect_filetype(filepath)
+        if filetype:
+            log.info('Found %s file: %s', filetype, filepath)
+            entries.append(ManifestEntry(filepath, filetype))
+        else:
+            log.warning('Skipping file of unknown type: %s', filepath)
+    return entries
+
+
+def schedule(entries):
+    """group entries into stages, to be imported in order"""
+    stages = {}
+    for entry in entries:
+        stages.setdefault(entry.stage, []).append(entry)
+    return [stages[stage] for stage in sorted(stages)]
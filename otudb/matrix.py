@@ -0,0 +1,233 @@
+"""OTU x sample abundance matrices of an analysis set as NumPy arrays.
+
+The counts are read as plain tuples from one streamed query (no model
+instances) and scattered straight into a dense array, or a CSR sparse
+structure of the non-zero cells. Rows are OTUs, or taxa when summed up to
+a rank; columns are samples.
+
+    matrix = tables.get_abundance_matrix(set_id=3, taxa_rank='genus')
+    matrix.values               # (taxa x samples) ndarray
+    matrix.row_index['Bacteroides'], matrix.column_index['S1']
+"""
+
+import attr
+import numpy as np
+
+from peewee import JOIN
+
+from .export import stream_rows, lineage_rank, in_set, FETCH_SIZE
+from .resolver import chunked
+from .taxonomy import ranks
+from .utils import log_it
+
+
+log = log_it(logname='otudb.matrix')
+
+# row label of OTUs without a name at the taxa_rank
+UNCLASSIFIED = 'Unclassified'
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Classes ~~~~~
+
+@attr.s(cmp=False)
+class SparseMatrix(object):
+    """Compressed sparse row matrix: the non-zero values of row i are
+    data[indptr[i]:indptr[i+1]], in the columns indices[indptr[i]:indptr[i+1]].
+    The same layout as scipy.sparse.csr_matrix (see to_scipy).
+    """
+    data = attr.ib(repr=False)
+    indices = attr.ib(repr=False)
+    indptr = attr.ib(repr=False)
+    shape: tuple = attr.ib()
+
+    @classmethod
+    def from_coo(cls, rows, columns, values, shape):
+        """CSR of (row, column, value) cells; values of repeated cells are summed"""
+        n_rows, n_columns = shape
+        keys = rows.astype(np.int64) * n_columns + columns
+        cells, positions = np.unique(keys, return_inverse=True)
+        data = np.bincount(positions, weights=values, minlength=len(cells))
+        indptr = np.zeros(n_rows + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cells // n_columns, minlength=n_rows), out=indptr[1:])
+        return cls(data, (cells % n_columns).astype(np.int64), indptr, shape)
+
+
+    @property
+    def nnz(self):
+        return len(self.data)
+
+
+    def row(self, i):
+        """(column indices, values) of row i"""
+        start, end = self.indptr[i], self.indptr[i+1]
+        return self.indices[start:end], self.data[start:end]
+
+
+    def toarray(self):
+        """dense ndarray of the matrix"""
+        dense = np.zeros(self.shape, dtype=self.data.dtype)
+        rows = np.repeat(np.arange(self.shape[0]), np.diff(self.indptr))
+        dense[rows, self.indices] = self.data
+        return dense
+
+
+    def to_scipy(self):
+        """scipy.sparse.csr_matrix of the matrix (needs scipy)"""
+        from scipy.sparse import csr_matrix
+        return csr_matrix((self.data, self.indices, self.indptr), shape=self.shape)
+
+
+@attr.s(cmp=False)
+class AbundanceMatrix(object):
+    """`values` (dense ndarray or SparseMatrix) with the labels of its rows
+    (OTU or taxon names) and columns (sample names). `version` is that of
+    the cached matrix it was opened from (otudb.matrix_cache), if any.
+    """
+    values = attr.ib(repr=False)
+    rows: list = attr.ib(repr=False)
+    columns: list = attr.ib(repr=False)
+    version: int = attr.ib(default=None, repr=False)
+    row_index: dict = attr.ib(init=False, repr=False)
+    column_index: dict = attr.ib(init=False, repr=False)
+
+    @row_index.default
+    def index_rows(self):
+        return {label: i for i, label in enumerate(self.rows)}
+
+    @column_index.default
+    def index_columns(self):
+        return {label: i for i, label in enumerate(self.columns)}
+
+
+    @property
+    def shape(self):
+        return (len(self.rows), len(self.columns))
+
+
+    @property
+    def sparse(self):
+        return isinstance(self.values, SparseMatrix)
+
+
+    def dense(self):
+        """the values as a dense ndarray"""
+        return self.values.toarray() if self.sparse else self.values
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Queries ~~~~~
+
+def matrix_samples(models, set_id=None, samples=None):
+    """(sample ids, sample names) of the columns: the samples named (in
+    that order), or all samples counted in the set
+    """
+    counts, sample_info = models.otu_counts, models.sample_info
+    if samples is None:
+        query = (sample_info.select(sample_info.sample_id, sample_info.sample_name)
+                            .where(sample_info.sample_id.in_(
+                                counts.select(counts.sample_id).distinct()
+                                      .where(in_set(counts.set_id, set_id))))
+                            .order_by(sample_info.sample_id))
+        found = list(query.tuples())
+    else:
+        ids = {}
+        for names in chunked(samples):
+            query = (sample_info.select(sample_info.sample_name, sample_info.sample_id)
+                                .where(sample_info.sample_name.in_(names)))
+            for name, sample_id in query.tuples():
+                ids.setdefault(name, sample_id)
+        missing = [name for name in samples if name not in ids]
+        if missing:
+            log.warning(f'Samples not in sample_info: {missing}')
+        found = [(ids[name], name) for name in samples if name in ids]
+    return [sample_id for sample_id, _ in found], [name for _, name in found]
+
+
+def otu_labels(db, models, set_id=None, taxa_rank=None, fetch_size=FETCH_SIZE):
+    """{otu_id: row label}: otu names, or the names of their taxa at
+    `taxa_rank` (by the annotations of the set)
+    """
+    counts, seqs = models.otu_counts, models.otu_seq
+    if taxa_rank is None:
+        query = (seqs.select(seqs.seq_id, seqs.otu_name)
+                     .where(seqs.seq_id.in_(counts.select(counts.otu_id).distinct()
+                                                  .where(in_set(counts.set_id, set_id)))))
+        return dict(stream_rows(db, query, fetch_size))
+    if taxa_rank not in ranks:
+        raise ValueError(f'Unknown taxa_rank {taxa_rank!r}, not one of {ranks}')
+    annotations, lineages = models.otu_annotation, models.otu_lineage
+    query = (annotations.select(annotations.otu_id, lineage_rank(models, taxa_rank))
+                        .join(lineages, JOIN.LEFT_OUTER,
+                              on=(annotations.lineage_id == lineages.lineage_id))
+                        .where(annotations.set_id == (set_id or 0))
+                        # the latest annotation of an OTU wins, as in otudb.rollup
+                        .order_by(annotations.annot_id))
+    return {otu_id: taxon or UNCLASSIFIED for otu_id, taxon in stream_rows(db, query, fetch_size)}
+
+
+def read_cells(db, query, fetch_size=FETCH_SIZE):
+    """(otu ids, sample ids, values) arrays of the (otu_id, sample_id, value)
+    rows of query, converted a fetch at a time
+    """
+    otu_ids, sample_ids, values = [], [], []
+    rows = stream_rows(db, query, fetch_size)
+    while True:
+        block = [row for _, row in zip(range(fetch_size), rows)]
+        if not block:
+            break
+        otus, samples, abundances = zip(*block)
+        otu_ids.append(np.array(otus, dtype=np.int64))
+        sample_ids.append(np.array(samples, dtype=np.int64))
+        values.append(np.array([0 if v is None else v for v in abundances], dtype=np.float64))
+    if not otu_ids:
+        return (np.zeros(0, dtype=np.int64),) * 2 + (np.zeros(0),)
+    return np.concatenate(otu_ids), np.concatenate(sample_ids), np.concatenate(values)
+
+
+def abundance_matrix(db, models, set_id=None, samples=None, taxa_rank=None,
+                     sparse=False, value='percent_abundance', fetch_size=FETCH_SIZE):
+    """AbundanceMatrix of otu_counts `value` of a set: OTUs (or their taxa
+    at `taxa_rank`, summed) x samples (those named, or all in the set).
+    `sparse` returns the values as a SparseMatrix instead of an ndarray.
+    """
+    counts = models.otu_counts
+    sample_ids, sample_names = matrix_samples(models, set_id, samples)
+    labels = otu_labels(db, models, set_id, taxa_rank, fetch_size)
+
+    query = (counts.select(counts.otu_id, counts.sample_id, getattr(counts, value))
+                   .where(in_set(counts.set_id, set_id)))
+    if samples is not None:
+        query = query.where(counts.sample_id.in_(sample_ids))
+    otu_ids, cell_samples, values = read_cells(db, query, fetch_size)
+
+    # cells of samples (or OTUs) missing from sample_info (otu_seq) are left out
+    sample_ids = np.array(sample_ids, dtype=np.int64)
+    keep = np.isin(cell_samples, sample_ids)
+    if taxa_rank is None:
+        row_ids = np.array(sorted(labels), dtype=np.int64)
+        keep &= np.isin(otu_ids, row_ids)
+    otu_ids, cell_samples, values = otu_ids[keep], cell_samples[keep], values[keep]
+
+    # rows: OTUs in otu_id order, or taxa by name
+    if taxa_rank is None:
+        rows = [labels[otu_id] for otu_id in row_ids.tolist()]
+        row_of_cell = np.searchsorted(row_ids, otu_ids)
+    else:
+        distinct_otus, otu_of_cell = np.unique(otu_ids, return_inverse=True)
+        otu_taxa = [labels.get(otu_id, UNCLASSIFIED) for otu_id in distinct_otus.tolist()]
+        rows = sorted(set(otu_taxa))
+        positions = {taxon: i for i, taxon in enumerate(rows)}
+        otu_rows = np.array([positions[taxon] for taxon in otu_taxa], dtype=np.int64)
+        row_of_cell = otu_rows[otu_of_cell]
+    order = np.argsort(sample_ids)
+    column_of_cell = order[np.searchsorted(sample_ids[order], cell_samples)]
+
+    shape = (len(rows), len(sample_names))
+    if sparse:
+        matrix = SparseMatrix.from_coo(row_of_cell, column_of_cell, values, shape)
+    else:
+        matrix = np.zeros(shape)
+        np.add.at(matrix, (row_of_cell, column_of_cell), values)
+    log.info(f'Abundance matrix of set {set_id}: {shape[0]} '
+             f'{"OTUs" if taxa_rank is None else taxa_rank} x {shape[1]} samples, '
+             f'{len(values)} cells')
+    return AbundanceMatrix(matrix, rows, list(sample_names))
@@ -0,0 +1,306 @@
+"""Local columnar cache of the OTU x sample count matrices of analysis sets.
+
+Analyses read the same set's otu_counts again and again. The cache keeps
+the sparse abundance matrix of each set (otudb.matrix) as NumPy arrays
+under the cache_dir, memory mapped when opened: a 10k x 2k matrix opens
+in milliseconds, and worker processes opening it share the pages.
+
+A set's counts have a generation, its row of otu_count_generation, moved
+on in the transaction of every import or diff of the set's counts (and
+by copies of a staging db). A cached matrix of an older generation is
+stale, and read again from the db when next asked for; import_data.py
+refreshes the matrix of a set after importing its counts.
+
+The sets opened least recently are evicted once the cache takes more than
+`max_bytes` (OTUDB_MATRIX_CACHE_BYTES, default 4 GiB).
+
+    cache = MatrixCache()
+    matrix = cache.matrix(db, tables.models, set_id=3)
+    matrix.values.row(matrix.row_index['OTU_1'])
+"""
+
+import os
+import json
+import time
+import fcntl
+import hashlib
+import datetime
+from contextlib import contextmanager
+
+import attr
+import numpy as np
+
+from peewee import MySQLDatabase
+
+from . import db_config
+from .bulk import real_database
+from .matrix import AbundanceMatrix, SparseMatrix, abundance_matrix
+from .utils import log_it
+
+
+log = log_it(logname='otudb.matrix_cache')
+
+# CSR values, then the row (OTU) and column (sample) labels
+value_arrays = ('data', 'indices', 'indptr')
+label_arrays = ('rows', 'columns')
+
+
+def cache_root():
+    """directory of the matrix cache of the configured db, under cache_dir"""
+    config = db_config.get_db_config()
+    name = hashlib.sha1(config['url'].encode('utf-8')).hexdigest()[:12]
+    return os.path.join(config['cache_dir'], f'matrix_cache-{name}')
+
+
+def count_generation(models, set_id=None):
+    """current generation of the counts of a set (0 if never imported)"""
+    model = models.otu_count_generation
+    generation = (model.select(model.generation)
+                       .where(model.set_id == (set_id or 0))
+                       .scalar())
+    return generation or 0
+
+
+def bump_generation(models, set_id=None):
+    """move the generation of a set's counts on, in the caller's
+    transaction: cached copies of them are stale from its commit
+    """
+    model = models.otu_count_generation
+    update = {model.generation: model.generation + 1,
+              model.updated_at: datetime.datetime.now()}
+    if isinstance(real_database(model._meta.database), MySQLDatabase):
+        conflict = dict(update=update)
+    else:
+        conflict = dict(conflict_target=[model.set_id], update=update)
+    (model.insert(set_id=set_id or 0, generation=1)
+          .on_conflict(**conflict)
+          .execute())
+
+
+def directory_bytes(directory):
+    return sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Classes ~~~~~
+
+@attr.s(cmp=False)
+class MatrixCache(object):
+    """Cached count matrices, a directory per set in `directory`:
+
+        data, indices, indptr   values of the matrix as CSR (SparseMatrix)
+        rows, columns           OTU names and sample names
+
+    saved as <version>.<name>.npy, with meta.json naming the current
+    version and the generation of the counts it holds, so readers never
+    see a half written matrix. Opening a set touches its meta.json, whose
+    mtime orders the sets for eviction.
+    """
+    directory: str = attr.ib(default=None)
+    max_bytes: int = attr.ib(default=attr.Factory(lambda: db_config.matrix_cache_bytes))
+
+    def __attrs_post_init__(self):
+        if self.directory is None:
+            self.directory = cache_root()
+
+
+    def set_dir(self, set_id=None):
+        return os.path.join(self.directory, f'set-{set_id or 0}')
+
+
+    def meta_file(self, set_id=None):
+        return os.path.join(self.set_dir(set_id), 'meta.json')
+
+
+    def array_file(self, set_id, version, name):
+        return os.path.join(self.set_dir(set_id), f'{version}.{name}.npy')
+
+
+    def meta(self, set_id=None):
+        """meta.json of the cached matrix of a set; None if not cached"""
+        try:
+            with open(self.meta_file(set_id), 'r') as fh:
+                return json.load(fh)
+        except FileNotFoundError:
+            return None
+
+
+    @contextmanager
+    def locked(self, set_id=None):
+        """exclusive lock of a set's directory while it is written"""
+        os.makedirs(self.set_dir(set_id), exist_ok=True)
+        with open(os.path.join(self.set_dir(set_id), 'lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+    def open(self, set_id=None, generation=None):
+        """memory mapped AbundanceMatrix (sparse) of a set; None if it is
+        not cached, or cached for another `generation` of its counts
+        """
+        meta = self.meta(set_id)
+        if meta is None or (generation is not None and meta['generation'] != generation):
+            return None
+        version = meta['version']
+        try:
+            arrays = {name: np.load(self.array_file(set_id, version, name), mmap_mode='r')
+                      for name in value_arrays + label_arrays}
+            os.utime(self.meta_file(set_id))
+        except FileNotFoundError:
+            # evicted or replaced while being opened
+            return None
+        values = SparseMatrix(arrays['data'], arrays['indices'], arrays['indptr'],
+                              tuple(meta['shape']))
+        return AbundanceMatrix(values, arrays['rows'].tolist(), arrays['columns'].tolist(),
+                               version)
+
+
+    def write(self, set_id, generation, matrix):
+        """save the sparse AbundanceMatrix of a set's counts of `generation`
+        as its next version; return False if a newer one is cached
+        """
+        with self.locked(set_id):
+            previous = self.meta(set_id)
+            if previous is not None and previous['generation'] > generation:
+                return False
+            version = previous['version'] + 1 if previous else 1
+            values = matrix.values
+            # 32 bit column positions halve the size of the indices
+            indices_type = np.int32 if values.shape[1] < 2**31 else np.int64
+            arrays = dict(data=values.data,
+                          indices=np.asarray(values.indices, dtype=indices_type),
+                          indptr=values.indptr,
+                          rows=np.array([label or '' for label in matrix.rows], dtype=str),
+                          columns=np.array([label or '' for label in matrix.columns],
+                                           dtype=str))
+            for name, array in arrays.items():
+                np.save(self.array_file(set_id, version, name), array)
+            meta = dict(set_id=set_id or 0, generation=generation, version=version,
+                        shape=list(values.shape), nnz=values.nnz,
+                        bytes=sum(os.path.getsize(self.array_file(set_id, version, name))
+                                  for name in arrays),
+                        written_at=time.time())
+            meta_file = self.meta_file(set_id)
+            tmp_file = f'{meta_file}.{os.getpid()}'
+            with open(tmp_file, 'w') as fh:
+                json.dump(meta, fh)
+            os.replace(tmp_file, meta_file)
+            # readers still mapping the old files keep them until they let go
+            if previous is not None:
+                self.remove_version(set_id, previous['version'])
+        log.info(f'Cached the counts of set {set_id or 0} (generation {generation}): '
+                 f'{meta["shape"][0]} OTUs x {meta["shape"][1]} samples, '
+                 f'{meta["bytes"]} bytes')
+        self.evict(keep=set_id or 0)
+        return True
+
+
+    def remove_version(self, set_id, version):
+        """remove the arrays of a version, and results computed from it"""
+        prefix = f'{version}.'
+        for entry in os.scandir(self.set_dir(set_id)):
+            if entry.name.startswith(prefix) and entry.name.endswith('.npy'):
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+
+    def load_result(self, set_id, version, name):
+        """memory mapped array `name` computed from a version of the matrix
+        of a set (see save_result); None if there is none
+        """
+        try:
+            return np.load(self.array_file(set_id, version, f'result-{name}'), mmap_mode='r')
+        except FileNotFoundError:
+            return None
+
+
+    def save_result(self, set_id, version, name, array):
+        """keep an array computed from a version of the matrix of a set,
+        until that version is replaced or evicted; False if it already is
+        """
+        with self.locked(set_id):
+            meta = self.meta(set_id)
+            if meta is None or meta['version'] != version:
+                return False
+            result_file = self.array_file(set_id, version, f'result-{name}')
+            tmp_file = f'{result_file}.{os.getpid()}.npy'
+            np.save(tmp_file, array)
+            os.replace(tmp_file, result_file)
+        return True
+
+
+    def refresh(self, db, models, set_id=None):
+        """read the matrix of a set from the db, cache and return it"""
+        # read before the counts: a commit in between leaves the cache stale, not wrong
+        generation = count_generation(models, set_id)
+        # cached as set 0, as are the counts imported without a set
+        matrix = abundance_matrix(db, models, set_id or None, sparse=True)
+        self.write(set_id, generation, matrix)
+        return self.open(set_id) or matrix
+
+
+    def matrix(self, db, models, set_id=None, refresh=False):
+        """sparse AbundanceMatrix of a set: the cached one if it is of the
+        current generation, else read from the db (and cached)
+        """
+        if not refresh:
+            matrix = self.open(set_id, count_generation(models, set_id))
+            if matrix is not None:
+                return matrix
+        return self.refresh(db, models, set_id)
+
+
+    def usage(self):
+        """{set_id: (bytes, last opened)} of the cached sets"""
+        sets = {}
+        if not os.path.isdir(self.directory):
+            return sets
+        for entry in os.scandir(self.directory):
+            meta_file = os.path.join(entry.path, 'meta.json')
+            if entry.name.startswith('set-') and os.path.exists(meta_file):
+                sets[int(entry.name[4:])] = (directory_bytes(entry.path),
+                                             os.path.getmtime(meta_file))
+        return sets
+
+
+    def remove(self, set_id=None):
+        """drop the cached matrix of a set"""
+        with self.locked(set_id):
+            os.remove(self.meta_file(set_id))
+            for entry in os.scandir(self.set_dir(set_id)):
+                if entry.name.endswith('.npy'):
+                    os.remove(entry.path)
+
+
+    def evict(self, keep=None):
+        """remove the sets opened least recently (but `keep`) until the cache
+        takes at most max_bytes; return the set_ids removed
+        """
+        sets = self.usage()
+        total = sum(size for size, _ in sets.values())
+        evicted = []
+        for set_id, (size, _) in sorted(sets.items(), key=lambda item: item[1][1]):
+            if total <= self.max_bytes:
+                break
+            if set_id == keep:
+                continue
+            try:
+                self.remove(set_id)
+            except FileNotFoundError:
+                pass
+            total -= size
+            evicted.append(set_id)
+        if evicted:
+            log.info(f'Evicted the cached counts of sets {evicted}, '
+                     f'{total} bytes cached')
+        return evicted
+
+
+
+def refresh_matrix_cache(db, models, set_id=None):
+    """bring the cached matrix of a set up to date with its counts"""
+    return MatrixCache().matrix(db, models, set_id)
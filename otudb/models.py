@@ -0,0 +1,308 @@
+"""Tables owned by the otudb package itself.
+
+These are defined in code (not introspected) and created on demand in the
+connected database. They are bound to `db_proxy`, which `otudb.database`
+sets up to connect on first use. Columns the package adds to the reflected
+tables are listed in `package_columns`.
+
+The base otu tables (`base_models`) are defined here as well, so that a
+local (SQLite) database can be created from code. The production MySQL
+schema is managed outside the package and reflected.
+"""
+
+import datetime
+
+from peewee import (DatabaseProxy, Model, Case, CompositeKey,
+                    AutoField, IntegerField, FloatField, CharField, DateTimeField,
+                    DecimalField, TextField)
+from playhouse.migrate import SchemaMigrator, migrate
+
+from .sequences import seq_digest
+
+
+class LazyDatabaseProxy(DatabaseProxy):
+    """DatabaseProxy that initializes itself from `factory()` on first use"""
+    __slots__ = ('obj', '_callbacks', '_Model', 'factory')
+
+    def __init__(self, factory=None):
+        self.factory = factory
+        super().__init__()
+
+    def get_database(self):
+        """the proxied database, connecting it if not done yet"""
+        if self.obj is None:
+            if self.factory is None:
+                raise AttributeError('Cannot use uninitialized Proxy.')
+            self.initialize(self.factory())
+        return self.obj
+
+    def __getattr__(self, attr):
+        return getattr(self.get_database(), attr)
+
+    def __enter__(self):
+        return self.get_database().__enter__()
+
+    def __exit__(self, *exc_info):
+        return self.get_database().__exit__(*exc_info)
+
+
+db_proxy = LazyDatabaseProxy()
+
+
+class PackageModel(Model):
+    class Meta:
+        database = db_proxy
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Base tables ~~~~~
+
+class sample_info(PackageModel):
+    sample_id = AutoField()
+    sample_name = CharField(max_length=150)
+    sample_type = CharField(max_length=100, null=True)
+    study = CharField(max_length=100, null=True)
+    sex = CharField(max_length=20, null=True)
+    cage = CharField(max_length=100, null=True)
+    time = CharField(max_length=50, null=True)
+
+    class Meta:
+        table_name = 'sample_info'
+
+
+class analysis_set(PackageModel):
+    set_id = AutoField()
+    set_name = CharField(max_length=150)
+    description = CharField(max_length=1000, null=True)
+
+    class Meta:
+        table_name = 'analysis_set'
+
+
+class sample_analysis_sets(PackageModel):
+    set_id = IntegerField()
+    sample_id = IntegerField(index=True)
+
+    class Meta:
+        table_name = 'sample_analysis_sets'
+        primary_key = CompositeKey('set_id', 'sample_id')
+
+
+class otu_seq(PackageModel):
+    seq_id = AutoField()
+    otu_name = CharField(max_length=100)
+    sequence = TextField(null=True)
+    seq_length = IntegerField(null=True)
+    method = CharField(max_length=1000, null=True)
+    seq_digest = CharField(max_length=40, null=True, index=True)
+
+    class Meta:
+        table_name = 'otu_seq'
+
+
+class otu_counts(PackageModel):
+    counts_id = AutoField()
+    set_id = IntegerField(null=True)
+    otu_id = IntegerField(index=True)
+    sample_id = IntegerField(index=True)
+    counts = IntegerField(null=True)
+    percent_abundance = DecimalField(max_digits=6, decimal_places=3, null=True)
+    method = CharField(max_length=1000, null=True)
+
+    class Meta:
+        table_name = 'otu_counts'
+
+
+class otu_annotation(PackageModel):
+    annot_id = AutoField()
+    set_id = IntegerField(null=True)
+    otu_id = IntegerField(null=True, index=True)
+    phylum = CharField(max_length=100, null=True)
+    class_ = CharField(max_length=100, null=True, column_name='class')
+    order_ = CharField(max_length=100, null=True, column_name='order')
+    family = CharField(max_length=100, null=True)
+    genus = CharField(max_length=100, null=True)
+    species = CharField(max_length=100, null=True)
+    method = CharField(max_length=1000, null=True)
+    lineage_id = IntegerField(null=True, index=True)
+
+    class Meta:
+        table_name = 'otu_annotation'
+
+
+class otu_xref(PackageModel):
+    xref_id = AutoField()
+    set_id_1 = IntegerField(null=True)
+    otu_id_1 = IntegerField(null=True)
+    set_id_2 = IntegerField(null=True)
+    otu_id_2 = IntegerField(null=True)
+    method = CharField(max_length=1000, null=True)
+
+    class Meta:
+        table_name = 'otu_xref'
+
+
+base_models = [sample_info, analysis_set, sample_analysis_sets, otu_seq,
+               otu_counts, otu_annotation, otu_xref]
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Package tables ~~~~~
+
+class otu_sample_totals(PackageModel):
+    """per-sample totals of an imported count table, kept so that the sparse
+    (non-zero only) otu_counts rows can be rebuilt into the exact dense matrix.
+    set_id 0 is a table imported without an analysis set.
+    """
+    set_id = IntegerField(default=0)
+    sample_id = IntegerField()
+    total_abundance = FloatField(default=0)
+    nonzero_otus = IntegerField(default=0)
+    total_otus = IntegerField(default=0)
+
+    class Meta:
+        table_name = 'otu_sample_totals'
+        indexes = (
+            (('set_id', 'sample_id'), True),
+        )
+
+
+class otu_lineage(PackageModel):
+    """each distinct taxonomic lineage of the otu annotations, stored once.
+    otu_annotation rows refer to it by lineage_id.
+    """
+    lineage_id = AutoField()
+    lineage_digest = CharField(max_length=40, unique=True)
+    lineage = CharField(max_length=1000)
+    kingdom = CharField(max_length=100, null=True)
+    phylum = CharField(max_length=100, null=True)
+    class_ = CharField(max_length=100, null=True, column_name='class')
+    order_ = CharField(max_length=100, null=True, column_name='order')
+    family = CharField(max_length=100, null=True)
+    genus = CharField(max_length=100, null=True)
+    species = CharField(max_length=100, null=True)
+
+    class Meta:
+        table_name = 'otu_lineage'
+
+
+class import_ledger(PackageModel):
+    """each file imported: its content digest, type, target analysis set
+    and rows written. A file whose digest is already here for the same
+    type and set is not imported again (see otudb.ledger).
+    """
+    ledger_id = AutoField()
+    filepath = CharField(max_length=1000)
+    # indexed in place of filepath, too long for a MySQL index key
+    path_digest = CharField(max_length=40)
+    filetype = CharField(max_length=20)
+    set_id = IntegerField(default=0)
+    content_digest = CharField(max_length=40, index=True)
+    row_count = IntegerField(default=0)
+    imported_at = DateTimeField(default=datetime.datetime.now)
+
+    class Meta:
+        table_name = 'import_ledger'
+        indexes = (
+            (('path_digest', 'filetype', 'set_id'), True),
+        )
+
+
+class otu_taxon_rollup(PackageModel):
+    """summed abundance and number of (non-zero) OTUs of each taxon, per
+    sample, analysis set and rank: otu_counts joined to otu_annotation,
+    kept up to date by the importers (see otudb.rollup).
+    set_id 0 is counts imported without an analysis set; taxon '' is
+    OTUs unclassified at the rank.
+    """
+    set_id = IntegerField(default=0)
+    sample_id = IntegerField()
+    rank = CharField(max_length=20)
+    taxon = CharField(max_length=100, default='')
+    abundance = FloatField(default=0)
+    otu_count = IntegerField(default=0)
+
+    class Meta:
+        table_name = 'otu_taxon_rollup'
+        indexes = (
+            (('set_id', 'rank', 'taxon', 'sample_id'), True),
+        )
+
+
+class otu_count_generation(PackageModel):
+    """generation of the otu_counts of each analysis set, moved on in the
+    transaction of every import or diff changing them; local copies of the
+    counts (otudb.matrix_cache) are stale once it has moved past theirs.
+    set_id 0 is counts imported without an analysis set.
+    """
+    set_id = IntegerField(primary_key=True)
+    generation = IntegerField(default=0)
+    updated_at = DateTimeField(default=datetime.datetime.now)
+
+    class Meta:
+        table_name = 'otu_count_generation'
+
+
+package_models = [otu_sample_totals, otu_lineage, import_ledger, otu_taxon_rollup,
+                  otu_count_generation]
+
+
+def create_package_tables(models=package_models):
+    """create any package tables missing from the database"""
+    db_proxy.create_tables(models, safe=True)
+    return {m._meta.table_name: m for m in models}
+
+
+def create_base_tables(models=base_models):
+    """create any base otu tables missing from the database (local dbs)"""
+    db_proxy.create_tables(models, safe=True)
+    return {m._meta.table_name: m for m in models}
+
+
+
+def backfill_seq_digests(otu_seq, batch_size=1000):
+    """set otu_seq.seq_digest of existing rows, one UPDATE per batch"""
+    query = (otu_seq.select(otu_seq.seq_id, otu_seq.sequence)
+                    .where(otu_seq.sequence.is_null(False))
+                    .tuples())
+    digests = [(seq_id, seq_digest(sequence)) for seq_id, sequence in query]
+    for start in range(0, len(digests), batch_size):
+        chunk = digests[start:start+batch_size]
+        with db_proxy.atomic():
+            (otu_seq.update(seq_digest=Case(otu_seq.seq_id, chunk))
+                    .where(otu_seq.seq_id.in_([seq_id for seq_id, _ in chunk]))
+                    .execute())
+    return len(digests)
+
+
+# columns added to reflected tables: {table: [(column, field, backfill function)]}
+package_columns = {
+    'otu_seq': [
+        ('seq_digest', CharField(max_length=40, null=True, index=True),
+         backfill_seq_digests),
+    ],
+    'otu_annotation': [
+        ('lineage_id', IntegerField(null=True, index=True), None),
+    ],
+}
+
+
+def add_package_columns(models, batch_size=1000):
+    """add any package columns missing from the reflected `models`, and fill
+    them in for existing rows. Return True if the schema was changed.
+    """
+    db = db_proxy.get_database()
+    migrator = SchemaMigrator.from_database(db)
+    changed = False
+    for table, columns in package_columns.items():
+        model = models.get(table)
+        if model is None:
+            continue
+        for column, field, backfill in columns:
+            if column in model._meta.columns:
+                continue
+            with db.atomic():
+                migrate(migrator.add_column(table, column, field))
+            model._meta.add_field(column, field.clone())
+            if backfill:
+                backfill(model, batch_size)
+            changed = True
+    return changed
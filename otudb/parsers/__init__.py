@@ -1,5 +1,6 @@
 from .csv import CSVParser
 from .fasta import FastaParser
+from .fasta_index import IndexedFasta
 from .text import TextParser
 
-__all__ = ['CSVParser', 'FastaParser', 'TextParser']
+__all__ = ['CSVParser', 'FastaParser', 'IndexedFasta', 'TextParser']
@@ -0,0 +1,201 @@
+import io
+import bz2
+import gzip
+import lzma
+import queue
+import itertools
+import threading
+
+from ..utils import log_it
+
+
+log = log_it(logname='parser.compressed')
+
+# leading bytes of each supported compression format
+magic_numbers = {
+    'gzip': b'\x1f\x8b',
+    'xz': b'\xfd7zXZ\x00',
+    'bz2': b'BZh',
+}
+
+openers = {
+    'gzip': gzip.open,
+    'xz': lzma.open,
+    'bz2': bz2.open,
+}
+
+READ_SIZE = 1 << 20
+
+
+def detect_compression(filename):
+    """name of the compression format of filename by its magic bytes, or None"""
+    try:
+        with open(filename, 'rb') as fh:
+            lead = fh.read(8)
+    except OSError:
+        return None
+    for compression, magic in magic_numbers.items():
+        if lead.startswith(magic):
+            return compression
+    return None
+
+
+def open_decompressed(filename, compression, newline=None, threaded=True,
+                      encoding='utf-8'):
+    """text stream of the decompressed contents of filename.
+    If `threaded`, inflating runs in a background thread (the codecs release
+    the GIL), overlapping with the parsing done by the reading thread.
+    """
+    raw = openers[compression](filename, 'rb')
+    if threaded:
+        raw = io.BufferedReader(ThreadedReader(raw), buffer_size=READ_SIZE)
+    text = io.TextIOWrapper(raw, encoding=encoding, newline=newline)
+    return RewindableText(text, name=filename)
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Classes ~~~~~
+
+class ThreadedReader(io.RawIOBase):
+    """Raw binary stream whose data is read from `source` by a background
+    thread, a few chunks ahead of the consumer (bounded by `depth`).
+    """
+
+    def __init__(self, source, chunk_size=READ_SIZE, depth=4):
+        super().__init__()
+        self.source = source
+        self.chunk_size = chunk_size
+        self.chunks = queue.Queue(maxsize=depth)
+        self.pending = b''
+        self.done = False
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.fill, daemon=True,
+                                       name=f'inflate {getattr(source, "name", "")}')
+        self.thread.start()
+
+    def fill(self):
+        try:
+            while not self.stopping.is_set():
+                chunk = self.source.read(self.chunk_size)
+                self.put(chunk)
+                if not chunk:
+                    break
+        except Exception as e:
+            self.put(e)
+
+    def put(self, item):
+        while not self.stopping.is_set():
+            try:
+                return self.chunks.put(item, timeout=0.1)
+            except queue.Full:
+                continue
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if not self.pending and not self.done:
+            chunk = self.chunks.get()
+            if isinstance(chunk, Exception):
+                self.done = True
+                raise chunk
+            if not chunk:
+                self.done = True
+            self.pending = chunk
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            self.stopping.set()
+            self.thread.join()
+            self.source.close()
+        super().close()
+
+
+class RewindableText(io.TextIOBase):
+    """Text stream over a non-seekable one (e.g. a decompressor) that keeps
+    its first lines (`head_size` chars, at least one line) in memory, so
+    that seek(0) works while reading has not gone past them. This is all
+    that sniffing the csv dialect and reading the header line need.
+    """
+
+    def __init__(self, stream, head_size=1 << 16, name=None):
+        super().__init__()
+        self.stream = stream
+        self.name = name
+        head = stream.read(head_size)
+        # a short read means the whole file is in `head`
+        self.complete = len(head) < head_size
+        if head and not head.endswith('\n'):
+            head += stream.readline()
+        self.head = head
+        self.pos = 0
+        self.past_head = False
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return self.complete or not self.past_head
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if offset != 0 or whence != io.SEEK_SET or not self.seekable():
+            raise io.UnsupportedOperation('can only seek to the start of the first lines')
+        self.pos = 0
+        return 0
+
+    def tell(self):
+        if not self.seekable():
+            raise io.UnsupportedOperation('position unknown past the first lines')
+        return self.pos
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            text = self.head[self.pos:]
+            self.pos = len(self.head)
+            if not self.complete:
+                self.past_head = True
+                text += self.stream.read()
+            return text
+        text = self.head[self.pos:self.pos+size]
+        self.pos += len(text)
+        if len(text) < size and not self.complete:
+            self.past_head = True
+            text += self.stream.read(size - len(text))
+        return text
+
+    def readline(self, size=-1):
+        if self.pos < len(self.head):
+            end = self.head.find('\n', self.pos) + 1 or len(self.head)
+            line = self.head[self.pos:end]
+            self.pos = end
+            return line
+        if self.complete:
+            return ''
+        self.past_head = True
+        return self.stream.readline(size)
+
+    def head_lines(self):
+        while self.pos < len(self.head):
+            yield self.readline()
+        if not self.complete:
+            self.past_head = True
+
+    def __iter__(self):
+        if self.complete:
+            return self.head_lines()
+        # the rest of the file is iterated by the wrapped stream itself
+        return itertools.chain(self.head_lines(), self.stream)
+
+    def __next__(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def close(self):
+        if not self.closed:
+            self.stream.close()
+        super().close()
@@ -1,14 +1,32 @@
+import io
 import csv
+import itertools
+from operator import itemgetter
 from collections import OrderedDict 
 
 import attr
+import numpy as np
 
 from .text import TextParser
-from ..utils import log_it, now
+from ..utils import log_it, now, ROWS
 
 
 log = log_it(logname='parser.csv')
 
+# rows formatted in memory per write() call of write_rows
+BLOCK_ROWS = 10000
+
+
+
+def parse_numbers(fields, dtype=np.float64):
+    """NumPy array of numeric fields (str), converted in one step; blank
+    fields are zero
+    """
+    try:
+        return np.array(fields, dtype=dtype)
+    except ValueError:
+        return np.array([field.strip() or 0 for field in fields], dtype=dtype)
+
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Classes ~~~~~
 
@@ -19,6 +37,7 @@ class CSVParser(TextParser):
     delimiter: str = attr.ib(default=',')
     quotechar: str = attr.ib(default='"')
     fieldnames: str = attr.ib(default=None)
+    header_read: bool = attr.ib(init=False, default=False)
 
     @dialect.default
     def get_dialect(self):
@@ -30,6 +49,7 @@ class CSVParser(TextParser):
             if self.fh.readable():
                 cr = csv.DictReader(self.fh, delimiter=self.delimiter, quotechar=self.quotechar)
                 self.fieldnames = cr.fieldnames
+                self.header_read = True
                 log.info(f'fieldnames in {self.filename} retrieved.')
                 return self.fieldnames
             else:
@@ -42,13 +62,26 @@ class CSVParser(TextParser):
             self.fh.seek(0)
 
 
-    def load_data(self):
-        """yield row dicts from csv file using DictReader"""
+    def load_data(self, offset=None):
+        """yield row dicts from csv file using DictReader.
+
+        With an `offset` (byte offset of a line start, 0 for the top) the
+        rows are read from there, line by line so position() gives the
+        offset after each row (see TextParser.lines).
+        """
         log.info(f'Loading rows from {self.filename}')
         self.dialect = self.dialect if self.dialect else self.sniff_dialect()
         try:
-            reader = csv.DictReader(self.fh,
-                                    fieldnames=self.fieldnames,
+            # starting past the header: read it first (get_fieldnames seeks
+            # back to the top, lines() then to the offset)
+            if offset and self.fieldnames is None:
+                self.get_fieldnames()
+            # fieldnames read from the file's own header: let DictReader skip
+            # it, unless starting past it
+            fieldnames = None if self.header_read and not offset else self.fieldnames
+            source = self.fh if offset is None else self.lines(offset)
+            reader = csv.DictReader(source,
+                                    fieldnames=fieldnames,
                                     dialect=self.dialect,
                                     delimiter=self.delimiter,
                                     quotechar=self.quotechar)
@@ -58,6 +91,69 @@ class CSVParser(TextParser):
             log.exception(f'Reading CSV file {self.filename}, line {reader.line_num!s}: {e!s}')
 
 
+    def column_index(self, names):
+        """positions of column `names` in the header"""
+        fieldnames = self.fieldnames or self.get_fieldnames()
+        index = {name: i for i, name in enumerate(fieldnames)}
+        try:
+            return [index[name] for name in names]
+        except KeyError as e:
+            raise KeyError(f'No column {e.args[0]!r} in {self.filename}') from None
+
+
+    def source_lines(self, offset=None):
+        """lines after the header (from `offset` if given, see load_data)"""
+        source = self.fh if offset is None else self.lines(offset)
+        if not offset:
+            next(source, None)
+        return source
+
+
+    def load_tuples(self, offset=None, columns=None):
+        """yield each row as a tuple, of all fields or only those at the
+        positions `columns` (see column_index). Much cheaper than load_data
+        for wide files: no dict per row. `offset` as for load_data.
+        """
+        log.info(f'Loading rows from {self.filename}')
+        reader = csv.reader(self.source_lines(offset), delimiter=self.delimiter,
+                            quotechar=self.quotechar)
+        project = itemgetter(*columns) if columns else tuple
+        if columns and len(columns) == 1:
+            project = lambda row, at=columns[0]: (row[at],)
+        try:
+            for row in reader:
+                yield project(row)
+        except csv.Error as e:
+            log.exception(f'Reading CSV file {self.filename}, line {reader.line_num!s}: {e!s}')
+
+
+    def load_arrays(self, offset=None, key_columns=1, columns=None, dtype=np.float64):
+        """yield (keys, values) of each row of a numeric table: `keys` the
+        tuple of its first `key_columns` fields, `values` a NumPy array of
+        the fields after them (blank ones zero), or of those at positions
+        `columns` of the numeric fields.
+
+        A line is split and its numbers converted in one step each, rather
+        than field by field; quoted lines go through the csv module.
+        `offset` as for load_data.
+        """
+        log.info(f'Loading rows from {self.filename}')
+        delimiter, quotechar = self.delimiter, self.quotechar
+        picked = None if columns is None else np.asarray(columns, dtype=np.intp)
+        for line in self.source_lines(offset):
+            line = line.rstrip('\r\n')
+            if not line:
+                continue
+            if quotechar in line:
+                fields = next(csv.reader([line], delimiter=delimiter, quotechar=quotechar))
+            else:
+                fields = line.split(delimiter)
+            values = parse_numbers(fields[key_columns:], dtype)
+            if picked is not None:
+                values = values[picked]
+            yield tuple(fields[:key_columns]), values
+
+
     def sniff_dialect(self):
         """find the line/ending type using csv.sniffer"""
         try:
@@ -95,7 +191,8 @@ class CSVParser(TextParser):
                 try:
                     for row in values:
                         if isinstance(row, dict):
-                            log.debug(row)
+                            if log.isEnabledFor(ROWS):
+                                log.log(ROWS, row)
                             writer.writerow(row)
                         else:
                             log.error(f'Row of values is *not* a "dict"!! ... {row!s}')
@@ -109,6 +206,37 @@ class CSVParser(TextParser):
         return True
 
 
+    def write_rows(self, rows, headers=None, block_rows=BLOCK_ROWS):
+        """write an iterable of value sequences (e.g. tuples from a query),
+        `headers` first if given. Rows are formatted into an in-memory block
+        of `block_rows` rows, written to the file in one call, so memory use
+        stays flat however many rows there are. Return rows written.
+        """
+        block = io.StringIO()
+        writer = csv.writer(block, delimiter=self.delimiter,
+                            quotechar=self.quotechar, lineterminator='\n')
+        if headers:
+            writer.writerow(headers)
+        rows = iter(rows)
+        row_count = 0
+        log.info(f'Writing rows to {self.filename}')
+        try:
+            while True:
+                chunk = list(itertools.islice(rows, block_rows))
+                writer.writerows(chunk)
+                if block.tell():
+                    self.fh.write(block.getvalue())
+                    block.seek(0)
+                    block.truncate()
+                if not chunk:
+                    break
+                row_count += len(chunk)
+        except Exception as e:
+            log.exception(f'Error writing CSV file {self.filename}, {e!s}')
+            raise e
+        return row_count
+
+
     def values_to_list_dicts(self, keynames=[], values=[]):
         """pass list of lists of values and list of keys of desired dict
         This converts to list of dicts
@@ -0,0 +1,229 @@
+import os
+import mmap
+
+import attr
+
+from .compressed import detect_compression
+from ..utils import log_it
+
+
+log = log_it(logname='parser.fasta_index')
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Classes ~~~~~
+
+@attr.s(slots=True)
+class FaiEntry(object):
+    """one line of a `.fai` index (samtools faidx layout)"""
+    name: str = attr.ib()
+    length: int = attr.ib(converter=int)     # number of bases
+    offset: int = attr.ib(converter=int)     # byte offset of the first base
+    linebases: int = attr.ib(converter=int)  # bases per line, 0 if lines are ragged
+    linewidth: int = attr.ib(converter=int)  # bytes per line, incl. line ending
+
+    def to_line(self):
+        return f'{self.name}\t{self.length}\t{self.offset}\t{self.linebases}\t{self.linewidth}\n'
+
+
+@attr.s(slots=True)
+class FastaRecord(object):
+    """a sequence as a zero-copy view of the mapped file.
+    `raw` still holds the line endings; `sequence` makes the str.
+    """
+    name: str = attr.ib()
+    raw: memoryview = attr.ib(repr=False)
+    length: int = attr.ib()
+
+    @property
+    def sequence(self):
+        return bytes(self.raw).replace(b'\n', b'').replace(b'\r', b'').decode('ascii')
+
+
+@attr.s
+class IndexedFasta(object):
+    """Random access to the records of a FASTA file by name.
+
+    The file is memory-mapped and an offset index (samtools `.fai` layout)
+    is built on first use and saved next to it, to be reused while it is
+    newer than the FASTA file. Names are the header up to the first space.
+
+        with IndexedFasta('otus.fasta') as fasta:
+            seq = fasta.fetch('OTU_12')
+            for record in fasta:
+                ...
+    """
+    filename: str = attr.ib()
+    index_file: str = attr.ib()
+    index: dict = attr.ib(init=False, default=attr.Factory(dict), repr=False)
+    _fh = attr.ib(init=False, default=None, repr=False)
+    _mm = attr.ib(init=False, default=None, repr=False)
+
+    @index_file.default
+    def get_index_file(self):
+        return self.filename + '.fai'
+
+
+    def __attrs_post_init__(self):
+        self.open()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+
+    def open(self):
+        """map the file and load (or build) its index"""
+        if detect_compression(self.filename):
+            raise ValueError(f'Cannot index compressed file {self.filename}, '
+                             'decompress it or read it with FastaParser.')
+        try:
+            self._fh = open(self.filename, 'rb')
+            if os.fstat(self._fh.fileno()).st_size:
+                self._mm = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self._mm = b''
+        except Exception as e:
+            log.exception(f'There is a problem opening file: {self.filename}.')
+            raise e
+        if not self.read_index():
+            self.build_index()
+            self.write_index()
+
+
+    def close(self):
+        if isinstance(self._mm, mmap.mmap):
+            try:
+                self._mm.close()
+            except BufferError:
+                # records still hold views of the map; it closes once they are freed
+                log.debug(f'{self.filename} map still in use by FastaRecords.')
+        if self._fh:
+            self._fh.close()
+        self._mm = self._fh = None
+
+
+    def read_index(self):
+        """load the saved index if it is at least as new as the file"""
+        try:
+            if os.path.getmtime(self.index_file) < os.path.getmtime(self.filename):
+                log.info(f'Index {self.index_file} is older than {self.filename}.')
+                return False
+            with open(self.index_file, 'r') as fh:
+                for line in fh:
+                    entry = FaiEntry(*line.rstrip('\n').split('\t'))
+                    self.index[entry.name] = entry
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            log.warning(f'Ignoring unreadable index {self.index_file}: {e!s}')
+            self.index = {}
+            return False
+        log.info(f'Loaded index of {len(self.index)} records from {self.index_file}')
+        return True
+
+
+    def build_index(self):
+        """scan the mapped file for headers and sequence offsets"""
+        mm = self._mm
+        size = len(mm)
+        self.index = {}
+        if mm[:1] == b'>':
+            pos = 0
+        else:
+            pos = mm.find(b'\n>')
+            pos = pos + 1 if pos >= 0 else -1
+        while 0 <= pos < size:
+            header_end = mm.find(b'\n', pos)
+            if header_end < 0:
+                header_end = size
+            name = (mm[pos+1:header_end].split(None, 1) or [b''])[0].decode()
+            start = header_end + 1
+            end = mm.find(b'\n>', header_end)
+            next_pos = end + 1 if end >= 0 else -1
+            end = end + 1 if end >= 0 else size
+            raw = mm[start:end]
+            newlines = raw.count(b'\n')
+            length = len(raw) - newlines - raw.count(b'\r')
+            linebases, linewidth = self.line_layout(raw, newlines)
+            if name in self.index:
+                log.warning(f'Duplicate name {name} in {self.filename}, keeping the first.')
+            else:
+                self.index[name] = FaiEntry(name, length, start, linebases, linewidth)
+            pos = next_pos
+        log.info(f'Indexed {len(self.index)} records in {self.filename}')
+        return self.index
+
+
+    @staticmethod
+    def line_layout(raw, newlines):
+        """(linebases, linewidth) of a record's sequence lines; (0, 0) if the
+        lines (other than the last) are not all the same width.
+        """
+        if not newlines:
+            return len(raw), len(raw)
+        linewidth = raw.find(b'\n') + 1
+        linebases = linewidth - (2 if raw[linewidth-2:linewidth-1] == b'\r' else 1)
+        full_lines = raw[linewidth-1::linewidth][:newlines-1]
+        if full_lines.count(b'\n') != newlines - 1 or \
+           len(raw) - (newlines-1) * linewidth > linewidth:
+            return 0, 0
+        return linebases, linewidth
+
+
+    def write_index(self):
+        """save the index next to the file, if the directory is writable"""
+        try:
+            tmp_file = f'{self.index_file}.{os.getpid()}'
+            with open(tmp_file, 'w') as fh:
+                fh.writelines(entry.to_line() for entry in self.index.values())
+            os.replace(tmp_file, self.index_file)
+        except OSError as e:
+            log.warning(f'Cannot save index {self.index_file}: {e!s}')
+
+
+    def raw_end(self, entry):
+        """byte offset just past the last base of entry"""
+        if not entry.length:
+            return entry.offset
+        if entry.linebases:
+            full_lines, rest = divmod(entry.length, entry.linebases)
+            return entry.offset + full_lines * entry.linewidth + rest
+        end = self._mm.find(b'\n>', entry.offset)
+        return end if end >= 0 else len(self._mm)
+
+
+    def record(self, name):
+        """FastaRecord for name (KeyError if absent)"""
+        entry = self.index[name]
+        raw = memoryview(self._mm)[entry.offset:self.raw_end(entry)]
+        return FastaRecord(name, raw, entry.length)
+
+
+    def fetch(self, name):
+        """sequence str of the record `name`"""
+        return self.record(name).sequence
+
+
+    def __contains__(self, name):
+        return name in self.index
+
+
+    def __len__(self):
+        return len(self.index)
+
+
+    def __iter__(self):
+        """FastaRecords in file order"""
+        for name in self.index:
+            yield self.record(name)
+
+
+    def load_data(self):
+        """yield (header, sequence) like FastaParser.load_data"""
+        for record in self:
+            yield record.name, record.sequence
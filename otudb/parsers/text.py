@@ -1,7 +1,8 @@
 import os
 import attr
 
-from ..utils import log_it, now
+from .compressed import detect_compression, open_decompressed
+from ..utils import log_it, now, count_records
 
 
 log = log_it(logname='parser.textfile')
@@ -14,6 +15,8 @@ class TextParser(object):
     mode: str = attr.ib(default='w+')
     headers: list = attr.ib(init=False, default='[]')
     newline: str = attr.ib(init=False, default='')
+    threaded: bool = attr.ib(default=True)
+    compression: str = attr.ib(init=False, default=None)
     fh = attr.ib(init=False)
 
     @fh.default
@@ -25,9 +28,19 @@ class TextParser(object):
         """determine if file can be accessed in the specified mode.
         Else check writeable, then readable to determine if at all.
         Return file object handle.
+
+        gzip, xz and bz2 files opened for reading are detected by their
+        magic bytes and decompressed while being read.
         """
         try:
-            fh = open(self.filename, self.mode, newline=self.newline)
+            if self.mode == 'r':
+                self.compression = detect_compression(self.filename)
+            if self.compression:
+                fh = open_decompressed(self.filename, self.compression,
+                                       newline=self.newline, threaded=self.threaded)
+                log.info(f'{self.filename} is {self.compression} compressed.')
+            else:
+                fh = open(self.filename, self.mode, newline=self.newline)
         except FileNotFoundError as e:
             log.exception(f'File does not exist: {self.filename}.')
             self.mode = 'w+'
@@ -48,6 +61,40 @@ class TextParser(object):
         return self.open_accessible_file()
 
 
+    def count_records(self, marker=b'\n'):
+        """quick count of `marker` (lines) in the file; None if compressed"""
+        if self.compression:
+            return None
+        return count_records(self.filename, marker)
+
+
+    def position(self):
+        """byte offset of the next line to be read; None if compressed"""
+        if self.compression:
+            return None
+        return self.fh.tell()
+
+
+    def lines(self, offset=None):
+        """iterate the lines with readline, which (unlike iterating the file)
+        keeps position() usable between lines. Start at byte `offset`.
+        """
+        if offset:
+            self.fh.seek(offset)
+        return iter(self.fh.readline, '')
+
+
+    def rewind(self):
+        """read from the top of the file again; a compressed file read past
+        its first lines is opened anew
+        """
+        if self.fh.seekable():
+            self.fh.seek(0)
+        else:
+            self.fh.close()
+            self.fh = self.open_file()
+
+
     def load_data(self):
         """yield rows from file using readline"""
         log.info(f'Loading rows from {self.filename}')
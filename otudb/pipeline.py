@@ -0,0 +1,228 @@
+"""Pipelined imports: rows parsed by a producer thread while the importer
+writes the rows before them.
+
+The producer reads the parser's rows in batches of `batch_rows` into a
+queue of at most `depth` batches; the importer (the thread holding the db
+connection and its transaction) takes them off the queue. A full queue
+blocks the producer, so it never runs more than depth batches ahead.
+The time each side spends blocked is reported: a parser stalled on a full
+queue means the db writes are the bottleneck (a deeper queue won't help),
+an importer stalled on an empty queue means parsing is.
+
+Batches end at commit boundaries, and each carries the parser's position
+just past its last row, so checkpoints are exact as when reading in line.
+
+    rows = source_rows(read_rows(tp, checkpoint), tp, Pipeline(depth=8))
+    for chunk in rows.chunks(commit_rows):
+        ...
+        commit_checkpoint(txn, checkpoint, row_count, rows.position(), batch)
+    rows.report()
+"""
+
+import queue
+import itertools
+import threading
+import time
+
+import attr
+
+from .utils import log_it
+
+
+log = log_it(logname='otudb.pipeline')
+
+# rows per queued batch, and batches queued at most
+PIPELINE_ROWS = 1000
+PIPELINE_DEPTH = 8
+# secs between checks of a producer blocked on a full queue for a stop
+PUT_TIMEOUT = 0.5
+
+# queue item closing the rows
+END = object()
+
+
+def commit_chunks(rows, commit_rows=None):
+    """split the `rows` iterator into iterators of `commit_rows` rows each
+    (all rows if None). Rows are not read ahead: once a chunk is exhausted,
+    the parser's position() is just past its last row.
+    """
+    rows = iter(rows)
+    while True:
+        chunk = itertools.islice(rows, commit_rows or None)
+        first = next(chunk, None)
+        if first is None:
+            return
+        yield itertools.chain([first], chunk)
+
+
+def parser_position(parser):
+    return parser.position() if parser is not None else None
+
+
+def source_rows(rows, parser=None, pipeline=None):
+    """the rows of `parser` (an iterator of them), read in line or through
+    `pipeline` (a Pipeline; None to read in line)
+    """
+    if pipeline is None or not pipeline.depth:
+        return InlineRows(rows, parser)
+    return ReadAhead(rows, parser, pipeline.batch_rows, pipeline.depth)
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Classes ~~~~~
+
+@attr.s(frozen=True)
+class Pipeline(object):
+    """settings of a pipelined import: batches of `batch_rows` rows, at
+    most `depth` of them queued (0: no pipeline)
+    """
+    depth: int = attr.ib(default=PIPELINE_DEPTH)
+    batch_rows: int = attr.ib(default=PIPELINE_ROWS)
+
+    @batch_rows.validator
+    def check_batch_rows(self, attribute, value):
+        if not value or value < 1:
+            raise ValueError(f'batch_rows must be a positive number of rows, not {value!r}')
+
+
+@attr.s
+class InlineRows(object):
+    """rows read by the importer itself, the same interface as ReadAhead"""
+    rows = attr.ib(repr=False)
+    parser = attr.ib(default=None, repr=False)
+
+    def chunks(self, commit_rows=None):
+        return commit_chunks(self.rows, commit_rows)
+
+
+    def position(self):
+        return parser_position(self.parser)
+
+
+    def report(self):
+        pass
+
+
+@attr.s
+class ReadAhead(object):
+    """rows of a parser read ahead by a producer thread, see module doc"""
+    rows = attr.ib(repr=False)
+    parser = attr.ib(default=None, repr=False)
+    batch_rows: int = attr.ib(default=PIPELINE_ROWS)
+    depth: int = attr.ib(default=PIPELINE_DEPTH)
+    row_count: int = attr.ib(init=False, default=0)
+    batch_count: int = attr.ib(init=False, default=0)
+    # secs the producer waited on a full queue, the importer on an empty one
+    parser_stall: float = attr.ib(init=False, default=0.0)
+    writer_stall: float = attr.ib(init=False, default=0.0)
+    started: float = attr.ib(init=False, default=None, repr=False)
+    last_position: int = attr.ib(init=False, default=None, repr=False)
+    ended: bool = attr.ib(init=False, default=False, repr=False)
+    batches: queue.Queue = attr.ib(init=False, default=None, repr=False)
+    stopped: threading.Event = attr.ib(init=False, default=attr.Factory(threading.Event),
+                                       repr=False)
+
+    def produce(self, commit_rows):
+        """producer thread: queue (rows, position after them) batches,
+        none crossing a commit boundary, then END (or the exception raised)
+        """
+        try:
+            rows = iter(self.rows)
+            while True:
+                room = commit_rows or None
+                while room is None or room > 0:
+                    size = self.batch_rows if room is None else min(self.batch_rows, room)
+                    batch = list(itertools.islice(rows, size))
+                    if not batch:
+                        self.put(END)
+                        return
+                    if not self.put((batch, parser_position(self.parser))):
+                        return
+                    if room is not None:
+                        room -= len(batch)
+        except Exception as e:
+            self.put(e)
+
+
+    def put(self, item):
+        """queue item, waiting while the queue is full; False if stopped"""
+        started = time.perf_counter()
+        try:
+            while not self.stopped.is_set():
+                try:
+                    self.batches.put(item, timeout=PUT_TIMEOUT)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+        finally:
+            self.parser_stall += time.perf_counter() - started
+
+
+    def get(self):
+        started = time.perf_counter()
+        item = self.batches.get()
+        self.writer_stall += time.perf_counter() - started
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+
+    def chunks(self, commit_rows=None):
+        """yield iterators of `commit_rows` rows each (all if None), as
+        commit_chunks; position() is just past a chunk once it is exhausted
+        """
+        self.batches = queue.Queue(maxsize=self.depth)
+        self.stopped.clear()
+        self.ended = False
+        self.started = time.perf_counter()
+        producer = threading.Thread(target=self.produce, args=(commit_rows,),
+                                    name='otudb-parser', daemon=True)
+        producer.start()
+        try:
+            while not self.ended:
+                batch = self.get()
+                if batch is END:
+                    break
+                yield self.chunk_rows(batch, commit_rows)
+        finally:
+            self.stopped.set()
+            producer.join()
+
+
+    def chunk_rows(self, batch, commit_rows=None):
+        """rows of `batch` and the batches after it, up to the commit boundary"""
+        taken = 0
+        while True:
+            rows, position = batch
+            yield from rows
+            taken += len(rows)
+            self.row_count += len(rows)
+            self.batch_count += 1
+            self.last_position = position
+            if commit_rows and taken >= commit_rows:
+                return
+            batch = self.get()
+            if batch is END:
+                self.ended = True
+                return
+
+
+    def position(self):
+        """parser position just past the rows taken so far"""
+        return self.last_position
+
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started if self.started else 0.0
+
+
+    def report(self):
+        """log rows read ahead and the time each side stalled"""
+        log.info('Read %s rows in %s batches in %.2fs; parser stalled %.2fs on a full '
+                 'queue (depth %s), writer stalled %.2fs on an empty one',
+                 self.row_count, self.batch_count, self.elapsed, self.parser_stall,
+                 self.depth, self.writer_stall)
+        return dict(rows=self.row_count, batches=self.batch_count,
+                    parser_stall=round(self.parser_stall, 4),
+                    writer_stall=round(self.writer_stall, 4))
@@ -0,0 +1,189 @@
+"""Pooled, reconnecting connections to the otu db.
+
+Each thread checks out a connection of its own from a pool of at most
+`max_connections`, waiting up to `wait_timeout` seconds for one to be
+returned once all are in use. Connections older than `stale_timeout`
+seconds are closed instead of reused, well before MySQL drops idle ones
+(its wait_timeout). A thread returns its connection with `db.close()`, or
+runs its work in `with db.connection_context():`.
+
+A statement run outside a transaction that fails because MySQL has gone
+away is run again on a new connection. A transaction cannot be picked up
+that way, so `retrying` runs a whole unit of work that is safe to repeat
+(e.g. an import carrying on from its last committed checkpoint) again.
+
+A forked child forgets the connections of its parent, without closing
+them (which would end the parent's sessions), and opens its own.
+"""
+
+import os
+import time
+import weakref
+import threading
+from collections import Counter
+
+from peewee import InterfaceError, OperationalError
+from playhouse.db_url import parse as parse_url
+from playhouse.pool import PooledMySQLDatabase, PooledSqliteDatabase
+from playhouse.shortcuts import ReconnectMixin
+
+from .bulk import real_database
+from .db_config import is_sqlite
+from .utils import log_it
+
+
+log = log_it(logname='otudb.pool')
+
+MAX_CONNECTIONS = 8
+# seconds: a connection is closed rather than reused after this long
+STALE_TIMEOUT = 300
+# seconds waited for a free connection when all are in use
+WAIT_TIMEOUT = 60
+# times a unit of work is run again after a lost connection
+RETRIES = 3
+RETRY_DELAY = 1.0
+
+stat_names = ('waits', 'reconnects', 'retries')
+
+# every pool of this process, to be reset in a forked child
+pools = weakref.WeakSet()
+# connections of the parent, kept from being closed in the child
+forked_connections = []
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Classes ~~~~~
+
+class PoolStatsMixin(object):
+    """counts of a pooled database, read with `pool_stats`"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = Counter()
+        pools.add(self)
+
+
+    def count(self, name):
+        with self._pool_lock:
+            self.stats[name] += 1
+
+
+    def connect(self, reuse_if_open=False):
+        if self.is_closed():
+            with self._pool_lock:
+                full = (self._max_connections and not self._connections
+                        and len(self._in_use) >= self._max_connections)
+            if full:
+                self.count('waits')
+        return super().connect(reuse_if_open)
+
+
+    def forget_connections(self):
+        """drop (unclosed) the connections inherited from a forked parent"""
+        forked_connections.extend(conn for _, _, conn in self._connections)
+        forked_connections.extend(pooled.connection for pooled in self._in_use.values())
+        self._connections, self._in_use = [], {}
+        self._state.reset()
+        self._reset_locks()
+
+
+    def _reset_locks(self):
+        # a lock held by another thread of the parent stays locked in the child
+        self._lock = threading.Lock()
+        self._pool_lock = threading.RLock()
+        self._pool_available = threading.Condition(self._pool_lock)
+
+
+    def drop_connection(self):
+        """close this thread's connection for good, not returning it to the pool"""
+        if not self.is_closed():
+            self.manual_close()
+
+
+class RetryMixin(ReconnectMixin):
+    """ReconnectMixin that counts its reconnects, and closes the broken
+    connection instead of returning it to the pool
+    """
+
+    def is_reconnect_error(self, exc):
+        message = str(exc).lower()
+        return any(fragment in message
+                   for fragment in self._reconnect_errors.get(type(exc), ()))
+
+
+    def _reconnect(self, func, *args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        except Exception as exc:
+            # in a transaction, its earlier statements would be lost
+            if self.in_transaction() or not self.is_reconnect_error(exc):
+                raise
+            log.warning(f'Lost the db connection ({exc!s}), reconnecting')
+        self.count('reconnects')
+        self.drop_connection()
+        self.connect()
+        return func(*args, **kwargs)
+
+
+class RetryingPooledMySQLDatabase(PoolStatsMixin, RetryMixin, PooledMySQLDatabase):
+    pass
+
+
+class StatsPooledSqliteDatabase(PoolStatsMixin, PooledSqliteDatabase):
+    """SQLite has no server to go away; connections are pooled only"""
+
+
+def pooled_database(url, max_connections=MAX_CONNECTIONS, stale_timeout=STALE_TIMEOUT,
+                    wait_timeout=WAIT_TIMEOUT, **kwargs):
+    """pooled database of a db url (MySQL or SQLite)"""
+    settings = dict(parse_url(url), max_connections=max_connections,
+                    stale_timeout=stale_timeout, timeout=wait_timeout, **kwargs)
+    if not settings.get('database'):
+        raise ValueError(f'"{url}" has no database name')
+    if is_sqlite(url):
+        # a pooled connection is checked out by one thread after another
+        return StatsPooledSqliteDatabase(**settings, check_same_thread=False)
+    return RetryingPooledMySQLDatabase(**settings)
+
+
+def pool_stats(db):
+    """{in_use, idle, max_connections, waits, reconnects, retries} of a
+    pooled database (db or proxy); empty for another database
+    """
+    db = real_database(db)
+    if not isinstance(db, PoolStatsMixin):
+        return {}
+    with db._pool_lock:
+        stats = dict(in_use=len(db._in_use), idle=len(db._connections),
+                     max_connections=db._max_connections)
+        stats.update((name, db.stats[name]) for name in stat_names)
+    return stats
+
+
+def retrying(db, func, *args, retries=RETRIES, delay=RETRY_DELAY, **kwargs):
+    """run `func(*args, **kwargs)`, again (up to `retries` times) on a new
+    connection if it fails because the db connection was lost. Only for
+    work that is safe to repeat: whatever it committed before failing is
+    done again, or must be skipped by func itself.
+    """
+    db = real_database(db)
+    for attempt in range(retries + 1):
+        try:
+            return func(*args, **kwargs)
+        except (OperationalError, InterfaceError) as e:
+            if (attempt == retries or db.in_transaction()
+                    or not getattr(db, 'is_reconnect_error', lambda e: False)(e)):
+                raise
+            log.warning(f'Lost the db connection ({e!s}), '
+                        f'retrying {getattr(func, "__name__", func)} ({attempt + 1}/{retries})')
+            if isinstance(db, PoolStatsMixin):
+                db.count('retries')
+                db.drop_connection()
+            time.sleep(delay * (attempt + 1))
+
+
+def forget_inherited_connections():
+    for db in list(pools):
+        db.forget_connections()
+
+
+os.register_at_fork(after_in_child=forget_inherited_connections)
@@ -0,0 +1,235 @@
+"""Rarefaction: the read counts of the samples of an analysis set
+subsampled, without replacement, to even depths.
+
+The otu_counts `counts` of a set are read once, a sample's non-zero cells
+together (sets imported from tables of relative abundances have none).
+Each sample is drawn `iterations` times at each depth it reaches with one
+multivariate hypergeometric call of NumPy (a vectorized draw of all its
+OTUs at once); samples with fewer reads than a depth are left out at that
+depth. Batches of samples are drawn in a pool of `jobs` processes.
+
+Draws are seeded per (seed, sample_id, depth), so the same seed gives
+the same rarefied tables whatever the jobs, batches, depths asked for
+alongside, or other samples of the set.
+
+    rarefied = rarefy(db, tables.models, set_id=3, depths=[1000, 5000], iterations=10)
+    rarefied.matrix(1000, 0)         # AbundanceMatrix of the first draw at 1000
+    store_rarefied(tables.models, rarefied, 1000)    # as a new analysis set
+"""
+
+import os
+import time
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import attr
+import numpy as np
+
+from peewee import fn
+
+from .batch import BatchInserter, DEFAULT_BATCH_SIZE
+from .export import in_set, FETCH_SIZE
+from .matrix import AbundanceMatrix, SparseMatrix, matrix_samples, otu_labels, read_cells
+from .matrix_cache import bump_generation
+from .utils import log_it
+
+
+log = log_it(logname='otudb.rarefaction')
+
+ITERATIONS = 1
+# samples per task of the process pool
+SAMPLE_BATCH = 64
+
+
+def draw_samples(batch, depths, iterations=ITERATIONS, seed=0):
+    """rarefied draws of a batch of samples (column, sample_id, counts):
+    [(column, {depth: (iterations x OTUs) counts})], depths above a
+    sample's total left out
+    """
+    drawn = []
+    for column, sample_id, counts in batch:
+        total = counts.sum()
+        draws = {}
+        for depth in depths:
+            if depth <= total:
+                rng = np.random.default_rng([seed, int(sample_id), int(depth)])
+                draws[depth] = rng.multivariate_hypergeometric(counts, depth, size=iterations,
+                                                               method='marginals')
+        drawn.append((column, draws))
+    return drawn
+
+
+def sample_batches(sample_ids, cell_rows, cell_columns, cell_counts,
+                   batch_size=SAMPLE_BATCH):
+    """(batches of (column, sample_id, counts of its cells), cell rows of
+    each column) of the cells of a matrix
+    """
+    order = np.argsort(cell_columns, kind='stable')
+    bounds = np.searchsorted(cell_columns[order], np.arange(len(sample_ids) + 1))
+    samples, rows = [], []
+    for column, sample_id in enumerate(sample_ids):
+        cells = order[bounds[column]:bounds[column + 1]]
+        samples.append((column, sample_id, cell_counts[cells]))
+        rows.append(cell_rows[cells])
+    batches = [samples[i:i + batch_size] for i in range(0, len(samples), batch_size)]
+    return batches, rows
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Classes ~~~~~
+
+@attr.s(cmp=False)
+class Rarefaction(object):
+    """rarefied counts of a set: `tables[depth]` is a list of `iterations`
+    SparseMatrix (OTUs x the samples reaching the depth), `columns[depth]`
+    the positions of those samples among sample_ids
+    """
+    depths: list = attr.ib()
+    iterations: int = attr.ib()
+    seed: int = attr.ib()
+    otu_ids: list = attr.ib(repr=False)
+    otu_names: list = attr.ib(repr=False)
+    sample_ids: list = attr.ib(repr=False)
+    sample_names: list = attr.ib(repr=False)
+    tables: dict = attr.ib(default=attr.Factory(dict), repr=False)
+    columns: dict = attr.ib(default=attr.Factory(dict), repr=False)
+
+    def matrix(self, depth, iteration=0):
+        """AbundanceMatrix of the counts of one draw at a depth"""
+        names = [self.sample_names[column] for column in self.columns[depth]]
+        return AbundanceMatrix(self.tables[depth][iteration], self.otu_names, names)
+
+
+    def rows(self):
+        """(depth, iteration, otu_name, sample_name, count) of every
+        non-zero rarefied cell
+        """
+        for depth in self.depths:
+            names = [self.sample_names[column] for column in self.columns[depth]]
+            for iteration, table in enumerate(self.tables[depth]):
+                for row, otu_name in enumerate(self.otu_names):
+                    columns, counts = table.row(row)
+                    for column, count in zip(columns.tolist(), counts.tolist()):
+                        yield depth, iteration + 1, otu_name, names[column], int(count)
+
+
+def read_counts(db, models, set_id=None, fetch_size=FETCH_SIZE):
+    """(otu ids, otu names, sample ids, sample names, cell rows, cell
+    columns, cell counts) of the non-zero read counts of a set
+    """
+    counts = models.otu_counts
+    sample_ids, sample_names = matrix_samples(models, set_id)
+    labels = otu_labels(db, models, set_id, fetch_size=fetch_size)
+    query = (counts.select(counts.otu_id, counts.sample_id, counts.counts)
+                   .where(in_set(counts.set_id, set_id) & (counts.counts > 0)))
+    cell_otus, cell_samples, cell_counts = read_cells(db, query, fetch_size)
+
+    otu_ids = np.array(sorted(labels), dtype=np.int64)
+    sample_array = np.array(sample_ids, dtype=np.int64)
+    keep = np.isin(cell_otus, otu_ids) & np.isin(cell_samples, sample_array)
+    cell_otus, cell_samples = cell_otus[keep], cell_samples[keep]
+    order = np.argsort(sample_array)
+    cell_columns = order[np.searchsorted(sample_array[order], cell_samples)]
+    return (otu_ids.tolist(), [labels[otu_id] for otu_id in otu_ids.tolist()],
+            sample_ids, sample_names, np.searchsorted(otu_ids, cell_otus), cell_columns,
+            cell_counts[keep].astype(np.int64))
+
+
+def rarefy(db, models, set_id=None, depths=(), iterations=ITERATIONS, seed=0, jobs=None,
+           batch_size=SAMPLE_BATCH, fetch_size=FETCH_SIZE):
+    """Rarefaction of the read counts of a set to each of `depths`,
+    `iterations` draws each, sample batches drawn by `jobs` processes
+    (default: number of cores; 1: in this one)
+    """
+    depths = sorted(set(int(depth) for depth in depths))
+    if not depths or depths[0] < 1:
+        raise ValueError(f'Rarefaction depths must be positive read counts, not {depths}')
+    if iterations < 1:
+        raise ValueError(f'iterations must be positive, not {iterations}')
+    started = time.perf_counter()
+    (otu_ids, otu_names, sample_ids, sample_names,
+     cell_rows, cell_columns, cell_counts) = read_counts(db, models, set_id, fetch_size)
+    if not len(cell_counts):
+        log.warning(f'No read counts stored in set {set_id or 0} to rarefy')
+    batches, rows = sample_batches(sample_ids, cell_rows, cell_columns, cell_counts,
+                                   batch_size)
+
+    if jobs == 1:
+        drawn = [draw_samples(batch, depths, iterations, seed) for batch in batches]
+    else:
+        # spawn, not fork: the workers need nothing of this process's db state
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=jobs or os.cpu_count(),
+                                 mp_context=context) as pool:
+            drawn = list(pool.map(draw_samples, batches, itertools.repeat(depths),
+                                  itertools.repeat(iterations), itertools.repeat(seed)))
+
+    totals = np.bincount(cell_columns, weights=cell_counts, minlength=len(sample_ids))
+    result = Rarefaction(depths, iterations, seed, otu_ids, otu_names,
+                         sample_ids, sample_names)
+    for depth in depths:
+        kept = np.flatnonzero(totals >= depth)
+        position = np.full(len(sample_ids), -1, dtype=np.int64)
+        position[kept] = np.arange(len(kept))
+        cells = dict(iteration=[], row=[], column=[], count=[])
+        for column, draws in itertools.chain.from_iterable(drawn):
+            if depth not in draws:
+                continue
+            iteration, cell = np.nonzero(draws[depth])
+            cells['iteration'].append(iteration)
+            cells['row'].append(rows[column][cell])
+            cells['column'].append(np.full(len(cell), position[column], dtype=np.int64))
+            cells['count'].append(draws[depth][iteration, cell])
+        cells = {name: np.concatenate(arrays) if arrays else np.zeros(0, dtype=np.int64)
+                 for name, arrays in cells.items()}
+        shape = (len(otu_ids), len(kept))
+        result.tables[depth] = [
+            SparseMatrix.from_coo(cells['row'][drawn_cells], cells['column'][drawn_cells],
+                                  cells['count'][drawn_cells], shape)
+            for drawn_cells in (cells['iteration'] == i for i in range(iterations))]
+        result.columns[depth] = kept.tolist()
+        if len(kept) < len(sample_ids):
+            log.info(f'{len(sample_ids) - len(kept)} samples of set {set_id or 0} have '
+                     f'fewer than {depth} reads, left out at that depth')
+    log.info(f'Rarefied {len(sample_ids)} samples of set {set_id or 0} to {depths}, '
+             f'{iterations} iterations, in {time.perf_counter() - started:.2f}s')
+    return result
+
+
+def store_rarefied(models, result, depth, iteration=0, set_name=None,
+                   batch_size=DEFAULT_BATCH_SIZE):
+    """store one draw of a Rarefaction as a new analysis set (its counts,
+    percent abundances, samples and sample totals); return its set_id
+    """
+    table = result.tables[depth][iteration]
+    method = f'rarefied to {depth} reads, seed {result.seed}, iteration {iteration + 1}'
+    sample_ids = [result.sample_ids[column] for column in result.columns[depth]]
+    rows = np.repeat(np.arange(table.shape[0]), np.diff(table.indptr))
+    sets, counts = models.analysis_set, models.otu_counts
+    with counts._meta.database.atomic():
+        # counts may be stored under set_ids without an analysis_set row
+        set_id = 1 + max(sets.select(fn.MAX(sets.set_id)).scalar() or 0,
+                         counts.select(fn.MAX(counts.set_id)).scalar() or 0)
+        sets.insert(set_id=set_id, set_name=set_name or f'rarefied to {depth}',
+                    description=method).execute()
+        if sample_ids:
+            models.sample_analysis_sets.insert_many(
+                [dict(set_id=set_id, sample_id=sample_id) for sample_id in sample_ids]).execute()
+        with BatchInserter(counts, batch_size) as batch:
+            for row, column, count in zip(rows.tolist(), table.indices.tolist(),
+                                          table.data.tolist()):
+                batch.add(dict(set_id=set_id,
+                               otu_id=result.otu_ids[row],
+                               sample_id=sample_ids[column],
+                               counts=int(count),
+                               percent_abundance=round(100.0 * count / depth, 3),
+                               method=method))
+        nonzero = np.bincount(table.indices, minlength=len(sample_ids))
+        with BatchInserter(models.otu_sample_totals, batch_size, replace=True) as totals:
+            for sample_id, otus in zip(sample_ids, nonzero.tolist()):
+                totals.add(dict(set_id=set_id, sample_id=sample_id, total_abundance=depth,
+                                nonzero_otus=otus, total_otus=len(result.otu_ids)))
+        bump_generation(models, set_id)
+    log.info(f'Stored the counts of {len(sample_ids)} samples rarefied to {depth} '
+             f'as set {set_id}')
+    return set_id
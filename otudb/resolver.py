@@ -0,0 +1,115 @@
+"""Resolve names (sample names, OTU names) to table ids in bulk"""
+
+import attr
+
+from .batch import BatchInserter, DEFAULT_BATCH_SIZE
+from .utils import log_it
+
+
+log = log_it(logname='otudb.resolver')
+
+# keep IN (...) lists below the bound-parameter limits of the db drivers
+QUERY_CHUNK = 500
+
+
+def chunked(items, size=QUERY_CHUNK):
+    """yield successive lists of at most `size` items"""
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start+size]
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Classes ~~~~~
+
+@attr.s
+class NameResolver(object):
+    """In-memory map of `name_field` -> `id_field` for one table.
+
+    Names are looked up in bulk (one query per chunk of names, or one query
+    for the whole table) so import loops never issue a SELECT per row:
+
+        samples = NameResolver(tables.models.sample_info, 'sample_name', 'sample_id')
+        samples.load(sample_names)
+        sample_id = samples.get('S1')
+
+    `where` is an optional peewee expression limiting the rows looked at.
+    """
+    model = attr.ib(repr=False)
+    name_field: str = attr.ib()
+    id_field: str = attr.ib()
+    where = attr.ib(default=None, repr=False)
+    ids: dict = attr.ib(init=False, default=attr.Factory(dict), repr=False)
+    missing: list = attr.ib(init=False, default=attr.Factory(list))
+
+    @property
+    def table_name(self):
+        return self.model._meta.table_name
+
+
+    def load(self, names=None):
+        """query ids of `names` (or of every row if None) into the cache.
+        Return the list of names not found in the table.
+        """
+        name_col = getattr(self.model, self.name_field)
+        id_col = getattr(self.model, self.id_field)
+        try:
+            query = self.model.select(id_col, name_col)
+            if self.where is not None:
+                query = query.where(self.where)
+            if names is None:
+                self.ids.update((name, _id) for _id, name in query.tuples())
+                self.missing = []
+            else:
+                names = list(dict.fromkeys(names)) # unique, in order
+                wanted = [n for n in names if n not in self.ids]
+                for chunk in chunked(wanted):
+                    rows = query.where(name_col.in_(chunk)).tuples()
+                    self.ids.update((name, _id) for _id, name in rows)
+                self.missing = [n for n in names if n not in self.ids]
+        except Exception as e:
+            log.error(f'Whoops resolving {self.name_field} in {self.table_name}.')
+            raise e
+        log.info('Resolved %s %s names in %s, %s missing',
+                 len(self.ids), self.name_field, self.table_name, len(self.missing))
+        return self.missing
+
+
+    def create_missing(self, batch_size=DEFAULT_BATCH_SIZE, **defaults):
+        """insert a row for each missing name in one batch, then resolve them.
+        `defaults` are extra column values for every new row.
+        """
+        created = list(self.missing)
+        if not created:
+            return []
+        log.info('Creating %s new rows in %s: %s', len(created), self.table_name, created)
+        with BatchInserter(self.model, batch_size) as batch:
+            for name in created:
+                batch.add(dict(defaults, **{self.name_field: name}))
+        self.load(created)
+        return created
+
+
+    def get(self, name, default=None):
+        return self.ids.get(name, default)
+
+
+    def __getitem__(self, name):
+        return self.ids[name]
+
+
+    def __contains__(self, name):
+        return name in self.ids
+
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def sample_resolver(models):
+    """resolver of sample_info.sample_name -> sample_id"""
+    return NameResolver(models.sample_info, 'sample_name', 'sample_id')
+
+
+def otu_resolver(models):
+    """resolver of otu_seq.otu_name -> seq_id"""
+    return NameResolver(models.otu_seq, 'otu_name', 'seq_id')
@@ -0,0 +1,216 @@
+"""Per-taxon abundance rollups: otu_counts joined to otu_annotation, summed
+per sample up to each rank, kept in the otu_taxon_rollup table so reports
+do not scan otu_counts.
+
+The importers keep the rollups up to date as they commit: the count rows
+(or annotation rows) written since the last commit are joined to the
+annotations (or counts) of their set, and the sums added to the rollup
+rows. Every (count, annotation) pair is added once, when the later of the
+two is written. An OTU annotated more than once in a set (by several
+methods, say) is rolled up under its latest annotation only; an import
+that supersedes annotations already rolled up rebuilds the set's rollups.
+Diffs, which also change and delete rows, rebuild the rollups of their
+set; rollup_taxa.py rebuilds them on demand.
+"""
+
+import time
+from collections import defaultdict
+
+import attr
+
+from peewee import JOIN, Case, MySQLDatabase, EXCLUDED, fn
+
+from .batch import DEFAULT_BATCH_SIZE
+from .bulk import real_database
+from .export import lineage_rank, in_set
+from .resolver import chunked
+from .taxonomy import ranks
+from .utils import log_it
+
+
+log = log_it(logname='otudb.rollup')
+
+
+def counts_in_set(counts, set_id):
+    """where clause of the count rows of a set (set_id None: rows without one)"""
+    return in_set(counts.set_id, set_id)
+
+
+def latest_annotations(annotations, set_id=None):
+    """query of the annot_id of the latest annotation of each OTU of a set"""
+    return (annotations.select(fn.MAX(annotations.annot_id))
+                       .where(annotations.set_id == (set_id or 0))
+                       .group_by(annotations.otu_id))
+
+
+def rollup_query(models, set_id=None):
+    """query of (sample_id, *rank names, abundance, non-zero OTUs) of the
+    count rows of a set joined to the latest annotation of their OTU in
+    the set
+    """
+    counts, annotations = models.otu_counts, models.otu_annotation
+    lineages = models.otu_lineage
+    rank_names = [lineage_rank(models, rank) for rank in ranks]
+    abundance = counts.percent_abundance
+    return (counts.select(counts.sample_id, *rank_names, fn.SUM(abundance),
+                          fn.SUM(Case(None, [(abundance > 0, 1)], 0)))
+                  .join(annotations, on=((annotations.otu_id == counts.otu_id) &
+                                         (annotations.set_id == (set_id or 0)) &
+                                         annotations.annot_id.in_(
+                                             latest_annotations(annotations, set_id))))
+                  .join(lineages, JOIN.LEFT_OUTER,
+                        on=(annotations.lineage_id == lineages.lineage_id))
+                  .where(counts_in_set(counts, set_id))
+                  .group_by(counts.sample_id, *rank_names))
+
+
+def rollup_sums(query):
+    """{(sample_id, rank, taxon): [abundance, otu_count]} of a rollup_query"""
+    sums = defaultdict(lambda: [0.0, 0])
+    for sample_id, *names, abundance, otu_count in query.tuples():
+        for rank, taxon in zip(ranks, names):
+            cell = sums[(sample_id, rank, taxon or '')]
+            cell[0] += float(abundance or 0)
+            cell[1] += int(otu_count or 0)
+    return sums
+
+
+def add_sums(model, set_id, sums, batch_size=DEFAULT_BATCH_SIZE):
+    """add sums to the rollup rows of a set, creating missing rows"""
+    rows = [dict(set_id=set_id or 0, sample_id=sample_id, rank=rank, taxon=taxon,
+                 abundance=abundance, otu_count=otu_count)
+            for (sample_id, rank, taxon), (abundance, otu_count) in sums.items()]
+    if isinstance(real_database(model._meta.database), MySQLDatabase):
+        update = {model.abundance: model.abundance + fn.VALUES(model.abundance),
+                  model.otu_count: model.otu_count + fn.VALUES(model.otu_count)}
+        conflict = dict(update=update)
+    else:
+        update = {model.abundance: model.abundance + EXCLUDED.abundance,
+                  model.otu_count: model.otu_count + EXCLUDED.otu_count}
+        conflict = dict(conflict_target=[model.set_id, model.rank, model.taxon,
+                                         model.sample_id],
+                        update=update)
+    for chunk in chunked(rows, batch_size):
+        model.insert_many(chunk).on_conflict(**conflict).execute()
+    return len(rows)
+
+
+def rebuild_rollups(models, set_id=None, batch_size=DEFAULT_BATCH_SIZE):
+    """recompute the rollups of a set (of all sets if set_id is None) from
+    otu_counts and otu_annotation; return rollup rows written
+    """
+    rollup, annotations = models.otu_taxon_rollup, models.otu_annotation
+    if set_id is None:
+        set_ids = [s for s, in annotations.select(annotations.set_id).distinct().tuples()]
+    else:
+        set_ids = [set_id]
+    written = 0
+    started = time.perf_counter()
+    with rollup._meta.database.atomic():
+        if set_id is None:
+            rollup.delete().execute()
+        for set_key in set_ids:
+            rollup.delete().where(rollup.set_id == (set_key or 0)).execute()
+            # annotations of set 0 go with the counts imported without a set
+            sums = rollup_sums(rollup_query(models, set_key or None))
+            written += add_sums(rollup, set_key, sums, batch_size)
+    log.info('Rebuilt %s taxon rollup rows of %s sets in %.2fs',
+             written, len(set_ids), time.perf_counter() - started)
+    return written
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Classes ~~~~~
+
+@attr.s
+class TaxonRollup(object):
+    """Adds the rows an importer writes to the rollups of their set,
+    within the importer's transaction:
+
+        rollup = TaxonRollup(tables.models, set_id, 'otu_counts')
+        rollup.begin()
+        ...  # write (and flush) a chunk of otu_counts rows
+        rollup.update()
+        txn.commit()
+
+    `table` is the table written, otu_counts or otu_annotation; its rows
+    with ids above those at begin() (or at the last update) are added.
+    New annotations of OTUs already annotated in the set replace the old
+    ones in the sums, by rebuilding the set's rollups.
+    """
+    models = attr.ib(repr=False)
+    set_id: int = attr.ib()
+    table: str = attr.ib(default='otu_counts')
+    batch_size: int = attr.ib(default=DEFAULT_BATCH_SIZE)
+    last_id: int = attr.ib(init=False, default=0)
+    added: int = attr.ib(init=False, default=0)
+
+    @property
+    def id_field(self):
+        model = self.models[self.table]
+        return model._meta.primary_key
+
+
+    def max_id(self):
+        field = self.id_field
+        return field.model.select(fn.MAX(field)).scalar() or 0
+
+
+    def begin(self):
+        """rows written from now on are added by update()"""
+        self.last_id = self.max_id()
+
+
+    def superseded(self, top):
+        """True if annotations up to `top` replace ones of the set written
+        before the last update
+        """
+        if self.table != 'otu_annotation':
+            return False
+        annotations = self.models.otu_annotation
+        in_set = annotations.set_id == (self.set_id or 0)
+        new_otus = (annotations.select(annotations.otu_id)
+                               .where(in_set & (annotations.annot_id > self.last_id) &
+                                      (annotations.annot_id <= top)))
+        return (annotations.select()
+                           .where(in_set & (annotations.annot_id <= self.last_id) &
+                                  annotations.otu_id.in_(new_otus))
+                           .exists())
+
+
+    def update(self):
+        """add the rows written since begin() or the last update"""
+        top = self.max_id()
+        if top <= self.last_id:
+            return 0
+        if self.superseded(top):
+            written = rebuild_rollups(self.models, self.set_id or 0, self.batch_size)
+            self.added += written
+            self.last_id = top
+            return written
+        new_rows = (self.id_field > self.last_id) & (self.id_field <= top)
+        sums = rollup_sums(rollup_query(self.models, self.set_id).where(new_rows))
+        written = add_sums(self.models.otu_taxon_rollup, self.set_id, sums, self.batch_size)
+        self.added += written
+        self.last_id = top
+        log.debug(f'Rollups of set {self.set_id or 0}: {written} rows updated '
+                  f'for {self.table} rows up to {top}')
+        return written
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Queries ~~~~~
+
+def taxon_abundances(models, rank, set_id=None, samples=None):
+    """query of (sample_name, taxon, abundance, otu_count) rows of the
+    rollups of a set at `rank`, of all samples or those named
+    """
+    if rank not in ranks:
+        raise ValueError(f'Unknown rank {rank!r}, not one of {ranks}')
+    rollup, sample_info = models.otu_taxon_rollup, models.sample_info
+    query = (rollup.select(sample_info.sample_name, rollup.taxon, rollup.abundance,
+                           rollup.otu_count)
+                   .join(sample_info, on=(rollup.sample_id == sample_info.sample_id))
+                   .where((rollup.set_id == (set_id or 0)) & (rollup.rank == rank))
+                   .order_by(rollup.taxon, sample_info.sample_name))
+    if samples is not None:
+        query = query.where(sample_info.sample_name.in_(list(samples)))
+    return query.tuples()
@@ -0,0 +1,103 @@
+"""On-disk cache of the reflected database schema.
+
+Reflecting every table (columns, keys, indexes) costs several round trips
+per table. The result is pickled under `cache_dir`, keyed by a fingerprint
+of the schema: a hash of the column/index/key definitions that the database
+reports in one cheap catalog query. A changed schema has a new fingerprint
+and is reflected again.
+"""
+
+import os
+import pickle
+import hashlib
+
+from peewee import MySQLDatabase, SqliteDatabase
+from playhouse.reflection import Introspector
+
+from .utils import log_it
+
+
+log = log_it(logname='otudb.schema_cache')
+
+# everything the Introspector reads about the MySQL schema
+mysql_fingerprint_sql = """
+SELECT 'c', TABLE_NAME, COLUMN_NAME, COLUMN_TYPE, IS_NULLABLE,
+       COLUMN_KEY, COLUMN_DEFAULT, EXTRA, ORDINAL_POSITION
+  FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE()
+UNION ALL
+SELECT 'i', TABLE_NAME, INDEX_NAME, COLUMN_NAME, NON_UNIQUE,
+       NULL, NULL, NULL, SEQ_IN_INDEX
+  FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = DATABASE()
+UNION ALL
+SELECT 'k', TABLE_NAME, CONSTRAINT_NAME, COLUMN_NAME, REFERENCED_TABLE_NAME,
+       REFERENCED_COLUMN_NAME, NULL, NULL, ORDINAL_POSITION
+  FROM information_schema.KEY_COLUMN_USAGE WHERE TABLE_SCHEMA = DATABASE()
+ORDER BY 1, 2, 3, 9
+"""
+
+sqlite_fingerprint_sql = """
+SELECT type, name, tbl_name, sql FROM sqlite_master ORDER BY type, name
+"""
+
+
+def schema_fingerprint(db):
+    """hex digest of the schema definition, or None if not supported"""
+    if isinstance(db, MySQLDatabase):
+        sql = mysql_fingerprint_sql
+    elif isinstance(db, SqliteDatabase):
+        sql = sqlite_fingerprint_sql
+    else:
+        return None
+    digest = hashlib.sha1(type(db).__name__.encode())
+    digest.update(str(db.database).encode())
+    for row in db.execute_sql(sql).fetchall():
+        digest.update(repr(row).encode())
+    return digest.hexdigest()
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Classes ~~~~~
+
+class CachedIntrospector(Introspector):
+    """Introspector that reuses pickled metadata of an unchanged schema"""
+    cache_dir = None
+
+    @classmethod
+    def from_database(cls, database, schema=None, cache_dir=None):
+        introspector = super().from_database(database, schema=schema)
+        introspector.cache_dir = cache_dir
+        return introspector
+
+
+    def cache_path(self, fingerprint):
+        return os.path.join(self.cache_dir, f'schema-{fingerprint}.pickle')
+
+
+    def introspect(self, table_names=None, *args, **kwargs):
+        db = self.metadata.database
+        fingerprint = schema_fingerprint(db) if self.cache_dir else None
+        if fingerprint is None or table_names is not None:
+            return super().introspect(table_names, *args, **kwargs)
+
+        cache_file = self.cache_path(fingerprint)
+        try:
+            with open(cache_file, 'rb') as fh:
+                cached = pickle.load(fh)
+            if cached['fingerprint'] == fingerprint:
+                log.info(f'Using cached schema {cache_file}')
+                return cached['metadata']
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            log.warning(f'Ignoring unreadable schema cache {cache_file}: {e!s}')
+
+        metadata = super().introspect(table_names, *args, **kwargs)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_file = f'{cache_file}.{os.getpid()}'
+            with open(tmp_file, 'wb') as fh:
+                pickle.dump({'fingerprint': fingerprint, 'metadata': metadata}, fh)
+            os.replace(tmp_file, cache_file)
+            log.info(f'Cached schema to {cache_file}')
+        except Exception as e:
+            log.warning(f'Cannot write schema cache {cache_file}: {e!s}')
+        return metadata
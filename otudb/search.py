@@ -0,0 +1,363 @@
+"""Nearest-OTU search: which stored OTU sequences look like a sequence?
+
+Each stored sequence is reduced to a sketch, the k-mers whose (mixed) hash
+is a multiple of `scale`, about 1/scale of its distinct k-mers. The
+postings of all sketches are kept as segments of sorted NumPy arrays
+saved under the cache_dir, memory mapped when searched (so worker
+processes share the pages). A query is sketched the same way, and stored sequences are ranked
+by the k-mers they share with it; identity is estimated from the Jaccard
+index of the two sketches as Mash does: (2J / (1 + J)) ** (1/k).
+
+The index is extended with the otu_seq rows added since it was built
+(`update`, run after each FASTA import once an index exists), a segment
+of their sketches added (and small segments merged) without rewriting
+the rest, and can be rebuilt from scratch (`rebuild`).
+"""
+
+import os
+import json
+import fcntl
+import hashlib
+import itertools
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import attr
+import numpy as np
+
+from . import db_config
+from .export import stream_rows, FETCH_SIZE
+from .kmers import kmer_array
+from .parsers import FastaParser
+from .resolver import chunked
+from .utils import log_it
+
+
+log = log_it(logname='otudb.search')
+
+SEARCH_K = 16
+SEARCH_SCALE = 8
+TOP_N = 10
+# query sequences per task of the process pool
+QUERY_BATCH = 500
+
+index_arrays = ('hashes', 'postings', 'seq_ids', 'sizes')
+
+
+def index_dir():
+    """directory of the search index of the configured db, under cache_dir"""
+    config = db_config.get_db_config()
+    name = hashlib.sha1(config['url'].encode('utf-8')).hexdigest()[:12]
+    return os.path.join(config['cache_dir'], f'kmer_index-{name}')
+
+
+def mix(kmers):
+    """well-mixed 64 bit hashes of packed k-mers (splitmix64 finalizer)"""
+    h = kmers.astype(np.uint64, copy=True)
+    with np.errstate(over='ignore'):
+        h ^= h >> np.uint64(30)
+        h *= np.uint64(0xbf58476d1ce4e5b9)
+        h ^= h >> np.uint64(27)
+        h *= np.uint64(0x94d049bb133111eb)
+        h ^= h >> np.uint64(31)
+    return h
+
+
+def sketch(sequence, k=SEARCH_K, scale=SEARCH_SCALE):
+    """sorted distinct hashes of the k-mers of sequence kept at this scale"""
+    kmers, valid = kmer_array(sequence, k)
+    hashes = mix(np.unique(kmers[valid]))
+    return np.sort(hashes[hashes % np.uint64(scale) == 0])
+
+
+def estimated_identity(shared, query_size, target_sizes, k=SEARCH_K):
+    """identity estimated from the shared sketch hashes (Mash distance)"""
+    union = query_size + target_sizes - shared
+    jaccard = np.divide(shared, union, out=np.zeros(len(shared)), where=union > 0)
+    with np.errstate(divide='ignore'):
+        return np.where(jaccard > 0, (2 * jaccard / (1 + jaccard)) ** (1 / k), 0.0)
+
+
+def sorted_segment(hashes, postings, seq_ids, sizes):
+    """index arrays of the sketches (hashes) of sequences and their
+    postings (rows of seq_ids), sorted by hash
+    """
+    all_hashes = np.concatenate(hashes) if hashes else np.zeros(0, dtype=np.uint64)
+    # runs of sorted hashes: the stable sort (timsort) merges them
+    order = np.argsort(all_hashes, kind='stable')
+    return dict(hashes=all_hashes[order],
+                postings=(np.concatenate(postings) if postings
+                          else np.zeros(0, dtype=np.int32))[order],
+                seq_ids=np.array(seq_ids, dtype=np.int64),
+                sizes=np.array(sizes, dtype=np.int32))
+
+
+def merge_segments(segments):
+    """one segment of the index arrays of segments, postings renumbered"""
+    offsets = np.cumsum([0] + [len(arrays['seq_ids']) for arrays in segments[:-1]])
+    return sorted_segment([arrays['hashes'] for arrays in segments],
+                          [arrays['postings'] + np.int32(offset)
+                           for arrays, offset in zip(segments, offsets)],
+                          np.concatenate([arrays['seq_ids'] for arrays in segments]),
+                          np.concatenate([arrays['sizes'] for arrays in segments]))
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Classes ~~~~~
+
+@attr.s(cmp=False)
+class SearchIndex(object):
+    """Sketch postings of the stored sequences, in `directory`, as
+    segments of arrays:
+
+        hashes    sorted sketch hashes (uint64)
+        postings  for each hash, the sequence holding it (row of seq_ids)
+        seq_ids   otu_seq.seq_id of each sequence of the segment
+        sizes     sketch size of each sequence of the segment
+
+    saved as <segment>.<name>.npy, with index.json naming the current
+    segments, so searches never see a half written index.
+
+    An update sorts only the sketches of the new sequences, into a segment
+    of their own. A segment is merged into the one before it once it holds
+    half as many postings, so there are a logarithmic number of segments
+    to search and each posting is rewritten a logarithmic number of times.
+
+        index = SearchIndex()
+        index.update(db, tables.models)
+        hits = index.search(['ACGT...'], top=5)
+    """
+    directory: str = attr.ib(default=None)
+    k: int = attr.ib(default=SEARCH_K)
+    scale: int = attr.ib(default=SEARCH_SCALE)
+    meta: dict = attr.ib(init=False, default=None, repr=False)
+    segments: list = attr.ib(init=False, default=None, repr=False)
+
+    def __attrs_post_init__(self):
+        if self.directory is None:
+            self.directory = index_dir()
+
+
+    @property
+    def meta_file(self):
+        return os.path.join(self.directory, 'index.json')
+
+
+    def exists(self):
+        return os.path.exists(self.meta_file)
+
+
+    def array_file(self, segment, name):
+        return os.path.join(self.directory, f'{segment}.{name}.npy')
+
+
+    def load(self):
+        """memory map the arrays of the current segments; False if there
+        is no index
+        """
+        try:
+            with open(self.meta_file, 'r') as fh:
+                self.meta = json.load(fh)
+        except FileNotFoundError:
+            return False
+        self.k, self.scale = self.meta['k'], self.meta['scale']
+        self.segments = [(segment, {name: np.load(self.array_file(segment, name),
+                                                  mmap_mode='r')
+                                    for name in index_arrays})
+                         for segment in self.meta['segments']]
+        return True
+
+
+    def empty(self, last_segment=0):
+        self.meta = dict(k=self.k, scale=self.scale, segments=[],
+                         last_segment=last_segment, last_seq_id=0)
+        self.segments = []
+
+
+    @contextmanager
+    def locked(self):
+        """exclusive lock of the index directory while it is written"""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, 'lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+    def save(self, segments, last_seq_id, previous=()):
+        """write the new segments (those without a number), then switch
+        index.json to `segments` and drop the files of the others of
+        `previous`
+        """
+        last_segment = self.meta['last_segment']
+        numbered = []
+        for segment, arrays in segments:
+            if segment is None:
+                last_segment += 1
+                segment = last_segment
+                for name in index_arrays:
+                    np.save(self.array_file(segment, name), arrays[name])
+            numbered.append((segment, arrays))
+        meta = dict(k=self.k, scale=self.scale, segments=[n for n, _ in numbered],
+                    last_segment=last_segment, last_seq_id=last_seq_id,
+                    sequences=sum(len(arrays['seq_ids']) for _, arrays in numbered),
+                    postings=sum(len(arrays['hashes']) for _, arrays in numbered))
+        tmp_file = f'{self.meta_file}.{os.getpid()}'
+        with open(tmp_file, 'w') as fh:
+            json.dump(meta, fh)
+        os.replace(tmp_file, self.meta_file)
+        for segment in set(previous) - set(meta['segments']):
+            for name in index_arrays:
+                try:
+                    os.remove(self.array_file(segment, name))
+                except FileNotFoundError:
+                    pass
+        self.meta = meta
+        self.load()
+
+
+    def new_sequences(self, db, models, fetch_size=FETCH_SIZE):
+        """(seq_id, sequence) of the stored sequences not indexed yet"""
+        seqs = models.otu_seq
+        query = (seqs.select(seqs.seq_id, seqs.sequence)
+                     .where((seqs.seq_id > self.meta['last_seq_id']) &
+                            seqs.sequence.is_null(False))
+                     .order_by(seqs.seq_id))
+        return stream_rows(db, query, fetch_size)
+
+
+    def update(self, db, models, rebuild=False):
+        """add the sequences stored since the index was built (all of them
+        if `rebuild`); return the number added
+        """
+        with self.locked():
+            k, scale = self.k, self.scale
+            loaded = self.load()
+            previous = self.meta['segments'] if loaded else []
+            if rebuild or not loaded:
+                # a rebuild takes this index's k and scale, not the saved ones
+                self.k, self.scale = k, scale
+                self.empty(self.meta['last_segment'] if loaded else 0)
+            hashes, postings, seq_ids, sizes = [], [], [], []
+            last_seq_id = self.meta['last_seq_id']
+            for seq_id, sequence in self.new_sequences(db, models):
+                sketched = sketch(sequence, self.k, self.scale)
+                hashes.append(sketched)
+                postings.append(np.full(len(sketched), len(seq_ids), dtype=np.int32))
+                seq_ids.append(seq_id)
+                sizes.append(len(sketched))
+                last_seq_id = seq_id
+            if not seq_ids and loaded and not rebuild:
+                return 0
+            segments = self.segments + [(None, sorted_segment(hashes, postings,
+                                                              seq_ids, sizes))]
+            while (len(segments) > 1 and len(segments[-2][1]['hashes']) <=
+                   2 * len(segments[-1][1]['hashes'])):
+                merged = merge_segments([arrays for _, arrays in segments[-2:]])
+                segments[-2:] = [(None, merged)]
+            self.save(segments, last_seq_id, previous)
+        log.info(f'Search index: {len(seq_ids)} sequences added, '
+                 f'{self.meta["sequences"]} indexed in {len(self.segments)} segments '
+                 f'in {self.directory}')
+        return len(seq_ids)
+
+
+    def search(self, sequences, top=TOP_N):
+        """for each query sequence, a list of up to `top` hits
+        (seq_id, shared hashes, query sketch size, estimated identity),
+        best first
+        """
+        if self.segments is None and not self.load():
+            raise FileNotFoundError(f'No search index in {self.directory}')
+        results = []
+        for sequence in sequences:
+            query = sketch(sequence, self.k, self.scale)
+            hit_ids, hit_shared, hit_sizes = [], [], []
+            # a sequence is in one segment: its hits add up within it
+            for _, arrays in self.segments:
+                hashes, postings = arrays['hashes'], arrays['postings']
+                start = np.searchsorted(hashes, query, side='left')
+                end = np.searchsorted(hashes, query, side='right')
+                found = [postings[s:e] for s, e in zip(start, end) if e > s]
+                if not found:
+                    continue
+                targets, shared = np.unique(np.concatenate(found), return_counts=True)
+                hit_ids.append(arrays['seq_ids'][targets])
+                hit_shared.append(shared)
+                hit_sizes.append(arrays['sizes'][targets])
+            if not hit_ids:
+                results.append([])
+                continue
+            seq_ids, shared, sizes = (np.concatenate(hit_ids), np.concatenate(hit_shared),
+                                      np.concatenate(hit_sizes))
+            identity = estimated_identity(shared, len(query), sizes, self.k)
+            best = np.lexsort((-identity, -shared))[:top]
+            results.append([(int(seq_ids[i]), int(shared[i]), len(query),
+                             round(float(identity[i]), 4)) for i in best])
+        return results
+
+
+def update_search_index(db, models):
+    """extend the search index of the db, if one has been built"""
+    index = SearchIndex()
+    if index.exists():
+        return index.update(db, models)
+    return 0
+
+
+def otu_names(models, seq_ids):
+    """{seq_id: otu_name} of seq_ids"""
+    seqs = models.otu_seq
+    names = {}
+    for ids in chunked(set(seq_ids)):
+        names.update(seqs.select(seqs.seq_id, seqs.otu_name)
+                         .where(seqs.seq_id.in_(ids)).tuples())
+    return names
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Process pool ~~~~~
+# each worker memory maps the index once, the pages are shared
+
+worker_index = None
+
+
+def init_search_worker(directory):
+    global worker_index
+    worker_index = SearchIndex(directory)
+    worker_index.load()
+
+
+def search_batch(names, sequences, top):
+    """(name, hits) of a batch of queries, in a worker"""
+    return list(zip(names, worker_index.search(sequences, top)))
+
+
+def search_fasta(filepath, index, top=TOP_N, jobs=None, batch_size=QUERY_BATCH):
+    """yield (query name, hits) of each record of a FASTA file, in file
+    order. Batches of records are searched in a pool of `jobs` processes
+    (jobs=1: in this one), at most two batches per process in flight.
+    """
+    records = FastaParser(filepath, mode='r').load_data()
+    batches = iter(lambda: list(itertools.islice(records, batch_size)), [])
+    if jobs == 1:
+        for batch in batches:
+            names, sequences = zip(*batch)
+            yield from zip(names, index.search(sequences, top))
+        return
+    jobs = jobs or os.cpu_count()
+    # spawn, not fork: as for import_many
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=context,
+                             initializer=init_search_worker,
+                             initargs=(index.directory,)) as pool:
+        pending = deque()
+        for batch in batches:
+            names, sequences = zip(*batch)
+            pending.append(pool.submit(search_batch, names, sequences, top))
+            if len(pending) >= 2 * jobs:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
@@ -0,0 +1,13 @@
+"""Sequence helpers: normalizing and content digests of OTU sequences"""
+
+import hashlib
+
+
+def normalize_sequence(sequence):
+    """uppercase bases with any whitespace removed"""
+    return ''.join(sequence.split()).upper()
+
+
+def seq_digest(sequence):
+    """SHA-1 hex digest of the normalized sequence; equal sequences share it"""
+    return hashlib.sha1(normalize_sequence(sequence).encode('ascii')).hexdigest()
@@ -0,0 +1,183 @@
+"""Copy a staging (SQLite) otu db into the production db.
+
+Files are loaded fast into a local SQLite db (import_data.py --bulk-load,
+with OTUDB_URL pointing at it), checked, then copied over in large batches.
+Ids are remapped on the way:
+
+    samples     by sample_name (new names are added)
+    lineages    by lineage_digest (new lineages are added)
+    otu_seq     seq_ids shifted past the largest seq_id of the target
+    sets        analysis_set rows kept with their set_id (missing ones added)
+
+Rows of otu_counts, otu_annotation and otu_xref get new ids of the target.
+Each table is copied in its own transaction; the taxon rollups (and
+matrix cache generations) of the sets copied into are then rebuilt in
+one more. Copy a staging db once.
+"""
+
+import time
+
+from peewee import fn
+
+from .batch import BatchInserter
+from .export import stream_rows, FETCH_SIZE
+from .matrix_cache import bump_generation
+from .models import (sample_info, analysis_set, sample_analysis_sets, otu_seq,
+                     otu_counts, otu_annotation, otu_xref, otu_sample_totals,
+                     otu_lineage, import_ledger)
+from .rollup import rebuild_rollups
+from .utils import log_it
+
+
+log = log_it(logname='otudb.staging')
+
+# rows per INSERT into the target
+COPY_BATCH_SIZE = 5000
+
+
+def copy_table(source, source_model, target_model, batch_size=COPY_BATCH_SIZE,
+               fetch_size=FETCH_SIZE, map_row=None, skip=(), replace=False):
+    """stream the rows of source_model (a code-defined model, read from the
+    `source` db) into target_model, by column name. `map_row` may rewrite
+    a row (dict of column: value) or drop it (return None); `skip` columns
+    are not copied. Return rows written.
+    """
+    target_columns = target_model._meta.columns
+    columns = [column for column in source_model._meta.columns
+               if column in target_columns and column not in skip]
+    query = (source_model.select(*[source_model._meta.columns[c] for c in columns])
+                         .bind(source))
+    table = target_model._meta.table_name
+    log.info(f'Copying {table}')
+    try:
+        with target_model._meta.database.atomic():
+            with BatchInserter(target_model, batch_size, replace=replace) as batch:
+                for values in stream_rows(source, query, fetch_size):
+                    row = dict(zip(columns, values))
+                    if map_row is not None:
+                        row = map_row(row)
+                        if row is None:
+                            continue
+                    batch.add({target_columns[column]: value
+                               for column, value in row.items()})
+    except Exception as e:
+        log.error(f'Whoops copying {table}.')
+        raise e
+    return batch.report()
+
+
+def missing_keys(source, source_model, target_model, key):
+    """values of column `key` in the source table but not in the target"""
+    source_keys = {k for k, in source_model.select(source_model._meta.columns[key])
+                                           .bind(source).tuples()}
+    target_column = target_model._meta.columns[key]
+    target_keys = {k for k, in target_model.select(target_column).tuples()}
+    return source_keys - target_keys
+
+
+def id_map(source, source_model, target_model, key, id_column):
+    """{source id: target id} of the rows with equal `key` values"""
+    source_ids = {k: _id for _id, k in
+                  source_model.select(source_model._meta.columns[id_column],
+                                      source_model._meta.columns[key])
+                              .bind(source).tuples()}
+    ids = {}
+    query = target_model.select(target_model._meta.columns[id_column],
+                                target_model._meta.columns[key]).tuples()
+    for _id, k in query:
+        if k in source_ids:
+            ids.setdefault(source_ids[k], _id)
+    return ids
+
+
+def only_new(column, values):
+    """row function keeping the rows whose `column` is in `values`"""
+    return lambda row: row if row[column] in values else None
+
+
+def remap(*mappings):
+    """row function rewriting columns through id maps or offsets:
+    remap(('sample_id', samples), ('otu_id', 1000))
+    Rows whose id is not in a map are dropped.
+    """
+    def map_row(row):
+        for column, mapping in mappings:
+            value = row.get(column)
+            if value is None:
+                continue
+            if isinstance(mapping, int):
+                row[column] = value + mapping
+            elif value in mapping:
+                row[column] = mapping[value]
+            else:
+                return None
+        return row
+    return map_row
+
+
+def copy_database(source, models, batch_size=COPY_BATCH_SIZE, fetch_size=FETCH_SIZE):
+    """copy the otu tables of the `source` (staging) db into the db of
+    `models` (tables.models). Return {table: rows copied}.
+    """
+    started = time.perf_counter()
+    copied = {}
+
+    # analysis sets: kept by set_id
+    new = missing_keys(source, analysis_set, models.analysis_set, 'set_id')
+    copied['analysis_set'] = copy_table(source, analysis_set, models.analysis_set,
+                                        batch_size, fetch_size, only_new('set_id', new))
+
+    # samples: by name
+    new = missing_keys(source, sample_info, models.sample_info, 'sample_name')
+    copied['sample_info'] = copy_table(source, sample_info, models.sample_info,
+                                       batch_size, fetch_size, only_new('sample_name', new),
+                                       skip=('sample_id',))
+    samples = id_map(source, sample_info, models.sample_info, 'sample_name', 'sample_id')
+    copied['sample_analysis_sets'] = copy_table(
+        source, sample_analysis_sets, models.sample_analysis_sets, batch_size, fetch_size,
+        remap(('sample_id', samples)), replace=True)
+
+    # lineages: by digest
+    new = missing_keys(source, otu_lineage, models.otu_lineage, 'lineage_digest')
+    copied['otu_lineage'] = copy_table(source, otu_lineage, models.otu_lineage,
+                                       batch_size, fetch_size, only_new('lineage_digest', new),
+                                       skip=('lineage_id',))
+    lineages = id_map(source, otu_lineage, models.otu_lineage, 'lineage_digest', 'lineage_id')
+
+    # sequences: seq_ids shifted past those of the target
+    target_seq = models.otu_seq
+    offset = target_seq.select(fn.MAX(target_seq.seq_id)).scalar() or 0
+    log.info(f'Copied seq_ids are offset by {offset}')
+    copied['otu_seq'] = copy_table(source, otu_seq, target_seq, batch_size, fetch_size,
+                                   remap(('seq_id', offset)))
+
+    copied['otu_counts'] = copy_table(
+        source, otu_counts, models.otu_counts, batch_size, fetch_size,
+        remap(('otu_id', offset), ('sample_id', samples)), skip=('counts_id',))
+    copied['otu_annotation'] = copy_table(
+        source, otu_annotation, models.otu_annotation, batch_size, fetch_size,
+        remap(('otu_id', offset), ('lineage_id', lineages)), skip=('annot_id',))
+    # cached matrices and taxon rollups of the sets copied into are stale
+    set_ids = {set_id or 0 for set_id, in
+               otu_counts.select(otu_counts.set_id).distinct().bind(source).tuples()}
+    set_ids.update(set_id or 0 for set_id, in
+                   otu_annotation.select(otu_annotation.set_id).distinct().bind(source).tuples())
+    with models.otu_counts._meta.database.atomic():
+        for set_id in sorted(set_ids):
+            bump_generation(models, set_id)
+            rebuild_rollups(models, set_id, batch_size)
+    copied['otu_xref'] = copy_table(
+        source, otu_xref, models.otu_xref, batch_size, fetch_size,
+        remap(('otu_id_1', offset), ('otu_id_2', offset)), skip=('xref_id',))
+    copied['otu_sample_totals'] = copy_table(
+        source, otu_sample_totals, models.otu_sample_totals, batch_size, fetch_size,
+        remap(('sample_id', samples)), skip=('id',), replace=True)
+    copied['import_ledger'] = copy_table(
+        source, import_ledger, models.import_ledger, batch_size, fetch_size,
+        skip=('ledger_id',), replace=True)
+
+    rows = sum(copied.values())
+    elapsed = time.perf_counter() - started
+    log.info('Copied %s rows in %.2fs (%.0f rows/sec)',
+             rows, elapsed, rows / elapsed if elapsed else 0)
+    return copied
@@ -0,0 +1,130 @@
+"""Synthetic, reproducible input files for benchmarks and tests: sample
+metadata, FASTA, wide sparse otu tables and RDP / GreenGenes taxonomy.
+
+Every generator takes a `seed`, so the same arguments write the same file.
+Files named *.gz are written gzip compressed.
+"""
+
+import gzip
+import random
+
+from .taxonomy import ranks, rank_prefixes
+
+
+# a few named scales: (OTUs, samples, fraction of non-zero count cells)
+scales = {
+    'tiny':   (200, 10, 0.2),
+    'small':  (5000, 50, 0.05),
+    'medium': (50000, 200, 0.02),
+    'large':  (200000, 1000, 0.01),
+}
+
+BASES = 'ACGT'
+
+
+def open_output(filepath):
+    """text file for writing; gzip compressed if named *.gz"""
+    if filepath.endswith('.gz'):
+        return gzip.open(filepath, 'wt', newline='')
+    return open(filepath, 'w', newline='')
+
+
+def otu_name(n):
+    return f'OTU_{n}'
+
+
+def sample_name(n):
+    return f'S{n}'
+
+
+def write_samples(filepath, n_samples, seed=0):
+    """sample_info csv of n_samples samples; return rows written"""
+    rng = random.Random(seed)
+    with open_output(filepath) as fh:
+        fh.write('sample_name,sample_type,study,sex,cage,time\n')
+        for n in range(n_samples):
+            fh.write(f'{sample_name(n)},feces,synthetic,{rng.choice("MF")},'
+                     f'{rng.randint(1, 20)},{rng.randint(0, 52)}\n')
+    return n_samples
+
+
+def random_sequence(rng, min_length=250, max_length=1500):
+    return ''.join(rng.choices(BASES, k=rng.randint(min_length, max_length)))
+
+
+def write_fasta(filepath, n_otus, min_length=250, max_length=1500, line_width=80,
+                duplicates=0.05, seed=0):
+    """FASTA of n_otus sequences of min_length..max_length bases, wrapped at
+    line_width. A `duplicates` fraction repeats an earlier sequence, as
+    OTUs of different runs do. Return records written.
+    """
+    rng = random.Random(seed)
+    sequences = []
+    with open_output(filepath) as fh:
+        for n in range(n_otus):
+            if sequences and rng.random() < duplicates:
+                seq = rng.choice(sequences)
+            else:
+                seq = random_sequence(rng, min_length, max_length)
+                if len(sequences) < 1000:
+                    sequences.append(seq)
+            fh.write(f'>{otu_name(n)}\n')
+            fh.write('\n'.join(seq[i:i+line_width] for i in range(0, len(seq), line_width)))
+            fh.write('\n')
+    return n_otus
+
+
+def write_count_table(filepath, n_otus, n_samples, density=0.05, seed=0):
+    """wide otu_table.tsv of n_otus rows x n_samples columns of percent
+    abundances, a `density` fraction of cells non-zero. Return rows written.
+    """
+    rng = random.Random(seed)
+    k = max(1, round(density * n_samples))
+    with open_output(filepath) as fh:
+        fh.write('\t'.join(['OTUId'] + [sample_name(n) for n in range(n_samples)]) + '\n')
+        for n in range(n_otus):
+            values = ['0'] * n_samples
+            for column in rng.sample(range(n_samples), k):
+                values[column] = f'{rng.expovariate(10):.3f}'
+            fh.write(otu_name(n) + '\t' + '\t'.join(values) + '\n')
+    return n_otus
+
+
+def taxonomy_tree(width=(3, 12, 6, 5, 4, 4, 3)):
+    """all lineages of a tree with `width` children per node at each rank"""
+    lineages = [()]
+    for rank, children in zip(ranks, width):
+        lineages = [lineage + (f'{rank.title()}{len(lineage)}_{n}',)
+                    for lineage in lineages for n in range(children)]
+    return lineages
+
+
+def random_lineages(n_otus, seed=0):
+    """n_otus lineages drawn from a taxonomy tree, some left unclassified
+    below a random rank, as classifiers do
+    """
+    rng = random.Random(seed)
+    tree = taxonomy_tree()
+    for _ in range(n_otus):
+        lineage = rng.choice(tree)
+        depth = rng.randint(2, len(ranks))
+        yield lineage[:depth] + (None,) * (len(ranks) - depth)
+
+
+def write_rdp_taxa(filepath, n_otus, seed=0):
+    """RDP format taxa file (phylum..genus columns); return rows written"""
+    with open_output(filepath) as fh:
+        fh.write('\tphylum\tclass\torder\tfamily\tgenus\n')
+        for n, lineage in enumerate(random_lineages(n_otus, seed)):
+            fh.write('\t'.join([otu_name(n)] + [name or '' for name in lineage[1:6]]) + '\n')
+    return n_otus
+
+
+def write_gg_taxa(filepath, n_otus, seed=0):
+    """GreenGenes format taxa file (no header); return rows written"""
+    rng = random.Random(seed)
+    with open_output(filepath) as fh:
+        for n, lineage in enumerate(random_lineages(n_otus, seed)):
+            taxa = '; '.join(prefix + (name or '') for prefix, name in zip(rank_prefixes, lineage))
+            fh.write(f'{otu_name(n)}\t{rng.uniform(90, 100):.1f}\t{rng.random():.2e}\t{taxa}\n')
+    return n_otus
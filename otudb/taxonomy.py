@@ -0,0 +1,96 @@
+"""Taxonomic lineages: parsing RDP / GreenGenes annotations and interning
+each distinct lineage as one row of the otu_lineage table.
+"""
+
+import sys
+import hashlib
+
+import attr
+
+from .batch import BatchInserter, DEFAULT_BATCH_SIZE
+from .resolver import NameResolver
+from .utils import log_it
+
+
+log = log_it(logname='otudb.taxonomy')
+
+ranks = ('kingdom', 'phylum', 'class', 'order', 'family', 'genus', 'species')
+rank_prefixes = ('k__', 'p__', 'c__', 'o__', 'f__', 'g__', 's__')
+# otu_lineage field names of the ranks ("class" and "order" are reserved words)
+rank_fields = ('kingdom', 'phylum', 'class_', 'order_', 'family', 'genus', 'species')
+
+
+def intern_name(name):
+    """stripped, interned rank name; None if empty"""
+    name = name.strip() if name else ''
+    return sys.intern(name) if name else None
+
+
+def parse_gg_lineage(taxa):
+    """lineage tuple from a GreenGenes 'k__X; p__Y; ...' string"""
+    names = [None] * len(ranks)
+    for part in taxa.split(';'):
+        part = part.strip()
+        if part[:3] in rank_prefixes:
+            names[rank_prefixes.index(part[:3])] = intern_name(part[3:])
+    return tuple(names)
+
+
+def parse_rdp_lineage(row):
+    """lineage tuple from an RDP row dict of rank: name"""
+    return tuple(intern_name(row.get(rank)) for rank in ranks)
+
+
+def lineage_string(lineage):
+    """GreenGenes style string of a lineage tuple"""
+    return '; '.join(prefix + (name or '') for prefix, name in zip(rank_prefixes, lineage))
+
+
+def lineage_digest(lineage):
+    return hashlib.sha1(lineage_string(lineage).encode('utf-8')).hexdigest()
+
+
+#~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Classes ~~~~~
+
+@attr.s
+class LineageIndex(object):
+    """In-memory intern table of lineage tuple -> otu_lineage.lineage_id.
+
+    Each distinct lineage is inserted once; after that every OTU with it
+    only needs its id. All stored lineages are loaded in one query.
+    """
+    model = attr.ib(repr=False)
+    batch_size: int = attr.ib(default=DEFAULT_BATCH_SIZE)
+    ids: dict = attr.ib(init=False, default=attr.Factory(dict), repr=False)
+    created: int = attr.ib(init=False, default=0)
+    digests: NameResolver = attr.ib(init=False, repr=False)
+
+    @digests.default
+    def get_digests(self):
+        return NameResolver(self.model, 'lineage_digest', 'lineage_id')
+
+
+    def load(self):
+        """read every stored lineage's id"""
+        self.digests.load()
+        return len(self.digests)
+
+
+    def resolve(self, lineages):
+        """ids of `lineages` (tuples), inserting the ones not stored yet"""
+        wanted = [l for l in dict.fromkeys(lineages) if l not in self.ids]
+        if wanted:
+            keys = {l: lineage_digest(l) for l in wanted}
+            new = [l for l in wanted if keys[l] not in self.digests]
+            if new:
+                with BatchInserter(self.model, self.batch_size) as batch:
+                    for lineage in new:
+                        row = dict(zip(rank_fields, lineage))
+                        row.update(lineage_digest=keys[lineage],
+                                   lineage=lineage_string(lineage))
+                        batch.add(row)
+                self.digests.load(keys[l] for l in new)
+                self.created += len(new)
+            for lineage in wanted:
+                self.ids[lineage] = self.digests[keys[lineage]]
+        return [self.ids[l] for l in lineages]
@@ -0,0 +1,60 @@
+import pytest
+
+from peewee import SqliteDatabase, Model, CharField, IntegerField
+
+from ..batch import BatchInserter
+
+
+class TestBatchInserter(object):
+    """test BatchInserter"""
+
+    @pytest.fixture
+    def model(self):
+        # setup
+        db = SqliteDatabase(':memory:')
+
+        class otu_seq(Model):
+            otu_name = CharField()
+            seq_length = IntegerField()
+
+            class Meta:
+                database = db
+
+        db.create_tables([otu_seq])
+
+        # action!
+        yield otu_seq
+
+        # teardown
+        db.close()
+
+
+    def test_flush_by_rows(self, model):
+        with BatchInserter(model, batch_size=3) as batch:
+            for n in range(7):
+                batch.add({'otu_name': f'OTU_{n}', 'seq_length': n})
+            assert model.select().count() == 6
+        assert model.select().count() == 7
+        assert batch.row_count == 7
+        assert batch.flush_count == 3
+
+
+    def test_flush_by_bytes(self, model):
+        with BatchInserter(model, batch_size=1000, batch_bytes=12) as batch:
+            batch.add({'otu_name': 'OTU_1', 'seq_length': 1})
+            assert model.select().count() == 0
+            batch.add({'otu_name': 'OTU_2', 'seq_length': 2})
+            assert model.select().count() == 2
+
+
+    def test_no_flush_on_error(self, model):
+        with pytest.raises(RuntimeError):
+            with BatchInserter(model) as batch:
+                batch.add({'otu_name': 'OTU_1', 'seq_length': 1})
+                raise RuntimeError('bad row')
+        assert model.select().count() == 0
+
+
+    def test_bad_batch_size(self, model):
+        with pytest.raises(ValueError):
+            BatchInserter(model, batch_size=0)
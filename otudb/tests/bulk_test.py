@@ -0,0 +1,51 @@
+import pytest
+
+from peewee import SqliteDatabase
+
+from ..bulk import bulk_load, deferred_indexes, set_bulk_session
+from ..models import otu_counts
+
+
+class TestBulkLoad(object):
+    """test the bulk load settings and deferred indexes of SQLite dbs"""
+
+    @pytest.fixture
+    def db(self, tmpdir):
+        # setup
+        db = SqliteDatabase(str(tmpdir.join('otudb.sqlite')))
+        with db.bind_ctx([otu_counts]):
+            db.create_tables([otu_counts])
+
+            # action!
+            yield db
+
+        # teardown
+        db.close()
+
+
+    def index_names(self, db):
+        return sorted(index.name for index in db.get_indexes('otu_counts'))
+
+
+    def test_set_bulk_session(self, db):
+        set_bulk_session(db)
+        assert db.pragma('synchronous') == 0
+        set_bulk_session(db, on=False)
+        assert db.pragma('synchronous') == 1
+
+
+    def test_deferred_indexes(self, db):
+        indexes = self.index_names(db)
+        assert indexes == ['otu_counts_otu_id', 'otu_counts_sample_id']
+        with deferred_indexes(db, ['otu_counts', 'no_such_table']) as dropped:
+            assert len(dropped) == 2
+            assert self.index_names(db) == []
+        assert self.index_names(db) == indexes
+
+
+    def test_bulk_load(self, db):
+        with bulk_load(db):
+            otu_counts.insert_many([dict(otu_id=n, sample_id=1, counts=n)
+                                    for n in range(100)]).execute()
+        assert otu_counts.select().count() == 100
+        assert self.index_names(db) == ['otu_counts_otu_id', 'otu_counts_sample_id']
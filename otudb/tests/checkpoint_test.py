@@ -0,0 +1,47 @@
+import os
+import pytest
+
+from ..checkpoint import Checkpoint
+
+
+class TestCheckpoint(object):
+    """test Checkpoint"""
+
+    @pytest.fixture
+    def datafile(self, tmpdir):
+        # setup
+        filename = os.path.join(tmpdir, 'otu_table.tsv')
+        with open(filename, 'w') as fh:
+            fh.write('OTUId\tS1\nOTU_1\t1\n')
+
+        # action!
+        yield filename
+
+
+    def test_save_load(self, datafile, tmpdir):
+        directory = os.path.join(tmpdir, 'checkpoints')
+        Checkpoint(datafile, 'count', directory).save(10, 250, totals={'1': 2.5})
+
+        checkpoint = Checkpoint(datafile, 'count', directory)
+        assert checkpoint.begin(resume=True)
+        assert (checkpoint.rows, checkpoint.offset) == (10, 250)
+        assert checkpoint.state == {'totals': {'1': 2.5}}
+
+        checkpoint.clear()
+        assert not Checkpoint(datafile, 'count', directory).load()
+
+
+    def test_changed_file(self, datafile, tmpdir):
+        directory = os.path.join(tmpdir, 'checkpoints')
+        Checkpoint(datafile, 'count', directory).save(1, 15)
+        with open(datafile, 'a') as fh:
+            fh.write('OTU_2\t2\n')
+        checkpoint = Checkpoint(datafile, 'count', directory)
+        assert not checkpoint.load()
+        assert checkpoint.rows == 0
+
+
+    def test_per_filetype(self, datafile, tmpdir):
+        directory = os.path.join(tmpdir, 'checkpoints')
+        Checkpoint(datafile, 'count', directory).save(1, 15)
+        assert not Checkpoint(datafile, 'taxa', directory).begin(resume=True)
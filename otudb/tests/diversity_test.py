@@ -0,0 +1,130 @@
+import pytest
+import numpy as np
+
+from munch import Munch
+from peewee import SqliteDatabase
+
+from ..models import sample_info, otu_seq, otu_counts, otu_count_generation
+from ..matrix import SparseMatrix
+from ..matrix_cache import MatrixCache, bump_generation
+from ..diversity import compute, diversity, tile_size, sparse_enough
+
+diversity_models = [sample_info, otu_seq, otu_counts, otu_count_generation]
+
+
+def sparse(dense):
+    rows, columns = np.nonzero(dense)
+    return SparseMatrix.from_coo(rows, columns, dense[rows, columns], dense.shape)
+
+
+def pairwise(dense, distance):
+    samples = dense.T
+    return np.array([[distance(x, y) for y in samples] for x in samples])
+
+
+def braycurtis(x, y):
+    return 1 - 2 * np.minimum(x, y).sum() / (x + y).sum() if (x + y).sum() else 0.0
+
+
+def jaccard(x, y):
+    union = ((x > 0) | (y > 0)).sum()
+    return 1 - ((x > 0) & (y > 0)).sum() / union if union else 0.0
+
+
+class TestMetrics(object):
+    """test the metrics against their plain definitions"""
+
+    @pytest.fixture
+    def dense(self):
+        rng = np.random.default_rng(5)
+        dense = rng.integers(0, 4, size=(30, 12)).astype(float)
+        dense[:, 3] = 0
+        return dense
+
+
+    def test_alpha(self, dense):
+        values = sparse(dense)
+        assert compute(values, 'richness').tolist() == (dense > 0).sum(axis=0).tolist()
+        p = dense[:, 0] / dense[:, 0].sum()
+        p = p[p > 0]
+        assert compute(values, 'shannon')[0] == pytest.approx(-(p * np.log(p)).sum())
+        assert compute(values, 'simpson')[0] == pytest.approx(1 - (p * p).sum())
+        # an empty sample
+        assert compute(values, 'shannon')[3] == 0
+        assert compute(values, 'simpson')[3] == 0
+
+
+    @pytest.mark.parametrize('memory', [1, 10**4, 10**9])
+    def test_beta(self, dense, memory):
+        values = sparse(dense)
+        np.testing.assert_allclose(compute(values, 'braycurtis', memory, jobs=3),
+                                   pairwise(dense, braycurtis), atol=1e-12)
+        np.testing.assert_allclose(compute(values, 'jaccard', memory, jobs=3),
+                                   pairwise(dense, jaccard), atol=1e-6)
+
+
+    @pytest.mark.parametrize('memory', [1, 10**9])
+    def test_braycurtis_sparse(self, dense, memory):
+        # mostly zeros: summed from the pairs of cells of each OTU
+        dense[dense < 3] = 0
+        values = sparse(dense)
+        assert sparse_enough(values)
+        np.testing.assert_allclose(compute(values, 'braycurtis', memory, jobs=3),
+                                   pairwise(dense, braycurtis), atol=1e-12)
+
+
+    def test_tile_size(self):
+        # 9 ** 2 + 2 * 9 <= 100 < 10 ** 2 + 2 * 10
+        assert tile_size(1000, 10**4, memory=8 * 10**4 * 100, jobs=1) == 9
+        assert tile_size(1000, 10**4, memory=8 * 10**4 * 100, jobs=4) == 4
+        assert tile_size(3, 10, memory=10**9) == 3
+        # 24 * 80 ** 2 + 8 * 1000 * 80 <= 8 * 10**5 < 24 * 81 ** 2 + 8 * 1000 * 81
+        assert tile_size(1000, 1000, memory=8 * 10**5, cubic=False) == 80
+        with pytest.raises(ValueError):
+            compute(sparse(np.ones((2, 2))), 'unifrac')
+
+
+class TestDiversity(object):
+    """test diversity of a set, cached with its matrix"""
+
+    @pytest.fixture
+    def db(self):
+        # setup
+        db = SqliteDatabase(':memory:')
+        with db.bind_ctx(diversity_models):
+            db.create_tables(diversity_models)
+            otu_seq.insert_many([{'otu_name': f'OTU_{n}'} for n in (1, 2)]).execute()
+            sample_info.insert_many([{'sample_name': s} for s in ('S1', 'S2')]).execute()
+            otu_counts.insert_many([
+                dict(set_id=1, otu_id=1, sample_id=1, percent_abundance=1),
+                dict(set_id=1, otu_id=2, sample_id=1, percent_abundance=1),
+                dict(set_id=1, otu_id=2, sample_id=2, percent_abundance=2),
+            ]).execute()
+            db.models = Munch({m._meta.table_name: m for m in diversity_models})
+
+            # action!
+            yield db
+
+        # teardown
+        db.close()
+
+
+    def test_cached(self, db, tmpdir):
+        cache = MatrixCache(str(tmpdir.join('cache')))
+        result = diversity(db, db.models, 1, 'braycurtis', cache=cache)
+        assert result.samples == ['S1', 'S2']
+        assert result.values.tolist() == [[0, 0.5], [0.5, 0]]
+        assert list(result.rows()) == [('S1', 0, 0.5), ('S2', 0.5, 0)]
+        assert cache.load_result(1, 1, 'braycurtis') is not None
+
+        otu_counts.update(percent_abundance=1).where(otu_counts.sample_id == 2).execute()
+        # the cached result until an import moves the counts on
+        assert diversity(db, db.models, 1, 'braycurtis', cache=cache).values[0, 1] == 0.5
+        bump_generation(db.models, 1)
+        result = diversity(db, db.models, 1, 'braycurtis', cache=cache)
+        assert result.values[0, 1] == pytest.approx(1 / 3)
+        assert cache.load_result(1, 1, 'braycurtis') is None
+
+        result = diversity(db, db.models, 1, 'richness', cache=cache)
+        assert result.headers() == ['sample_name', 'richness']
+        assert list(result.rows()) == [('S1', 2), ('S2', 1)]
@@ -0,0 +1,70 @@
+import pytest
+
+from munch import Munch
+from peewee import (SqliteDatabase, Model, AutoField, IntegerField,
+                    CharField, FloatField)
+
+from ..export import export_long, export_wide, stream_rows
+
+
+class TestExport(object):
+    """test export_long and export_wide of otu counts"""
+
+    @pytest.fixture
+    def db(self):
+        # setup
+        db = SqliteDatabase(':memory:')
+
+        class BaseModel(Model):
+            class Meta:
+                database = db
+
+        class otu_seq(BaseModel):
+            seq_id = AutoField()
+            otu_name = CharField()
+
+        class sample_info(BaseModel):
+            sample_id = AutoField()
+            sample_name = CharField()
+
+        class otu_counts(BaseModel):
+            counts_id = AutoField()
+            set_id = IntegerField(null=True)
+            otu_id = IntegerField()
+            sample_id = IntegerField()
+            percent_abundance = FloatField()
+
+        db.create_tables([otu_seq, sample_info, otu_counts])
+        otu_seq.insert_many([{'otu_name': f'OTU_{n}'} for n in (1, 2, 3)]).execute()
+        sample_info.insert_many([{'sample_name': s} for s in ('S1', 'S2')]).execute()
+        otu_counts.insert_many([
+            dict(set_id=1, otu_id=2, sample_id=2, percent_abundance=5),
+            dict(set_id=1, otu_id=1, sample_id=1, percent_abundance=1),
+            dict(set_id=1, otu_id=2, sample_id=1, percent_abundance=2),
+            dict(set_id=2, otu_id=3, sample_id=1, percent_abundance=9),
+        ]).execute()
+        db.models = Munch(otu_seq=otu_seq, sample_info=sample_info, otu_counts=otu_counts)
+
+        # action!
+        yield db
+
+        # teardown
+        db.close()
+
+
+    def test_stream_rows(self, db):
+        query = db.models.otu_seq.select(db.models.otu_seq.otu_name)
+        assert list(stream_rows(db, query, fetch_size=2)) == [('OTU_1',), ('OTU_2',), ('OTU_3',)]
+
+
+    def test_long(self, db):
+        headers, rows = export_long(db, db.models, 'count', set_id=1)
+        assert headers == ['set_id', 'otu_name', 'sample_name', 'percent_abundance']
+        assert sorted(rows) == [(1, 'OTU_1', 'S1', 1), (1, 'OTU_2', 'S1', 2),
+                                (1, 'OTU_2', 'S2', 5)]
+
+
+    def test_wide(self, db):
+        headers, rows = export_wide(db, db.models, set_id=1, fetch_size=1)
+        assert headers == ['OTUId', 'S1', 'S2']
+        assert list(rows) == [('OTU_1', 1, 0), ('OTU_2', 2, 5)]
@@ -0,0 +1,146 @@
+import os
+import pytest
+
+from peewee import SqliteDatabase
+
+import import_data
+from .. import db_config
+from ..database import otudb, tables
+from ..rarefaction import rarefy, store_rarefied
+
+
+class TestImport(object):
+    """test importing files into a SQLite otu db"""
+
+    @pytest.fixture
+    def db(self, tmpdir, monkeypatch):
+        # setup
+        filename = os.path.join(tmpdir, 'otudb.sqlite')
+        db = SqliteDatabase(filename)
+        config = {'url': f'sqlite:///{filename}', 'charset': None,
+                  'cache_dir': str(tmpdir), 'pool': {}}
+        monkeypatch.setattr(db_config, 'get_db_config', lambda: config)
+        monkeypatch.setattr(tables, 'cache_dir', str(tmpdir))
+        monkeypatch.setattr(tables, '_models', None)
+        otudb.initialize(db)
+
+        # action!
+        yield db
+
+        # teardown
+        otudb.initialize(None)
+        tables._models = None
+        db.close()
+
+
+    @pytest.fixture
+    def samplefile(self, tmpdir):
+        filename = os.path.join(tmpdir, 'samples.csv')
+        with open(filename, 'w') as fh:
+            fh.write('sample_name,sample_type,study,sex,cage,time\n')
+            for n in range(5):
+                fh.write(f'S{n},feces,synthetic,F,{n},{n * 7}\n')
+        return filename
+
+
+    def test_resume(self, db, samplefile, monkeypatch):
+        commit_checkpoint = import_data.commit_checkpoint
+        commits = []
+        def fail_second(*args, **kwargs):
+            commits.append(args[2])
+            if len(commits) == 2:
+                raise RuntimeError('lost the connection')
+            commit_checkpoint(*args, **kwargs)
+
+        monkeypatch.setattr(import_data, 'commit_checkpoint', fail_second)
+        with pytest.raises(RuntimeError):
+            import_data.sample_import(samplefile, commit_rows=2)
+        sample_info = tables.models.sample_info
+        assert [s.sample_name for s in sample_info.select()] == ['S0', 'S1']
+
+        # carries on past the committed rows, the header read first
+        monkeypatch.setattr(import_data, 'commit_checkpoint', commit_checkpoint)
+        import_data.sample_import(samplefile, commit_rows=2, resume=True)
+        samples = sample_info.select().order_by(sample_info.sample_id)
+        assert [(s.sample_name, s.cage) for s in samples] == \
+            [(f'S{n}', str(n)) for n in range(5)]
+
+
+    def test_rarefy_imported(self, db, samplefile, tmpdir):
+        fasta = os.path.join(tmpdir, 'otus.fasta')
+        with open(fasta, 'w') as fh:
+            fh.write(''.join(f'>OTU_{n}\nACGT{"ACGT" * n}\n' for n in (1, 2, 3)))
+        table = os.path.join(tmpdir, 'otu_table.tsv')
+        with open(table, 'w') as fh:
+            fh.write('OTUId\tS0\tS1\tS2\n'
+                     'OTU_1\t10\t0\t3\n'
+                     'OTU_2\t5\t8\t0\n'
+                     'OTU_3\t0\t4\t1\n')
+        import_data.import_file(samplefile, 'sample')
+        import_data.import_file(fasta, 'fasta')
+        import_data.import_file(table, 'count', set_id=1)
+
+        # read counts, with their percentages of the sample totals
+        counts = tables.models.otu_counts
+        cells = (counts.select(counts.counts, counts.percent_abundance)
+                       .where(counts.sample_id == 1).order_by(counts.otu_id))
+        assert [(c.counts, float(c.percent_abundance)) for c in cells] == \
+            [(10, 66.667), (5, 33.333)]
+
+        result = rarefy(db, tables.models, 1, depths=[4, 12], seed=3, jobs=1)
+        assert result.sample_names == ['S0', 'S1', 'S2']
+        assert result.columns == {4: [0, 1, 2], 12: [0, 1]}
+        assert result.tables[12][0].toarray().sum(axis=0).tolist() == [12, 12]
+        assert (result.tables[4][0].toarray() <= [[10, 0, 3], [5, 8, 0], [0, 4, 1]]).all()
+
+        set_id = store_rarefied(tables.models, result, 4)
+        totals = tables.models.otu_sample_totals
+        stored = totals.select(totals.total_abundance).where(totals.set_id == set_id)
+        assert [float(row.total_abundance) for row in stored] == [4.0] * 3
+
+        # relative abundances are stored as they are, without counts
+        with open(table, 'w') as fh:
+            fh.write('OTUId\tS0\tS1\n'
+                     'OTU_1\t0.25\t1\n'
+                     'OTU_2\t0.75\t0\n')
+        import_data.import_file(table, 'count', set_id=7)
+        cells = counts.select().where(counts.set_id == 7).order_by(counts.counts_id)
+        assert [(c.counts, float(c.percent_abundance)) for c in cells] == \
+            [(None, 0.25), (None, 1.0), (None, 0.75)]
+
+
+    def test_count_diff(self, db, samplefile, tmpdir):
+        fasta = os.path.join(tmpdir, 'otus.fasta')
+        with open(fasta, 'w') as fh:
+            fh.write('>OTU_1\nACGT\n>OTU_2\nACGTACGT\n')
+        table = os.path.join(tmpdir, 'otu_table.tsv')
+        with open(table, 'w') as fh:
+            fh.write('OTUId\tS0\tS1\nOTU_1\t1\t2\nOTU_2\t3\t2\n')
+        import_data.import_file(samplefile, 'sample')
+        import_data.import_file(fasta, 'fasta')
+        import_data.import_file(table, 'count', set_id=1)
+
+        # a changed count moves the percentages of its whole sample
+        with open(table, 'w') as fh:
+            fh.write('OTUId\tS0\tS1\nOTU_1\t1\t2\nOTU_2\t1\t2\n')
+        import_data.import_file(table, 'count', set_id=1)
+        counts = tables.models.otu_counts
+        cells = counts.select().order_by(counts.sample_id, counts.otu_id)
+        assert [(c.counts, float(c.percent_abundance)) for c in cells] == \
+            [(1, 50.0), (1, 50.0), (2, 50.0), (2, 50.0)]
+
+
+    def test_fasta_diff(self, db, tmpdir, caplog):
+        fasta = os.path.join(tmpdir, 'otus.fasta')
+        with open(fasta, 'w') as fh:
+            fh.write('>OTU_1\nACGTACGT\n>OTU_2\nACGTACGT\n>OTU_3\nTTTT\n')
+        import_data.import_file(fasta, 'fasta')
+
+        # OTU_2 is stored as an alias of OTU_1's sequence
+        with open(fasta, 'w') as fh:
+            fh.write('>OTU_1\nACGTACGT\n>OTU_2\nGGGGCCCC\n>OTU_3\nTTTT\n')
+        import_data.import_file(fasta, 'fasta')
+        changed = [record.getMessage() for record in caplog.records
+                   if 'different sequence' in record.getMessage()]
+        assert len(changed) == 1
+        assert "['OTU_2']" in changed[0]
@@ -0,0 +1,26 @@
+import numpy as np
+
+from ..kmers import kmer_array, kmer_set, KmerIndex
+
+
+class TestKmers(object):
+    """test k-mer packing and the KmerIndex"""
+
+    def test_kmer_array(self):
+        kmers, valid = kmer_array('ACGTNA', k=2)
+        assert kmers.tolist() == [0b0001, 0b0110, 0b1011, 0b1100, 0b0000]
+        assert valid.tolist() == [True, True, True, False, False]
+        assert kmer_array('AC', k=3)[0].tolist() == []
+
+
+    def test_kmer_set(self):
+        assert kmer_set('aaaa', k=2).tolist() == [0]
+
+
+    def test_index(self):
+        index = KmerIndex.build(['ACGTACGT', 'TTTT'], k=4, stride=2)
+        assert len(index) == 4
+        start, end = index.lookup(kmer_array('ACGT', k=4)[0])
+        postings = index.positions[start[0]:end[0]]
+        assert sorted(postings.tolist()) == [0, 4]
+        assert index.counts(np.array([0], dtype=np.uint64)).tolist() == [0]
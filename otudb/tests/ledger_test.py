@@ -0,0 +1,54 @@
+import os
+import pytest
+
+from ..models import import_ledger
+from ..ledger import ImportLedger, file_digest
+
+
+class TestImportLedger(object):
+    """test ImportLedger"""
+
+    @pytest.fixture
+    def ledger(self, tmpdir):
+        # setup
+        from peewee import SqliteDatabase
+        db = SqliteDatabase(':memory:')
+        with db.bind_ctx([import_ledger]):
+            db.create_tables([import_ledger])
+
+            # action!
+            yield ImportLedger(import_ledger)
+
+        # teardown
+        db.close()
+
+
+    @pytest.fixture
+    def datafile(self, tmpdir):
+        filename = os.path.join(tmpdir, 'otu_table.tsv')
+        with open(filename, 'w') as fh:
+            fh.write('OTUId\tS1\nOTU_1\t1\n')
+        return filename
+
+
+    def test_record(self, ledger, datafile):
+        digest = file_digest(datafile)
+        assert not ledger.is_imported(digest, 'count', 2)
+        assert ledger.previous(datafile, 'count', 2) is None
+
+        ledger.record(datafile, 'count', 2, digest, 1)
+        assert ledger.is_imported(digest, 'count', 2)
+        assert not ledger.is_imported(digest, 'count', None)
+        assert ledger.previous(datafile, 'count', 2).row_count == 1
+
+
+    def test_changed_file(self, ledger, datafile):
+        ledger.record(datafile, 'count', None, file_digest(datafile), 1)
+        with open(datafile, 'a') as fh:
+            fh.write('OTU_2\t2\n')
+        digest = file_digest(datafile)
+        assert not ledger.is_imported(digest, 'count')
+        assert ledger.previous(datafile, 'count').content_digest != digest
+
+        ledger.record(datafile, 'count', None, digest, 2)
+        assert import_ledger.select().count() == 1
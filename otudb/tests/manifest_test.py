@@ -0,0 +1,60 @@
+import os
+import json
+import pytest
+
+from ..manifest import (ManifestEntry, read_manifest, detect_filetype,
+                        scan_directory, schedule)
+
+
+class TestManifest(object):
+    """test manifest reading, type detection and scheduling"""
+
+    @pytest.fixture
+    def study(self, tmpdir):
+        # setup
+        files = {
+            'samples.csv': 'sample_name,sample_type\nS1,stool\n',
+            'otus.fasta': '>OTU_1\nACGT\n',
+            'otu_table.tsv': 'OTUId\tS1\nOTU_1\t1\n',
+            'taxa.txt': 'OTU_1\t99.0\t0.0\tk__Bacteria; p__Firmicutes\n',
+            'notes.txt': 'nothing to see\n',
+        }
+        for name, text in files.items():
+            with open(os.path.join(tmpdir, name), 'w') as fh:
+                fh.write(text)
+
+        # action!
+        yield str(tmpdir)
+
+
+    def test_detect_filetype(self, study):
+        assert detect_filetype(os.path.join(study, 'otus.fasta')) == 'fasta'
+        assert detect_filetype(os.path.join(study, 'otu_table.tsv')) == 'count'
+        assert detect_filetype(os.path.join(study, 'taxa.txt')) == 'taxa'
+        assert detect_filetype(os.path.join(study, 'samples.csv')) == 'sample'
+        assert detect_filetype(os.path.join(study, 'notes.txt')) is None
+
+
+    def test_schedule(self, study):
+        stages = schedule(scan_directory(study))
+        assert [sorted(e.filetype for e in stage) for stage in stages] == \
+            [['fasta', 'sample'], ['count'], ['taxa']]
+
+
+    def test_read_manifest(self, study):
+        manifest = os.path.join(study, 'manifest.json')
+        with open(manifest, 'w') as fh:
+            json.dump([{'filepath': 'otu_table.tsv', 'filetype': 'count', 'set_id': '2'}], fh)
+        assert read_manifest(manifest) == \
+            [ManifestEntry(os.path.join(study, 'otu_table.tsv'), 'count', 2)]
+
+        manifest = os.path.join(study, 'manifest.tsv')
+        with open(manifest, 'w') as fh:
+            fh.write('filepath\tfiletype\notus.fasta\tfasta\n')
+        assert read_manifest(manifest) == \
+            [ManifestEntry(os.path.join(study, 'otus.fasta'), 'fasta')]
+
+
+    def test_bad_filetype(self):
+        with pytest.raises(ValueError):
+            ManifestEntry('otu_table.biom', 'biom')
@@ -0,0 +1,116 @@
+import os
+import pytest
+
+from munch import Munch
+from peewee import SqliteDatabase
+
+from ..models import sample_info, otu_seq, otu_counts, otu_count_generation
+from ..matrix import abundance_matrix
+from ..matrix_cache import MatrixCache, bump_generation, count_generation
+
+cache_models = [sample_info, otu_seq, otu_counts, otu_count_generation]
+
+
+class TestMatrixCache(object):
+    """test caching, invalidating and evicting count matrices"""
+
+    @pytest.fixture
+    def db(self):
+        # setup
+        db = SqliteDatabase(':memory:')
+        with db.bind_ctx(cache_models):
+            db.create_tables(cache_models)
+            otu_seq.insert_many([{'otu_name': f'OTU_{n}'} for n in (1, 2, 3)]).execute()
+            sample_info.insert_many([{'sample_name': s} for s in ('S1', 'S2')]).execute()
+            otu_counts.insert_many([
+                dict(set_id=1, otu_id=1, sample_id=1, percent_abundance=1),
+                dict(set_id=1, otu_id=2, sample_id=2, percent_abundance=5),
+                dict(set_id=2, otu_id=3, sample_id=1, percent_abundance=9),
+            ]).execute()
+            bump_generation(Munch(otu_count_generation=otu_count_generation), 1)
+            db.models = Munch({m._meta.table_name: m for m in cache_models})
+
+            # action!
+            yield db
+
+        # teardown
+        db.close()
+
+
+    @pytest.fixture
+    def cache(self, tmpdir):
+        return MatrixCache(str(tmpdir.join('cache')))
+
+
+    def test_generation(self, db):
+        assert count_generation(db.models, 1) == 1
+        assert count_generation(db.models, 2) == 0
+        bump_generation(db.models, 1)
+        bump_generation(db.models)
+        assert count_generation(db.models, 1) == 2
+        assert count_generation(db.models, None) == 1
+
+
+    def test_cached(self, db, cache):
+        assert cache.open(1) is None
+        matrix = cache.matrix(db, db.models, 1)
+        assert matrix.rows == ['OTU_1', 'OTU_2']
+        assert matrix.columns == ['S1', 'S2']
+        assert matrix.dense().tolist() == [[1, 0], [0, 5]]
+        assert cache.meta(1)['generation'] == 1
+
+        # opened from the files while the generation holds
+        otu_counts.update(percent_abundance=7).where(otu_counts.otu_id == 1).execute()
+        matrix = cache.matrix(db, db.models, 1)
+        assert matrix.dense().tolist() == [[1, 0], [0, 5]]
+        assert cache.meta(1)['version'] == 1
+
+        # read again once an import moved it on
+        bump_generation(db.models, 1)
+        matrix = cache.matrix(db, db.models, 1)
+        assert matrix.dense().tolist() == [[7, 0], [0, 5]]
+        assert cache.meta(1)['version'] == 2
+        # the files of the old version are gone
+        assert sorted(os.listdir(cache.set_dir(1))) == sorted(
+            ['lock', 'meta.json'] + [f'2.{name}.npy' for name in
+                                     ('data', 'indices', 'indptr', 'rows', 'columns')])
+
+
+    def test_without_set(self, db, cache):
+        # counts imported without a set are one set of their own, not all sets
+        otu_counts.insert(otu_id=2, sample_id=1, percent_abundance=3).execute()
+        cached = cache.matrix(db, db.models, None)
+        uncached = abundance_matrix(db, db.models, None, sparse=True)
+        assert cached.dense().tolist() == uncached.dense().tolist() == [[3]]
+
+        # untouched by imports into the other sets
+        otu_counts.insert(set_id=2, otu_id=1, sample_id=2, percent_abundance=4).execute()
+        bump_generation(db.models, 2)
+        assert cache.matrix(db, db.models, None).dense().tolist() == [[3]]
+
+        otu_counts.insert(otu_id=3, sample_id=2, percent_abundance=6).execute()
+        bump_generation(db.models, None)
+        cached = cache.matrix(db, db.models, None)
+        uncached = abundance_matrix(db, db.models, None, sparse=True)
+        assert (cached.rows, cached.columns) == (uncached.rows, uncached.columns)
+        assert cached.dense().tolist() == uncached.dense().tolist() == [[3, 0], [0, 6]]
+
+
+    def test_older_not_written(self, db, cache):
+        matrix = cache.matrix(db, db.models, 1)
+        bump_generation(db.models, 1)
+        cache.matrix(db, db.models, 1)
+        assert not cache.write(1, 1, matrix)
+        assert cache.meta(1)['generation'] == 2
+
+
+    def test_evict(self, db, cache):
+        cache.matrix(db, db.models, 1)
+        cache.matrix(db, db.models, 2)
+        os.utime(cache.meta_file(2), (0, 0))
+        cache.open(1)
+        assert sorted(cache.usage()) == [1, 2]
+        cache.max_bytes = cache.usage()[1][0]
+        assert cache.evict() == [2]
+        assert cache.open(2) is None
+        assert cache.open(1) is not None
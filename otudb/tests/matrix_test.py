@@ -0,0 +1,79 @@
+import pytest
+import numpy as np
+
+from munch import Munch
+from peewee import SqliteDatabase
+
+from ..models import (sample_info, otu_seq, otu_counts, otu_annotation, otu_lineage)
+from ..matrix import abundance_matrix, SparseMatrix
+
+matrix_models = [sample_info, otu_seq, otu_counts, otu_annotation, otu_lineage]
+
+
+class TestAbundanceMatrix(object):
+    """test abundance_matrix of otu counts"""
+
+    @pytest.fixture
+    def db(self):
+        # setup
+        db = SqliteDatabase(':memory:')
+        with db.bind_ctx(matrix_models):
+            db.create_tables(matrix_models)
+            otu_seq.insert_many([{'otu_name': f'OTU_{n}'} for n in (1, 2, 3)]).execute()
+            sample_info.insert_many([{'sample_name': s} for s in ('S1', 'S2')]).execute()
+            otu_counts.insert_many([
+                dict(set_id=1, otu_id=2, sample_id=2, percent_abundance=5),
+                dict(set_id=1, otu_id=1, sample_id=1, percent_abundance=1),
+                dict(set_id=1, otu_id=2, sample_id=1, percent_abundance=2),
+                dict(set_id=1, otu_id=3, sample_id=2, percent_abundance=4),
+                dict(set_id=2, otu_id=3, sample_id=1, percent_abundance=9),
+            ]).execute()
+            otu_lineage.insert(lineage_digest='x', lineage='Bacteria;Firmicutes',
+                               kingdom='Bacteria', phylum='Firmicutes').execute()
+            otu_annotation.insert_many([
+                dict(set_id=1, otu_id=1, lineage_id=1),
+                dict(set_id=1, otu_id=2, lineage_id=1),
+            ]).execute()
+            db.models = Munch({m._meta.table_name: m for m in matrix_models})
+
+            # action!
+            yield db
+
+        # teardown
+        db.close()
+
+
+    def test_dense(self, db):
+        matrix = abundance_matrix(db, db.models, set_id=1, fetch_size=2)
+        assert matrix.rows == ['OTU_1', 'OTU_2', 'OTU_3']
+        assert matrix.columns == ['S1', 'S2']
+        assert matrix.values.tolist() == [[1, 0], [2, 5], [0, 4]]
+        assert matrix.row_index['OTU_2'] == 1
+
+
+    def test_sparse(self, db):
+        matrix = abundance_matrix(db, db.models, set_id=1, sparse=True)
+        assert matrix.sparse
+        assert matrix.values.nnz == 4
+        assert matrix.values.indptr.tolist() == [0, 1, 3, 4]
+        assert matrix.dense().tolist() == [[1, 0], [2, 5], [0, 4]]
+
+
+    def test_samples(self, db):
+        matrix = abundance_matrix(db, db.models, set_id=1, samples=['S2', 'S9'])
+        assert matrix.columns == ['S2']
+        assert matrix.values[:, 0].tolist() == [0, 5, 4]
+
+
+    def test_taxa_rank(self, db):
+        matrix = abundance_matrix(db, db.models, set_id=1, taxa_rank='phylum')
+        assert matrix.rows == ['Firmicutes', 'Unclassified']
+        assert matrix.values.tolist() == [[3, 5], [0, 4]]
+        with pytest.raises(ValueError):
+            abundance_matrix(db, db.models, set_id=1, taxa_rank='strain')
+
+
+    def test_from_coo(self):
+        sparse = SparseMatrix.from_coo(np.array([1, 0, 1]), np.array([2, 0, 2]),
+                                       np.array([1.0, 2.0, 3.0]), (2, 3))
+        assert sparse.toarray().tolist() == [[2, 0, 0], [0, 0, 4]]
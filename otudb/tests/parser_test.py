@@ -1,7 +1,7 @@
 import os
 import pytest
 
-from ..parsers import CSVParser, FastaParser
+from ..parsers import CSVParser, FastaParser, IndexedFasta
 
 
 class TestCSV(object):
@@ -41,6 +41,73 @@ class TestCSV(object):
             break
 
 
+    def test_write_rows(self, tmpdir):
+        filename = os.path.join(tmpdir, 'export.tsv')
+        out = CSVParser(filename, mode='w', delimiter='\t')
+        rows = ((f'OTU_{n}', n) for n in range(5))
+        assert out.write_rows(rows, headers=['OTUId', 'S1'], block_rows=2) == 5
+        out.fh.close()
+        with open(filename) as fh:
+            assert fh.read() == 'OTUId\tS1\n' + ''.join(f'OTU_{n}\t{n}\n' for n in range(5))
+
+
+    def test_load_after_fieldnames(self, tmpdir):
+        """header read by get_fieldnames is not loaded as a row"""
+        filename = os.path.join(tmpdir, 'otu_table.tsv')
+        with open(filename, 'w') as fh:
+            fh.write('OTUId\tS1\tS2\nOTU_1\t0\t2\n')
+        tp = CSVParser(filename, mode='r', delimiter='\t')
+        assert tp.get_fieldnames() == ['OTUId', 'S1', 'S2']
+        assert list(tp.load_data()) == [{'OTUId': 'OTU_1', 'S1': '0', 'S2': '2'}]
+
+
+    def test_load_from_offset(self, tmpdir):
+        """rows resume at the position() recorded after a row"""
+        filename = os.path.join(tmpdir, 'otu_table.tsv')
+        with open(filename, 'w') as fh:
+            fh.write('OTUId\tS1\nOTU_1\t1\nOTU_2\t2\nOTU_3\t3\n')
+        tp = CSVParser(filename, mode='r', delimiter='\t')
+        tp.get_fieldnames()
+        rows = tp.load_data(offset=0)
+        assert next(rows)['OTUId'] == 'OTU_1'
+        offset = tp.position()
+
+        tp = CSVParser(filename, mode='r', delimiter='\t')
+        tp.get_fieldnames()
+        assert [row['OTUId'] for row in tp.load_data(offset)] == ['OTU_2', 'OTU_3']
+
+
+    def test_load_tuples(self, tmpdir):
+        filename = os.path.join(tmpdir, 'otu_table.tsv')
+        with open(filename, 'w') as fh:
+            fh.write('OTUId\tS1\tS2\nOTU_1\t1\t2\nOTU_2\t3\t4\n')
+        tp = CSVParser(filename, mode='r', delimiter='\t')
+        assert tp.column_index(['S2', 'OTUId']) == [2, 0]
+        assert list(tp.load_tuples(columns=[2, 0])) == [('2', 'OTU_1'), ('4', 'OTU_2')]
+        tp.rewind()
+        assert list(tp.load_tuples()) == [('OTU_1', '1', '2'), ('OTU_2', '3', '4')]
+        with pytest.raises(KeyError):
+            tp.column_index(['S3'])
+
+
+    def test_load_arrays(self, tmpdir):
+        filename = os.path.join(tmpdir, 'otu_table.tsv')
+        with open(filename, 'w') as fh:
+            fh.write('OTUId\tS1\tS2\tS3\nOTU_1\t0.5\t\t2\n"OTU 2"\t1e-3\t0\t3\n')
+        tp = CSVParser(filename, mode='r', delimiter='\t')
+        rows = list(tp.load_arrays())
+        assert [keys for keys, _ in rows] == [('OTU_1',), ('OTU 2',)]
+        assert rows[0][1].tolist() == [0.5, 0.0, 2.0]
+        assert rows[1][1].tolist() == [0.001, 0.0, 3.0]
+
+        tp = CSVParser(filename, mode='r', delimiter='\t')
+        tp.get_fieldnames()
+        rows = tp.load_arrays(offset=0, columns=[2, 0])
+        assert next(rows)[1].tolist() == [2.0, 0.5]
+        offset = tp.position()
+        assert [values.tolist() for _, values in tp.load_arrays(offset, columns=[2])] == [[3.0]]
+
+
 class TestFasta(object):
     """test CSVParser"""
 
@@ -81,3 +148,101 @@ class TestFasta(object):
             break
 
 
+
+
+class TestIndexedFasta(object):
+    """test IndexedFasta"""
+
+    records = [('OTU_1', 'ACGTACGTAC'), ('OTU_2', 'GG'), ('OTU_3', 'TTTTACGTTTTT')]
+
+    @pytest.fixture
+    def fasta_file(self, tmpdir):
+        # setup
+        filename = os.path.join(tmpdir, 'otus.fasta')
+        with open(filename, 'w') as fh:
+            for name, seq in self.records:
+                fh.write(f'>{name} size=1\n')
+                fh.write('\n'.join(seq[i:i+4] for i in range(0, len(seq), 4)) + '\n')
+
+        # action!
+        yield filename
+
+
+    def test_fetch(self, fasta_file):
+        with IndexedFasta(fasta_file) as fasta:
+            assert len(fasta) == 3
+            assert fasta.fetch('OTU_3') == 'TTTTACGTTTTT'
+            assert fasta.fetch('OTU_2') == 'GG'
+            assert 'OTU_4' not in fasta
+
+
+    def test_index_saved(self, fasta_file):
+        IndexedFasta(fasta_file).close()
+        with open(fasta_file + '.fai') as fh:
+            assert fh.readline() == 'OTU_1\t10\t14\t4\t5\n'
+        with IndexedFasta(fasta_file) as fasta:
+            assert fasta.fetch('OTU_1') == 'ACGTACGTAC'
+
+
+    def test_iterate(self, fasta_file):
+        with IndexedFasta(fasta_file) as fasta:
+            records = list(fasta)
+            assert isinstance(records[0].raw, memoryview)
+            assert [(r.name, r.sequence) for r in records] == self.records
+            del records
+
+
+class TestCompressed(object):
+    """test reading gzip/xz/bz2 compressed files"""
+
+    table = 'OTUId\tS1\tS2\n' + ''.join(f'OTU_{n}\t{n}\t0\n' for n in range(5000))
+
+    @pytest.fixture(params=['gzip', 'lzma', 'bz2'])
+    def table_file(self, request, tmpdir):
+        # setup
+        codec = __import__(request.param)
+        filename = os.path.join(tmpdir, 'otu_table.tsv.z')
+        with codec.open(filename, 'wt') as fh:
+            fh.write(self.table)
+
+        # action!
+        yield filename
+
+
+    def test_csv_compressed(self, table_file):
+        tp = CSVParser(table_file, mode='r', delimiter='\t')
+        assert tp.compression in ('gzip', 'xz', 'bz2')
+        assert tp.get_fieldnames() == ['OTUId', 'S1', 'S2']
+        rows = list(tp.load_data())
+        assert len(rows) == 5000
+        assert rows[-1] == {'OTUId': 'OTU_4999', 'S1': '4999', 'S2': '0'}
+        assert tp.count_records() is None
+
+
+    def test_rewind_compressed(self, table_file):
+        tp = CSVParser(table_file, mode='r', delimiter='\t')
+        tp.get_fieldnames()
+        assert sum(1 for _ in tp.load_arrays(offset=0)) == 5000
+        tp.rewind()
+        keys, values = next(tp.load_arrays(columns=[0]))
+        assert keys == ('OTU_0',) and values.tolist() == [0.0]
+
+
+    def test_sniff_small_compressed(self, tmpdir):
+        import gzip
+        filename = os.path.join(tmpdir, 'taxa.txt.gz')
+        with gzip.open(filename, 'wt') as fh:
+            fh.write('OTU_1\tk__Bacteria; p__Firmicutes\n')
+        tp = CSVParser(filename, mode='r', delimiter='\t', threaded=False)
+        tp.sniff_dialect()
+        assert tp.fh.seekable()
+        assert tp.fh.readline() == 'OTU_1\tk__Bacteria; p__Firmicutes\n'
+
+
+    def test_fasta_compressed(self, tmpdir):
+        import gzip
+        filename = os.path.join(tmpdir, 'otus.fasta.gz')
+        with gzip.open(filename, 'wt') as fh:
+            fh.write('>OTU_1\nACGT\nAC\n>OTU_2\nGG\n')
+        fp = FastaParser(filename, mode='r', threaded=False)
+        assert list(fp.load_data()) == [('OTU_1', 'ACGTAC'), ('OTU_2', 'GG')]
@@ -0,0 +1,67 @@
+import pytest
+
+from ..pipeline import Pipeline, ReadAhead, InlineRows, commit_chunks, source_rows
+
+
+class CountingParser(object):
+    """rows 0..n-1 and the number read as position()"""
+
+    def __init__(self, n):
+        self.n = n
+        self.read = 0
+
+    def rows(self):
+        for row in range(self.n):
+            self.read = row + 1
+            yield row
+
+    def position(self):
+        return self.read
+
+
+def chunks_and_positions(rows, commit_rows):
+    return [(list(chunk), rows.position()) for chunk in rows.chunks(commit_rows)]
+
+
+class TestReadAhead(object):
+    """test rows read ahead by a producer thread"""
+
+    @pytest.mark.parametrize('commit_rows', [None, 3, 4, 10, 25])
+    @pytest.mark.parametrize('batch_rows', [1, 3, 50])
+    def test_same_as_inline(self, commit_rows, batch_rows):
+        parser = CountingParser(10)
+        inline = chunks_and_positions(InlineRows(parser.rows(), parser), commit_rows)
+        parser = CountingParser(10)
+        ahead = ReadAhead(parser.rows(), parser, batch_rows, depth=2)
+        assert chunks_and_positions(ahead, commit_rows) == inline
+        assert ahead.row_count == 10
+        report = ahead.report()
+        assert report['rows'] == 10 and report['parser_stall'] >= 0
+
+
+    def test_parser_error(self):
+        def rows():
+            yield 1
+            raise ValueError('bad row')
+        ahead = ReadAhead(rows(), batch_rows=1, depth=2)
+        with pytest.raises(ValueError):
+            for chunk in ahead.chunks(5):
+                list(chunk)
+
+
+    def test_stopped_early(self):
+        ahead = ReadAhead(iter(range(10**6)), batch_rows=10, depth=2)
+        for chunk in ahead.chunks(100):
+            assert next(chunk) == 0
+            break
+        # the producer was stopped, not left blocked on the full queue
+        assert ahead.stopped.is_set()
+
+
+    def test_source_rows(self):
+        assert isinstance(source_rows([], None, None), InlineRows)
+        assert isinstance(source_rows([], None, Pipeline(depth=0)), InlineRows)
+        assert isinstance(source_rows([], None, Pipeline(depth=4)), ReadAhead)
+        with pytest.raises(ValueError):
+            Pipeline(batch_rows=0)
+        assert [list(chunk) for chunk in commit_chunks(range(5), 2)] == [[0, 1], [2, 3], [4]]
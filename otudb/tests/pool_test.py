@@ -0,0 +1,129 @@
+import os
+import threading
+import pytest
+
+from peewee import OperationalError
+
+from ..db_config import sqlite_url
+from ..models import sample_info
+from ..pool import StatsPooledSqliteDatabase, pooled_database, pool_stats, retrying
+
+
+class FlakyDatabase(StatsPooledSqliteDatabase):
+    """SQLite pool taking 'gone away' errors for lost connections"""
+
+    def is_reconnect_error(self, exc):
+        return 'gone away' in str(exc)
+
+
+def count_samples(db):
+    with db.bind_ctx([sample_info]):
+        return sample_info.select().count()
+
+
+class TestPool(object):
+    """test the pooled SQLite database"""
+
+    @pytest.fixture
+    def db(self, tmpdir):
+        # setup
+        db = pooled_database(sqlite_url(str(tmpdir.join('otudb.sqlite'))),
+                             max_connections=2, wait_timeout=5)
+        with db.bind_ctx([sample_info]):
+            db.create_tables([sample_info])
+            sample_info.create(sample_name='S1')
+        db.close()
+
+        # action!
+        yield db
+
+        # teardown
+        db.close_all()
+
+
+    def test_threads(self, db):
+        results = []
+        def read():
+            with db.connection_context():
+                results.append(count_samples(db))
+        threads = [threading.Thread(target=read) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert results == [1] * 6
+        stats = pool_stats(db)
+        assert stats['in_use'] == 0
+        assert 1 <= stats['idle'] <= 2
+        assert stats['max_connections'] == 2
+
+
+    def test_waits(self, db):
+        held = threading.Event()
+        release = threading.Event()
+        def hold():
+            with db.connection_context():
+                held.set()
+                release.wait()
+        threads = [threading.Thread(target=hold) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        held.wait()
+        while pool_stats(db)['in_use'] < 2:
+            pass
+        threading.Timer(0.2, release.set).start()
+        with db.connection_context():
+            assert count_samples(db) == 1
+        for thread in threads:
+            thread.join()
+        assert pool_stats(db)['waits'] == 1
+
+
+    def test_fork(self, db):
+        db.connect()
+        assert count_samples(db) == 1
+        pid = os.fork()
+        if pid == 0:
+            # child: a connection of its own
+            os._exit(0 if count_samples(db) == 1 and pool_stats(db)['in_use'] == 1 else 1)
+        _, status = os.waitpid(pid, 0)
+        assert os.waitstatus_to_exitcode(status) == 0
+        # the parent's connection is still open and usable
+        assert not db.is_closed()
+        assert count_samples(db) == 1
+
+
+class TestRetrying(object):
+    """test retrying work after lost connections"""
+
+    @pytest.fixture
+    def db(self):
+        db = FlakyDatabase(':memory:', max_connections=2)
+        yield db
+        db.close_all()
+
+
+    def test_retried(self, db):
+        calls = []
+        def work():
+            calls.append(db.connection())
+            if len(calls) < 3:
+                raise OperationalError('(2006, MySQL server has gone away)')
+            return 'done'
+        assert retrying(db, work, delay=0) == 'done'
+        assert len(calls) == 3
+        assert pool_stats(db)['retries'] == 2
+
+
+    def test_not_retried(self, db):
+        def work():
+            raise OperationalError('no such table: otu_counts')
+        with pytest.raises(OperationalError):
+            retrying(db, work, delay=0)
+        assert pool_stats(db)['retries'] == 0
+
+        def lost():
+            raise OperationalError('gone away')
+        with pytest.raises(OperationalError):
+            retrying(db, lost, retries=1, delay=0)
+        assert pool_stats(db)['retries'] == 1
@@ -0,0 +1,93 @@
+import pytest
+import numpy as np
+
+from munch import Munch
+from peewee import SqliteDatabase
+
+from ..models import (sample_info, otu_seq, otu_counts, otu_count_generation, analysis_set,
+                      sample_analysis_sets, otu_sample_totals)
+from ..matrix_cache import count_generation
+from ..rarefaction import rarefy, store_rarefied
+
+rarefy_models = [sample_info, otu_seq, otu_counts, otu_count_generation, analysis_set,
+                 sample_analysis_sets, otu_sample_totals]
+
+
+def dense(matrix):
+    return matrix.dense().tolist()
+
+
+class TestRarefy(object):
+    """test rarefying the read counts of a set"""
+
+    @pytest.fixture
+    def db(self):
+        # setup
+        db = SqliteDatabase(':memory:')
+        with db.bind_ctx(rarefy_models):
+            db.create_tables(rarefy_models)
+            otu_seq.insert_many([{'otu_name': f'OTU_{n}'} for n in (1, 2, 3)]).execute()
+            sample_info.insert_many([{'sample_name': s} for s in ('S1', 'S2', 'S3')]).execute()
+            analysis_set.insert(set_name='run 1').execute()
+            # S1: 30 reads, S2: 12, S3: 4
+            otu_counts.insert_many([
+                dict(set_id=1, otu_id=1, sample_id=1, counts=10),
+                dict(set_id=1, otu_id=2, sample_id=1, counts=20),
+                dict(set_id=1, otu_id=2, sample_id=2, counts=2),
+                dict(set_id=1, otu_id=3, sample_id=2, counts=10),
+                dict(set_id=1, otu_id=3, sample_id=3, counts=4),
+            ]).execute()
+            db.models = Munch({m._meta.table_name: m for m in rarefy_models})
+
+            # action!
+            yield db
+
+        # teardown
+        db.close()
+
+
+    def test_depths(self, db):
+        result = rarefy(db, db.models, 1, depths=[10, 4], iterations=3, seed=7, jobs=1)
+        assert result.depths == [4, 10]
+        assert result.columns == {4: [0, 1, 2], 10: [0, 1]}
+        for depth in result.depths:
+            for table in result.tables[depth]:
+                # every kept sample rarefied to the depth, within its own counts
+                assert np.bincount(table.indices, weights=table.data).tolist() == \
+                    [depth] * len(result.columns[depth])
+                counts = np.array([[10, 0, 0], [20, 2, 0], [0, 10, 4]])
+                assert (table.toarray() <= counts[:, result.columns[depth]]).all()
+        assert result.matrix(10, 0).columns == ['S1', 'S2']
+        # S3 only has OTU_3
+        assert dense(result.matrix(4, 2))[2][2] == 4
+        rows = list(result.rows())
+        assert rows[0][:2] == (4, 1) and sum(row[4] for row in rows) == 3 * (4 * 3 + 10 * 2)
+
+
+    def test_seeded(self, db):
+        first = rarefy(db, db.models, 1, depths=[10], iterations=2, seed=7, jobs=1)
+        again = rarefy(db, db.models, 1, depths=[4, 10], iterations=2, seed=7, jobs=2,
+                       batch_size=1)
+        assert [dense(first.matrix(10, i)) for i in range(2)] == \
+            [dense(again.matrix(10, i)) for i in range(2)]
+        with pytest.raises(ValueError):
+            rarefy(db, db.models, 1, depths=[0])
+        # relative abundances are not read counts
+        otu_counts.insert(set_id=2, otu_id=1, sample_id=1, percent_abundance=0.5).execute()
+        assert rarefy(db, db.models, 2, depths=[1], jobs=1).columns == {1: []}
+
+
+    def test_store(self, db):
+        result = rarefy(db, db.models, 1, depths=[10], seed=7, jobs=1)
+        set_id = store_rarefied(db.models, result, 10)
+        # past the sets of stored counts, with or without an analysis_set row
+        assert set_id == 2
+        otu_counts.insert(set_id=5, otu_id=1, sample_id=1, counts=1).execute()
+        assert store_rarefied(db.models, result, 10) == 6
+        stored = (otu_counts.select(otu_counts.counts, otu_counts.percent_abundance)
+                            .where(otu_counts.set_id == set_id))
+        assert sum(row.counts for row in stored) == 20
+        assert sum(float(row.percent_abundance) for row in stored) == pytest.approx(200)
+        assert sample_analysis_sets.select().where(
+            sample_analysis_sets.set_id == set_id).count() == 2
+        assert count_generation(db.models, set_id) == 1
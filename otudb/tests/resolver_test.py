@@ -0,0 +1,55 @@
+import pytest
+
+from peewee import SqliteDatabase, Model, AutoField, CharField
+
+from ..resolver import NameResolver
+
+
+class TestNameResolver(object):
+    """test NameResolver"""
+
+    @pytest.fixture
+    def model(self):
+        # setup
+        db = SqliteDatabase(':memory:')
+
+        class sample_info(Model):
+            sample_id = AutoField()
+            sample_name = CharField()
+
+            class Meta:
+                database = db
+
+        db.create_tables([sample_info])
+        sample_info.insert_many([{'sample_name': n} for n in ('S1', 'S2', 'S3')]).execute()
+
+        # action!
+        yield sample_info
+
+        # teardown
+        db.close()
+
+
+    @pytest.fixture
+    def samples(self, model):
+        return NameResolver(model, 'sample_name', 'sample_id')
+
+
+    def test_load_names(self, samples):
+        missing = samples.load(['S3', 'S1', 'S9'])
+        assert missing == ['S9']
+        assert samples['S1'] == 1
+        assert samples.get('S3') == 3
+        assert 'S2' not in samples
+
+
+    def test_load_all(self, samples):
+        assert samples.load() == []
+        assert len(samples) == 3
+
+
+    def test_create_missing(self, samples, model):
+        samples.load(['S1', 'S8', 'S9'])
+        assert samples.create_missing() == ['S8', 'S9']
+        assert samples.missing == []
+        assert samples['S9'] == model.get(model.sample_name == 'S9').sample_id
@@ -0,0 +1,118 @@
+import pytest
+
+from munch import Munch
+from peewee import SqliteDatabase
+
+from ..models import (base_models, package_models, sample_info, otu_counts,
+                      otu_annotation, otu_taxon_rollup)
+from ..rollup import TaxonRollup, rebuild_rollups, taxon_abundances
+
+
+def add_counts(set_id, rows):
+    otu_counts.insert_many([dict(set_id=set_id, otu_id=otu_id, sample_id=sample_id,
+                                 counts=1, percent_abundance=abundance)
+                            for otu_id, sample_id, abundance in rows]).execute()
+
+
+def add_annotations(set_id, rows):
+    otu_annotation.insert_many([dict(set_id=set_id or 0, otu_id=otu_id, phylum=phylum,
+                                     genus=genus)
+                                for otu_id, phylum, genus in rows]).execute()
+
+
+def rollup_rows():
+    return set(otu_taxon_rollup.select(otu_taxon_rollup.set_id, otu_taxon_rollup.sample_id,
+                                       otu_taxon_rollup.rank, otu_taxon_rollup.taxon,
+                                       otu_taxon_rollup.abundance,
+                                       otu_taxon_rollup.otu_count).tuples())
+
+
+class TestTaxonRollup(object):
+    """test the rollups kept by TaxonRollup against rebuild_rollups"""
+
+    counts = [(1, 1, 50.0), (2, 1, 30.0), (3, 1, 20.0), (1, 2, 0.0), (3, 2, 100.0)]
+    annotations = [(1, 'Firmicutes', 'Bacillus'), (2, 'Firmicutes', 'Listeria'),
+                   (3, 'Proteobacteria', None)]
+
+    @pytest.fixture
+    def db(self):
+        # setup
+        db = SqliteDatabase(':memory:')
+        models = base_models + package_models
+        with db.bind_ctx(models):
+            db.create_tables(models)
+            sample_info.insert_many([dict(sample_id=1, sample_name='S1'),
+                                     dict(sample_id=2, sample_name='S2')]).execute()
+            db.models = Munch({m._meta.table_name: m for m in models})
+
+            # action!
+            yield db
+
+        # teardown
+        db.close()
+
+
+    def import_rows(self, db, set_id, first, second):
+        """write the first then the second table, each in two chunks"""
+        writers = {'otu_counts': (add_counts, self.counts),
+                   'otu_annotation': (add_annotations, self.annotations)}
+        for table in (first, second):
+            add, rows = writers[table]
+            rollup = TaxonRollup(db.models, set_id, table)
+            rollup.begin()
+            for chunk in (rows[:2], rows[2:]):
+                add(set_id, chunk)
+                rollup.update()
+
+
+    @pytest.mark.parametrize('first,second', [('otu_counts', 'otu_annotation'),
+                                              ('otu_annotation', 'otu_counts')])
+    def test_incremental(self, db, first, second):
+        self.import_rows(db, 4, first, second)
+        incremental = rollup_rows()
+        assert (4, 1, 'phylum', 'Firmicutes', 80.0, 2) in incremental
+        assert (4, 2, 'phylum', 'Firmicutes', 0.0, 0) in incremental
+        assert (4, 1, 'genus', '', 20.0, 1) in incremental
+
+        rebuild_rollups(db.models, 4)
+        assert rollup_rows() == incremental
+
+
+    def test_without_set(self, db):
+        self.import_rows(db, None, 'otu_counts', 'otu_annotation')
+        add_counts(4, self.counts)
+        incremental = rollup_rows()
+        assert {row[0] for row in incremental} == {0}
+
+        rebuild_rollups(db.models)
+        assert rollup_rows() == incremental
+
+
+    @pytest.mark.parametrize('first,second', [('otu_counts', 'otu_annotation'),
+                                              ('otu_annotation', 'otu_counts')])
+    def test_annotated_twice(self, db, first, second):
+        self.import_rows(db, 4, first, second)
+        # OTU_1 annotated again, by another method: only the latest one counts
+        rollup = TaxonRollup(db.models, 4, 'otu_annotation')
+        rollup.begin()
+        add_annotations(4, [(1, 'Bacteroidetes', 'Bacteroides')])
+        rollup.update()
+        incremental = rollup_rows()
+        assert (4, 1, 'phylum', 'Firmicutes', 30.0, 1) in incremental
+        assert (4, 1, 'phylum', 'Bacteroidetes', 50.0, 1) in incremental
+        assert sum(row[4] for row in incremental
+                   if row[1] == 1 and row[2] == 'phylum') == 100.0
+
+        rebuild_rollups(db.models, 4)
+        assert rollup_rows() == incremental
+
+
+    def test_taxon_abundances(self, db):
+        self.import_rows(db, 4, 'otu_counts', 'otu_annotation')
+        rows = list(taxon_abundances(db.models, 'phylum', 4))
+        assert rows == [('S1', 'Firmicutes', 80.0, 2), ('S2', 'Firmicutes', 0.0, 0),
+                        ('S1', 'Proteobacteria', 20.0, 1),
+                        ('S2', 'Proteobacteria', 100.0, 1)]
+        assert list(taxon_abundances(db.models, 'phylum', 4, ['S2']))[0][0] == 'S2'
+        with pytest.raises(ValueError):
+            taxon_abundances(db.models, 'strain', 4)
@@ -0,0 +1,40 @@
+import os
+import pytest
+
+from peewee import SqliteDatabase
+
+from ..schema_cache import CachedIntrospector, schema_fingerprint
+
+
+class TestSchemaCache(object):
+    """test CachedIntrospector"""
+
+    @pytest.fixture
+    def db(self, tmpdir):
+        # setup
+        db = SqliteDatabase(os.path.join(tmpdir, 'otu.db'))
+        db.execute_sql('CREATE TABLE otu_seq (seq_id INTEGER PRIMARY KEY, otu_name VARCHAR(10))')
+
+        # action!
+        yield db
+
+        # teardown
+        db.close()
+
+
+    def test_fingerprint_changes(self, db):
+        before = schema_fingerprint(db)
+        assert before == schema_fingerprint(db)
+        db.execute_sql('ALTER TABLE otu_seq ADD COLUMN seq_length INTEGER')
+        assert before != schema_fingerprint(db)
+
+
+    def test_cached_models(self, db, tmpdir):
+        cache_dir = os.path.join(tmpdir, 'cache')
+        models = CachedIntrospector.from_database(db, cache_dir=cache_dir).generate_models()
+        cache_files = os.listdir(cache_dir)
+        assert len(cache_files) == 1
+
+        models = CachedIntrospector.from_database(db, cache_dir=cache_dir).generate_models()
+        assert list(models['otu_seq']._meta.columns) == ['seq_id', 'otu_name']
+        assert os.listdir(cache_dir) == cache_files
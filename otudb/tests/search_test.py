@@ -0,0 +1,95 @@
+import os
+import random
+import pytest
+
+from munch import Munch
+from peewee import SqliteDatabase
+
+from ..models import otu_seq
+from ..search import SearchIndex, sketch, index_arrays
+
+
+def random_sequence(rng, length):
+    return ''.join(rng.choices('ACGT', k=length))
+
+
+class TestSearchIndex(object):
+    """test building, extending and searching a SearchIndex"""
+
+    @pytest.fixture
+    def db(self):
+        # setup
+        db = SqliteDatabase(':memory:')
+        rng = random.Random(3)
+        with db.bind_ctx([otu_seq]):
+            db.create_tables([otu_seq])
+            db.sequences = [random_sequence(rng, 400) for _ in range(5)]
+            otu_seq.insert_many([dict(otu_name=f'OTU_{n}', sequence=seq)
+                                 for n, seq in enumerate(db.sequences[:3])]).execute()
+            db.models = Munch(otu_seq=otu_seq)
+
+            # action!
+            yield db
+
+        # teardown
+        db.close()
+
+
+    @pytest.fixture
+    def index(self, tmpdir):
+        return SearchIndex(str(tmpdir.join('index')), k=12, scale=2)
+
+
+    def test_sketch(self):
+        hashes = sketch('ACGT' * 20, k=4, scale=1)
+        assert len(hashes) == 4
+        assert list(hashes) == sorted(hashes)
+
+
+    def test_update(self, db, index):
+        assert not index.exists()
+        assert index.update(db, db.models) == 3
+        assert index.update(db, db.models) == 0
+        otu_seq.insert_many([dict(otu_name=f'OTU_{n}', sequence=seq)
+                             for n, seq in enumerate(db.sequences[3:], 3)]).execute()
+        assert index.update(db, db.models) == 2
+        assert index.meta['sequences'] == 5
+        assert index.meta['last_seq_id'] == 5
+        assert index.update(db, db.models, rebuild=True) == 5
+
+
+    def test_search(self, db, index):
+        index.update(db, db.models)
+        mutated = list(db.sequences[1])
+        mutated[200] = 'A' if mutated[200] != 'A' else 'C'
+        hits, = SearchIndex(index.directory).search([''.join(mutated)], top=2)
+        seq_id, shared, query_size, identity = hits[0]
+        assert seq_id == 2
+        assert 0.9 < identity < 1
+        assert shared < query_size
+        assert SearchIndex(index.directory).search(['NNNN']) == [[]]
+
+
+    def test_segments(self, db, index):
+        index.update(db, db.models)
+        first = index.meta['segments']
+        # the new sequences go in a segment of their own, of fewer postings
+        otu_seq.insert(otu_name='OTU_3', sequence=db.sequences[3][:100]).execute()
+        index.update(db, db.models)
+        assert index.meta['segments'][0] == first[0]
+        assert len(index.meta['segments']) == 2
+        # merged into the one before once it is about as large
+        otu_seq.insert(otu_name='OTU_4', sequence=db.sequences[4]).execute()
+        index.update(db, db.models)
+        assert len(index.meta['segments']) < 3
+        assert sorted(f for f in os.listdir(index.directory) if f.endswith('.npy')) == \
+            sorted(f'{segment}.{name}.npy' for segment in index.meta['segments']
+                   for name in index_arrays)
+
+        queries = [seq[50:350] for seq in db.sequences]
+        hits = index.search(queries)
+        rebuilt = SearchIndex(index.directory + '-rebuilt', k=12, scale=2)
+        rebuilt.update(db, db.models)
+        assert len(rebuilt.meta['segments']) == 1
+        assert hits == rebuilt.search(queries)
+        assert [query_hits[0][0] for query_hits in hits] == [1, 2, 3, 4, 5]
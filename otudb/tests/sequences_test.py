@@ -0,0 +1,13 @@
+import pytest
+
+from ..sequences import normalize_sequence, seq_digest
+
+
+def test_normalize_sequence():
+    assert normalize_sequence('acgT\nAC ') == 'ACGTAC'
+
+
+def test_seq_digest():
+    assert seq_digest('ACGTAC') == seq_digest('acgt\nac')
+    assert seq_digest('ACGTAC') != seq_digest('ACGTAA')
+    assert len(seq_digest('ACGT')) == 40
@@ -0,0 +1,82 @@
+import pytest
+
+from munch import Munch
+from peewee import SqliteDatabase
+
+from ..models import (base_models, package_models, sample_info, otu_seq,
+                      otu_counts, otu_annotation, otu_lineage, otu_taxon_rollup)
+from ..staging import copy_database
+
+all_models = base_models + package_models
+
+
+def make_db(path, samples, otus):
+    db = SqliteDatabase(path)
+    with db.bind_ctx(all_models):
+        db.create_tables(all_models)
+        sample_info.insert_many([{'sample_name': s} for s in samples]).execute()
+        otu_seq.insert_many([{'otu_name': o} for o in otus]).execute()
+    return db
+
+
+class TestCopyDatabase(object):
+    """test copy_database from a staging db into a target db"""
+
+    @pytest.fixture
+    def source(self, tmpdir):
+        # setup
+        db = make_db(str(tmpdir.join('staging.sqlite')), ['S2', 'S3'], ['OTU_a', 'OTU_b'])
+        with db.bind_ctx(all_models):
+            otu_lineage.insert(lineage_digest='x', lineage='Bacteria', kingdom='Bacteria').execute()
+            otu_counts.insert_many([
+                dict(set_id=1, otu_id=1, sample_id=1, counts=5, percent_abundance=100),
+                dict(set_id=1, otu_id=2, sample_id=2, counts=7, percent_abundance=100),
+            ]).execute()
+            otu_annotation.insert(set_id=1, otu_id=2, lineage_id=1).execute()
+
+        # action!
+        yield db
+
+        # teardown
+        db.close()
+
+
+    @pytest.fixture
+    def target(self, tmpdir):
+        # setup
+        db = make_db(str(tmpdir.join('target.sqlite')), ['S1', 'S2'], ['OTU_x'])
+        with db.bind_ctx(all_models):
+            otu_lineage.insert(lineage_digest='y', lineage='Archaea', kingdom='Archaea').execute()
+
+            # action!
+            yield db
+
+        # teardown
+        db.close()
+
+
+    def test_copy(self, source, target):
+        models = Munch({m._meta.table_name: m for m in all_models})
+        copied = copy_database(source, models, batch_size=1, fetch_size=1)
+        assert copied['sample_info'] == 1
+        assert copied['otu_seq'] == 2
+        assert copied['otu_counts'] == 2
+
+        query = (otu_counts.select(otu_seq.otu_name, sample_info.sample_name, otu_counts.counts)
+                           .join(otu_seq, on=(otu_counts.otu_id == otu_seq.seq_id))
+                           .switch(otu_counts)
+                           .join(sample_info, on=(otu_counts.sample_id == sample_info.sample_id))
+                           .order_by(otu_counts.counts)
+                           .tuples())
+        assert list(query) == [('OTU_a', 'S2', 5), ('OTU_b', 'S3', 7)]
+        assert sample_info.select().count() == 3
+
+        annotation = otu_annotation.get()
+        assert otu_seq.get_by_id(annotation.otu_id).otu_name == 'OTU_b'
+        assert otu_lineage.get_by_id(annotation.lineage_id).lineage == 'Bacteria'
+
+        # rolled up in the target, with its sample ids
+        rollup = otu_taxon_rollup.get((otu_taxon_rollup.rank == 'kingdom') &
+                                      (otu_taxon_rollup.taxon == 'Bacteria'))
+        assert (rollup.set_id, rollup.abundance, rollup.otu_count) == (1, 100.0, 1)
+        assert sample_info.get_by_id(rollup.sample_id).sample_name == 'S3'
@@ -0,0 +1,36 @@
+import os
+
+from .. import synthetic
+from ..parsers import CSVParser, FastaParser
+from ..taxonomy import parse_gg_lineage
+
+
+def test_count_table(tmpdir):
+    filename = os.path.join(tmpdir, 'otu_table.tsv')
+    assert synthetic.write_count_table(filename, 20, 10, density=0.3, seed=1) == 20
+    tp = CSVParser(filename, mode='r', delimiter='\t')
+    assert tp.get_fieldnames() == ['OTUId'] + [f'S{n}' for n in range(10)]
+    rows = list(tp.load_data())
+    assert len(rows) == 20
+    assert all(sum(value != '0' for value in row.values()) == 1 + 3 for row in rows)
+
+
+def test_reproducible(tmpdir):
+    first, second = (os.path.join(tmpdir, name) for name in ('a.fasta', 'b.fasta'))
+    synthetic.write_fasta(first, 10, seed=7)
+    synthetic.write_fasta(second, 10, seed=7)
+    with open(first) as a, open(second) as b:
+        assert a.read() == b.read()
+    records = list(FastaParser(first, mode='r').load_data())
+    assert len(records) == 10
+    assert all(250 <= len(seq) <= 1500 for _, seq in records)
+
+
+def test_gg_taxa(tmpdir):
+    filename = os.path.join(tmpdir, 'taxa.txt.gz')
+    synthetic.write_gg_taxa(filename, 5)
+    tp = CSVParser(filename, mode='r', delimiter='\t',
+                   fieldnames=['otu_name', 'identity', 'p_value', 'taxa'])
+    lineages = [parse_gg_lineage(row['taxa']) for row in tp.load_data()]
+    assert len(lineages) == 5
+    assert all(lineage[0] and lineage[1] for lineage in lineages)
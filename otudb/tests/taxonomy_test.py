@@ -0,0 +1,69 @@
+import pytest
+
+from peewee import SqliteDatabase, Model, AutoField, CharField
+
+from ..taxonomy import (parse_gg_lineage, parse_rdp_lineage, lineage_string,
+                        LineageIndex)
+
+
+def test_parse_gg_lineage():
+    lineage = parse_gg_lineage('k__Bacteria; p__Firmicutes; c__; o__; f__; g__; s__')
+    assert lineage == ('Bacteria', 'Firmicutes', None, None, None, None, None)
+    assert lineage_string(lineage).startswith('k__Bacteria; p__Firmicutes; c__;')
+
+
+def test_parse_rdp_lineage():
+    row = {'kingdom': 'Bacteria', 'phylum': ' Firmicutes ', 'class': ''}
+    assert parse_rdp_lineage(row) == parse_gg_lineage('k__Bacteria; p__Firmicutes')
+
+
+class TestLineageIndex(object):
+    """test LineageIndex"""
+
+    @pytest.fixture
+    def model(self):
+        # setup
+        db = SqliteDatabase(':memory:')
+
+        class otu_lineage(Model):
+            lineage_id = AutoField()
+            lineage_digest = CharField(unique=True)
+            lineage = CharField()
+            kingdom = CharField(null=True)
+            phylum = CharField(null=True)
+            class_ = CharField(null=True, column_name='class')
+            order_ = CharField(null=True, column_name='order')
+            family = CharField(null=True)
+            genus = CharField(null=True)
+            species = CharField(null=True)
+
+            class Meta:
+                database = db
+
+        db.create_tables([otu_lineage])
+
+        # action!
+        yield otu_lineage
+
+        # teardown
+        db.close()
+
+
+    def test_resolve(self, model):
+        a = parse_gg_lineage('k__Bacteria; p__Firmicutes')
+        b = parse_gg_lineage('k__Bacteria; p__Bacteroidetes')
+        index = LineageIndex(model, batch_size=1)
+        ids = index.resolve([a, b, a])
+        assert ids[0] == ids[2] != ids[1]
+        assert index.created == 2
+        assert model.select().count() == 2
+        assert model.get(model.lineage_id == ids[1]).phylum == 'Bacteroidetes'
+
+
+    def test_resolve_stored(self, model):
+        a = parse_gg_lineage('k__Bacteria; p__Firmicutes')
+        first = LineageIndex(model).resolve([a])
+        index = LineageIndex(model)
+        assert index.load() == 1
+        assert index.resolve([a]) == first
+        assert index.created == 0
@@ -0,0 +1,30 @@
+import os
+import logging
+import pytest
+
+from ..utils import log_it, count_records, ProgressLog
+
+
+def test_log_it_handlers_once(tmpdir):
+    logdir = os.path.join(tmpdir, 'logs')
+    l = log_it(logname='test.utils', logdir=logdir)
+    handlers = list(l.handlers)
+    assert log_it(logname='test.utils', logdir=logdir) is l
+    assert l.handlers == handlers
+
+
+def test_count_records(tmpdir):
+    filename = os.path.join(tmpdir, 'otus.fasta')
+    with open(filename, 'wb') as fh:
+        fh.write(b'>OTU_1\nACGT\n>OTU_2\nACGT\nACGT\n>OTU_3\nA\n')
+    assert count_records(filename) == 7
+    assert count_records(filename, b'\n>', chunk_size=3) == 2
+
+
+def test_progress_log(caplog):
+    l = logging.getLogger('test.progress')
+    progress = ProgressLog(l, 'Importing', total=10, interval=0)
+    with caplog.at_level(logging.INFO, logger='test.progress'):
+        progress.update(4)
+    assert '4 of 10 rows' in caplog.text
+    assert 'ETA' in caplog.text
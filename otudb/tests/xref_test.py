@@ -0,0 +1,63 @@
+import random
+import pytest
+
+from munch import Munch
+from peewee import SqliteDatabase
+
+from ..models import base_models, otu_seq, otu_counts, otu_xref
+from ..sequences import seq_digest
+from ..xref import find_contained, xref_sets
+
+
+def random_sequence(rng, length):
+    return ''.join(rng.choices('ACGT', k=length))
+
+
+class TestFindContained(object):
+    """test find_contained of sequences within others"""
+
+    def test_offsets(self):
+        rng = random.Random(0)
+        targets = [random_sequence(rng, 300) for _ in range(20)]
+        queries = [targets[3][:100], targets[7][41:250], random_sequence(rng, 100), 'ACGT']
+        found = list(find_contained(queries, targets, k=16, stride=4))
+        assert found == [(0, 3, 0), (1, 7, 41)]
+
+
+class TestXrefSets(object):
+    """test xref_sets of two analysis sets"""
+
+    @pytest.fixture
+    def db(self):
+        # setup
+        db = SqliteDatabase(':memory:')
+        rng = random.Random(1)
+        shared, longer = random_sequence(rng, 200), random_sequence(rng, 300)
+        sequences = {1: shared, 2: longer[:150], 3: shared, 4: longer}
+        with db.bind_ctx(base_models):
+            db.create_tables(base_models)
+            otu_seq.insert_many([dict(seq_id=otu_id, otu_name=f'OTU_{otu_id}', sequence=seq,
+                                      seq_digest=seq_digest(seq))
+                                 for otu_id, seq in sequences.items()]).execute()
+            otu_counts.insert_many([dict(set_id=1 if otu_id < 3 else 2, otu_id=otu_id,
+                                         sample_id=1, counts=1)
+                                    for otu_id in sequences]).execute()
+            db.models = Munch({m._meta.table_name: m for m in base_models})
+
+            # action!
+            yield db
+
+        # teardown
+        db.close()
+
+
+    def test_xref(self, db):
+        written = xref_sets(db, db.models, 1, 2, k=16, stride=4)
+        assert written == {'seq_digest': 1, 'kmer_prefix': 1, 'kmer_contained': 0}
+        rows = set(otu_xref.select(otu_xref.set_id_1, otu_xref.otu_id_1, otu_xref.set_id_2,
+                                   otu_xref.otu_id_2, otu_xref.method).tuples())
+        assert rows == {(1, 1, 2, 3, 'seq_digest'), (1, 2, 2, 4, 'kmer_prefix')}
+
+        # run again: replaced, not added
+        xref_sets(db, db.models, 2, 1, k=16, stride=4)
+        assert otu_xref.select().count() == 2
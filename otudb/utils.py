@@ -1,8 +1,13 @@
 """Set of utility functions for OTU 16S"""
 
 import os
-import logging
 import time
+import queue
+import atexit
+import logging
+import logging.handlers
+
+import attr
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ Functional ~~~~~
 def now(dateformat="%Y-%m-%d %H:%M"):
@@ -11,30 +16,120 @@ def now(dateformat="%Y-%m-%d %H:%M"):
 
 
 # Log It!
-def log_it(logname=os.path.basename(__file__), logdir="logs"):
-    """package logging setup"""
+# per-row records: below DEBUG, so off unless OTUDB_LOG_LEVEL=ROWS
+ROWS = 5
+logging.addLevelName(ROWS, 'ROWS')
+
+# write log records from a background thread (QueueListener) unless OTUDB_LOG_QUEUE=0
+log_queued = os.environ.get('OTUDB_LOG_QUEUE', '1') != '0'
+log_level = os.environ.get('OTUDB_LOG_LEVEL', 'DEBUG').upper()
+
+_log_listeners = []
+
+
+def _stop_log_listeners():
+    """flush and stop the logging threads"""
+    while _log_listeners:
+        _log_listeners.pop().stop()
+
+atexit.register(_stop_log_listeners)
+
+
+def add_log_handlers(logger, handlers, queued=None):
+    """attach handlers to logger, behind a QueueHandler if `queued` so that
+    formatting and writing happen on a listener thread, not the caller's.
+    """
+    queued = log_queued if queued is None else queued
+    if queued:
+        log_queue = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(log_queue, *handlers,
+                                                  respect_handler_level=True)
+        listener.start()
+        _log_listeners.append(listener)
+        handlers = [logging.handlers.QueueHandler(log_queue)]
+    for handler in handlers:
+        logger.addHandler(handler)
+    return logger
+
+
+def log_it(logname=os.path.basename(__file__), logdir="logs", queued=None):
+    """package logging setup; handlers are only added on the first call per logname"""
+    l = logging.getLogger(logname)
+    if l.handlers:
+        return l
+
     curtime = now("%Y%m%d-%H%M")
     logfile = '.'.join([curtime, logname, 'log'])
     logfile = os.path.join(logdir, logfile)
+    os.makedirs(logdir, exist_ok=True)
 
-    loglevel = logging.DEBUG
+    loglevel = logging.getLevelName(log_level)
     logFormat = "%(asctime)s %(levelname)5s: %(module)15s %(funcName)10s: %(message)s"
     formatter = logging.Formatter(logFormat)
 
-    logging.basicConfig(format=logFormat, filename=logfile, level=loglevel)
-    l = logging.getLogger(logname)
+    root = logging.getLogger()
+    if not root.handlers:
+        rfh = logging.FileHandler(logfile, mode='a')
+        rfh.setFormatter(formatter)
+        add_log_handlers(root, [rfh], queued)
+    root.setLevel(loglevel)
+    l.setLevel(loglevel)
 
     ch = logging.StreamHandler()
     ch.setLevel(loglevel)
     ch.setFormatter(formatter)
-    l.addHandler(ch)
 
     fh = logging.FileHandler(logfile, mode='a')
     fh.setLevel(loglevel)
     fh.setFormatter(formatter)
-    l.addHandler(fh)
 
-    return l
+    return add_log_handlers(l, [ch, fh], queued)
+
+
+@attr.s
+class ProgressLog(object):
+    """Rate-limited progress records for long loops: rows done, rows/sec and,
+    when the `total` is known, the ETA. At most one record per `interval` secs.
+    """
+    log = attr.ib(repr=False)
+    label: str = attr.ib()
+    total: int = attr.ib(default=None)
+    interval: float = attr.ib(default=10.0)
+    done: int = attr.ib(init=False, default=0)
+    started: float = attr.ib(init=False, default=attr.Factory(time.monotonic), repr=False)
+    next_report: float = attr.ib(init=False, default=None, repr=False)
+
+    def __attrs_post_init__(self):
+        self.next_report = self.started + self.interval
+
+    def update(self, count=1):
+        self.done += count
+        if time.monotonic() >= self.next_report:
+            self.report()
+
+    def report(self):
+        current = time.monotonic()
+        self.next_report = current + self.interval
+        elapsed = current - self.started
+        rate = self.done / elapsed if elapsed else 0.0
+        if self.total and rate:
+            eta = (self.total - self.done) / rate
+            self.log.info('%s: %s of %s rows, %.0f rows/sec, ETA %.0fs',
+                          self.label, self.done, self.total, rate, eta)
+        else:
+            self.log.info('%s: %s rows, %.0f rows/sec', self.label, self.done, rate)
+
+
+def count_records(filepath, marker=b'\n', chunk_size=1<<20):
+    """count occurrences of `marker` (default: lines) in a file, quickly"""
+    count = 0
+    tail = b''
+    with open(filepath, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b''):
+            chunk = tail + chunk
+            count += chunk.count(marker)
+            tail = chunk[-(len(marker)-1):] if len(marker) > 1 else b''
+    return count
 
 
 # dump_args decorator
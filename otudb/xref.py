@@ -0,0 +1,185 @@
+"""Match the OTUs of two analysis sets and record the pairs in otu_xref.
+
+OTUs are matched in two passes, neither comparing all pairs:
+
+    seq_digest      equal sequences, by their stored digest
+    kmer_prefix     the sequence of otu_id_1 starts the one of otu_id_2
+    kmer_contained  the sequence of otu_id_1 lies within the one of otu_id_2
+
+The second pass indexes every `stride`-th k-mer of the sequences of one
+set (otudb.kmers.KmerIndex) and looks up, for each unmatched sequence of
+the other, the `stride` consecutive k-mers with the fewest postings. If a
+sequence lies within another, one of those k-mers is indexed at the right
+offset, so every containment is found; candidates are then checked base
+for base. For the prefix/contained rows, the shorter OTU is otu_id_1 (and
+its set set_id_1); digest matches keep the sets in the order given.
+"""
+
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from .batch import BatchInserter, DEFAULT_BATCH_SIZE
+from .export import stream_rows, FETCH_SIZE
+from .kmers import KmerIndex, kmer_array, DEFAULT_K, DEFAULT_STRIDE
+from .sequences import normalize_sequence, seq_digest
+from .utils import log_it
+
+
+log = log_it(logname='otudb.xref')
+
+xref_methods = ('seq_digest', 'kmer_prefix', 'kmer_contained')
+
+# queries looked up in the index at a time
+QUERY_BLOCK = 1000
+
+
+def set_otus(models, set_id):
+    """query of the otu ids counted or annotated in analysis set set_id"""
+    counts, annotations = models.otu_counts, models.otu_annotation
+    return (counts.select(counts.otu_id).where(counts.set_id == set_id)
+            | annotations.select(annotations.otu_id).where(annotations.set_id == set_id))
+
+
+def set_sequences(db, models, set_id, fetch_size=FETCH_SIZE):
+    """{otu_id: (digest, sequence)} of the OTUs of a set. OTUs imported
+    with a sequence already stored have theirs through otu_xref (see
+    import_data.import_seq_chunk).
+    """
+    seqs, xref = models.otu_seq, models.otu_xref
+    otus = set_otus(models, set_id)
+    own = (seqs.select(seqs.seq_id, seqs.seq_digest, seqs.sequence)
+               .where(seqs.seq_id.in_(otus) & seqs.sequence.is_null(False)))
+    aliased = (xref.select(xref.otu_id_2, seqs.seq_digest, seqs.sequence)
+                   .join(seqs, on=(xref.otu_id_1 == seqs.seq_id))
+                   .where((xref.method == 'seq_digest') & xref.otu_id_2.in_(otus)
+                          & seqs.sequence.is_null(False)))
+    sequences = {}
+    for query in (own, aliased):
+        for otu_id, digest, sequence in stream_rows(db, query, fetch_size):
+            sequence = normalize_sequence(sequence)
+            sequences[otu_id] = (digest or seq_digest(sequence), sequence)
+    log.info(f'Read {len(sequences)} sequences of set {set_id}')
+    return sequences
+
+
+def match_digests(sequences_1, sequences_2):
+    """(otu_id_1, otu_id_2) pairs of equal sequences"""
+    by_digest = defaultdict(list)
+    for otu_id, (digest, _) in sequences_1.items():
+        by_digest[digest].append(otu_id)
+    for otu_id_2, (digest, _) in sequences_2.items():
+        for otu_id_1 in by_digest.get(digest, ()):
+            yield otu_id_1, otu_id_2
+
+
+def query_candidates(index, kmers, valid, start, end):
+    """postings of the `stride` consecutive k-mers of a query with the
+    fewest postings: (target numbers, offsets of the query in them)
+    """
+    stride = index.stride
+    if len(kmers) < stride:
+        return None
+    counts = np.where(valid, end - start, len(index) + 1).astype(np.int64)
+    sums = np.convolve(counts, np.ones(stride, dtype=np.int64), mode='valid')
+    first = int(np.argmin(sums))
+    if sums[first] > len(index):
+        return None # no window of only ACGT k-mers
+    window = range(first, first + stride)
+    postings = np.concatenate([np.arange(start[p], end[p]) for p in window])
+    query_positions = np.concatenate([np.full(end[p] - start[p], p) for p in window])
+    return index.seqs[postings], index.positions[postings] - query_positions
+
+
+def find_contained(queries, targets, index=None, k=DEFAULT_K, stride=DEFAULT_STRIDE,
+                   block=QUERY_BLOCK):
+    """yield (query number, target number, offset) of each of the `queries`
+    (list of str) that lies within one of the `targets`, at offset
+    """
+    if index is None:
+        index = KmerIndex.build(targets, k, stride)
+    target_lengths = np.array([len(target) for target in targets], dtype=np.int64)
+    for first in range(0, len(queries), block):
+        numbers = range(first, min(first + block, len(queries)))
+        arrays = [kmer_array(queries[q], index.k) for q in numbers]
+        start, end = index.lookup(np.concatenate([kmers for kmers, _ in arrays])
+                                  if arrays else np.zeros(0, dtype=np.uint64))
+        at = 0
+        for q, (kmers, valid) in zip(numbers, arrays):
+            n = len(kmers)
+            found = query_candidates(index, kmers, valid, start[at:at+n], end[at:at+n])
+            at += n
+            if found is None:
+                continue
+            seqs, offsets = found
+            length = len(queries[q])
+            fits = (offsets >= 0) & (offsets + length <= target_lengths[seqs])
+            candidates = set(zip(seqs[fits].tolist(), offsets[fits].tolist()))
+            for t, offset in sorted(candidates):
+                if targets[t][offset:offset+length] == queries[q]:
+                    yield q, t, offset
+
+
+def contained_pairs(sequences_1, sequences_2, k=DEFAULT_K, stride=DEFAULT_STRIDE):
+    """yield (otu_id_1, otu_id_2, offset) of sequences of sequences_1
+    ({otu_id: (digest, sequence)}) lying within sequences of sequences_2
+    """
+    if not sequences_1 or not sequences_2:
+        return
+    query_ids = list(sequences_1)
+    target_ids = list(sequences_2)
+    queries = [sequences_1[otu_id][1] for otu_id in query_ids]
+    targets = [sequences_2[otu_id][1] for otu_id in target_ids]
+    for q, t, offset in find_contained(queries, targets, None, k, stride):
+        if len(queries[q]) < len(targets[t]):
+            yield query_ids[q], target_ids[t], offset
+
+
+def xref_sets(db, models, set_id_1, set_id_2, k=DEFAULT_K, stride=DEFAULT_STRIDE,
+              kmers=True, batch_size=DEFAULT_BATCH_SIZE):
+    """match the OTUs of two sets, replacing their earlier matches in
+    otu_xref. Return {method: pairs written}.
+    """
+    started = time.perf_counter()
+    xref = models.otu_xref
+    sequences_1 = set_sequences(db, models, set_id_1)
+    sequences_2 = set_sequences(db, models, set_id_2)
+    written = dict.fromkeys(xref_methods, 0)
+    pair_sets = (((xref.set_id_1 == set_id_1) & (xref.set_id_2 == set_id_2)) |
+                 ((xref.set_id_1 == set_id_2) & (xref.set_id_2 == set_id_1)))
+    try:
+        with db.atomic():
+            deleted = xref.delete().where(pair_sets & xref.method.in_(xref_methods)).execute()
+            if deleted:
+                log.info(f'Replacing {deleted} earlier matches of sets {set_id_1}, {set_id_2}')
+            with BatchInserter(xref, batch_size) as batch:
+                def add(set_1, otu_1, set_2, otu_2, method):
+                    batch.add(dict(set_id_1=set_1, otu_id_1=otu_1,
+                                   set_id_2=set_2, otu_id_2=otu_2, method=method))
+                    written[method] += 1
+
+                matched_1, matched_2 = set(), set()
+                for otu_1, otu_2 in match_digests(sequences_1, sequences_2):
+                    add(set_id_1, otu_1, set_id_2, otu_2, 'seq_digest')
+                    matched_1.add(otu_1)
+                    matched_2.add(otu_2)
+                log.info(f'{written["seq_digest"]} OTU pairs of equal sequences')
+
+                if kmers:
+                    unmatched_1 = {o: s for o, s in sequences_1.items() if o not in matched_1}
+                    unmatched_2 = {o: s for o, s in sequences_2.items() if o not in matched_2}
+                    for (set_1, queries), (set_2, targets) in (
+                            ((set_id_1, unmatched_1), (set_id_2, sequences_2)),
+                            ((set_id_2, unmatched_2), (set_id_1, sequences_1))):
+                        for otu_1, otu_2, offset in contained_pairs(queries, targets, k, stride):
+                            add(set_1, otu_1, set_2, otu_2,
+                                'kmer_prefix' if offset == 0 else 'kmer_contained')
+            batch.report()
+    except Exception as e:
+        log.error(f'Whoops matching the OTUs of sets {set_id_1} and {set_id_2}.')
+        raise e
+    elapsed = time.perf_counter() - started
+    log.info('Matched %s x %s OTUs of sets %s, %s in %.2fs: %s',
+             len(sequences_1), len(sequences_2), set_id_1, set_id_2, elapsed, written)
+    return written
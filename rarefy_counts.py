@@ -0,0 +1,64 @@
+"""Rarefy the read counts of the samples of an analysis set to even
+    depths (see otudb.rarefaction), written out and/or stored as new sets.
+"""
+import time
+
+from clize import run, parameters
+
+from otudb.batch import DEFAULT_BATCH_SIZE
+from otudb.database import otudb, tables
+from otudb.parsers import CSVParser
+from otudb.rarefaction import rarefy, store_rarefied, ITERATIONS
+from otudb.utils import log_it
+
+log = log_it(logname='rarefy_counts')
+
+result_headers = ['depth', 'iteration', 'otu_name', 'sample_name', 'count']
+
+
+def parse_rarefy(*,
+                 set_id:['s', int]=None,
+                 depth:['d', parameters.multi()]=None,
+                 iterations:['n', int]=ITERATIONS,
+                 seed:int=0,
+                 jobs:['j', int]=None,
+                 outfile:['o', str]=None,
+                 store=False,
+                 batch_size:['b', int]=DEFAULT_BATCH_SIZE,
+                ):
+    """Rarefy the otu_counts read counts of an analysis set.
+
+    :param set_id: analysis set (default: counts imported without a set)
+    :param depth: reads per sample to rarefy to (REQUIRED, repeatable)
+    :param iterations: draws per sample and depth
+    :param seed: random seed; equal seeds, equal draws
+    :param jobs: number of processes drawing samples (default: number of cores)
+    :param outfile: TSV file of the (depth, iteration, otu_name, sample_name,
+        count) rarefied cells
+    :param store: store the first draw at each depth as a new analysis set
+    :param batch_size: number of rows written per INSERT statement
+    """
+    if not depth or not (outfile or store):
+        log.error('    Whoops! Depth *and* output file (or --store) are required...')
+        return
+    try:
+        depths = [int(d) for d in depth]
+    except ValueError:
+        log.error(f'    Whoops! Depths must be numbers of reads, not {depth}...')
+        return
+    started = time.perf_counter()
+    result = rarefy(otudb.get_database(), tables.models, set_id, depths, iterations, seed, jobs)
+    if outfile:
+        out = CSVParser(outfile, mode='w', delimiter='\t')
+        with out.fh:
+            rows = out.write_rows(result.rows(), result_headers)
+        log.info('Wrote %s rarefied cells in %.2fs', rows, time.perf_counter() - started)
+    if store:
+        for d in result.depths:
+            new_set = store_rarefied(tables.models, result, d, batch_size=batch_size,
+                                     set_name=f'set {set_id or 0} rarefied to {d}')
+            log.info(f'Counts of set {set_id or 0} rarefied to {d} stored as set {new_set}')
+
+
+if __name__ == '__main__':
+    run(parse_rarefy)
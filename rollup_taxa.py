@@ -0,0 +1,59 @@
+"""Report summed abundances per taxon from the otu_taxon_rollup table, or
+    rebuild the rollups from otu_counts and otu_annotation.
+"""
+import time
+
+from clize import run
+
+from otudb.batch import DEFAULT_BATCH_SIZE
+from otudb.database import otudb, tables
+from otudb.parsers import CSVParser
+from otudb.pool import retrying
+from otudb.rollup import rebuild_rollups, taxon_abundances
+from otudb.taxonomy import ranks
+from otudb.utils import log_it
+
+log = log_it(logname='rollup_taxa')
+
+result_headers = ['sample_name', 'taxon', 'abundance', 'otu_count']
+
+
+def parse_rollup(*,
+                 set_id:['s', int]=None,
+                 rank:['r', str]=None,
+                 outfile:['o', str]=None,
+                 rebuild=False,
+                 batch_size:int=DEFAULT_BATCH_SIZE,
+                ):
+    """Per-taxon abundances of the samples of an analysis set.
+
+    The rollups are kept up to date by import_data.py; rebuild them if they
+    have drifted (e.g. after rows were changed outside the importers).
+
+    :param set_id: analysis set (default: rows imported without a set)
+    :param rank: rank to report, one of kingdom..species
+    :param outfile: TSV file of (sample_name, taxon, abundance, otu_count)
+    :param rebuild: recompute the rollups of the set (of all sets if no
+        set is given) before reporting
+    :param batch_size: number of rows written per INSERT statement
+    """
+    if not rebuild and not (rank and outfile):
+        log.error('    Whoops! Rank *and* output file (or --rebuild) are required...')
+        return
+    if rank and rank not in ranks:
+        log.error(f'    Whoops! Unknown rank {rank}, not one of {", ".join(ranks)}...')
+        return
+    if rebuild:
+        retrying(otudb, rebuild_rollups, tables.models, set_id, batch_size)
+    if not (rank and outfile):
+        return
+    started = time.perf_counter()
+    out = CSVParser(outfile, mode='w', delimiter='\t')
+    with out.fh:
+        rows = out.write_rows(taxon_abundances(tables.models, rank, set_id).iterator(),
+                              result_headers)
+    log.info('Wrote %s rows in %.2fs', rows, time.perf_counter() - started)
+
+
+if __name__ == '__main__':
+    run(parse_rollup)
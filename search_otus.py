@@ -0,0 +1,76 @@
+"""Search the stored OTU sequences for those nearest to each sequence of a
+    FASTA file, by shared k-mers (see otudb.search).
+"""
+import time
+
+from clize import run
+
+from otudb.database import otudb, tables
+from otudb.parsers import CSVParser
+from otudb.search import (SearchIndex, search_fasta, otu_names,
+                          SEARCH_K, SEARCH_SCALE, TOP_N, QUERY_BATCH)
+from otudb.utils import log_it
+
+log = log_it(logname='search_otus')
+
+result_headers = ['query', 'rank', 'otu_name', 'seq_id',
+                  'shared_kmers', 'query_kmers', 'identity']
+
+
+def result_rows(results):
+    """one row per hit of (query, hits) results, otu names looked up a
+    block of queries at a time
+    """
+    block = []
+    for query, hits in results:
+        block.append((query, hits))
+        if len(block) >= QUERY_BATCH:
+            yield from named_rows(block)
+            block = []
+    yield from named_rows(block)
+
+
+def named_rows(block):
+    names = otu_names(tables.models, [hit[0] for _, hits in block for hit in hits])
+    for query, hits in block:
+        for rank, (seq_id, shared, query_size, identity) in enumerate(hits, 1):
+            yield query, rank, names.get(seq_id), seq_id, shared, query_size, identity
+
+
+def parse_search(*,
+                 filepath:['p', str]=None,
+                 outfile:['o', str]=None,
+                 top:['n', int]=TOP_N,
+                 jobs:['j', int]=None,
+                 rebuild=False,
+                 k:int=SEARCH_K,
+                 scale:int=SEARCH_SCALE,
+                ):
+    """Find the stored OTUs nearest to each sequence of a FASTA file.
+
+    The k-mer index of otu_seq is built on first use and brought up to
+    date with new sequences before searching.
+
+    :param filepath: FASTA file of the query sequences (REQUIRED)
+    :param outfile: TSV file of the hits (REQUIRED)
+    :param top: number of hits per query
+    :param jobs: number of processes searching (default: number of cores)
+    :param rebuild: build the index anew (e.g. with another k or scale)
+    :param k: k-mer length of a new index
+    :param scale: a new index keeps about 1 in `scale` k-mers of a sequence
+    """
+    if not filepath or not outfile:
+        log.error('    Whoops! Query FASTA file *and* output file are required...')
+        return
+    index = SearchIndex(k=k, scale=scale)
+    index.update(otudb.get_database(), tables.models, rebuild)
+    started = time.perf_counter()
+    out = CSVParser(outfile, mode='w', delimiter='\t')
+    with out.fh:
+        rows = out.write_rows(result_rows(search_fasta(filepath, index, top, jobs)),
+                              result_headers)
+    log.info('Wrote %s hits in %.2fs', rows, time.perf_counter() - started)
+
+
+if __name__ == '__main__':
+    run(parse_search)
@@ -19,6 +19,7 @@ setup(
         'clize>=4.0.3',
         'SQLAlchemy>=1.2.2',
         'PyMySQL>=0.8.0',
+        'numpy>=1.18',
     ],
     tests_require=[
         'pytest>=3.4.0',
@@ -0,0 +1,43 @@
+"""Match the OTUs of two analysis sets (equal sequences, then prefixes and
+    containment by k-mers) and record the pairs in otu_xref.
+"""
+from clize import run
+
+from otudb.batch import DEFAULT_BATCH_SIZE
+from otudb.database import otudb, tables
+from otudb.kmers import DEFAULT_K, DEFAULT_STRIDE
+from otudb.pool import retrying
+from otudb.xref import xref_sets
+from otudb.utils import log_it
+
+log = log_it(logname='xref_otus')
+
+
+def parse_xref(*,
+               set_id_1:['a', int]=None,
+               set_id_2:['b', int]=None,
+               k:int=DEFAULT_K,
+               stride:int=DEFAULT_STRIDE,
+               digest_only=False,
+               batch_size:int=DEFAULT_BATCH_SIZE,
+              ):
+    """Cross reference the OTUs of two analysis sets in OTUdb.
+
+    :param set_id_1: first analysis set (REQUIRED)
+    :param set_id_2: second analysis set (REQUIRED)
+    :param k: k-mer length of the prefix/containment matching (at most 32)
+    :param stride: index every stride-th k-mer; larger uses less memory,
+        but sequences shorter than k + stride - 1 are not matched
+    :param digest_only: only match equal sequences
+    :param batch_size: number of rows written per INSERT statement
+    """
+    if set_id_1 is None or set_id_2 is None:
+        log.error('    Whoops! Both analysis sets (-a, -b) are required...')
+        return
+    # run again from the start if the connection is lost: matches are replaced
+    retrying(otudb, xref_sets, otudb.get_database(), tables.models, set_id_1, set_id_2,
+             k, stride, not digest_only, batch_size)
+
+
+if __name__ == '__main__':
+    run(parse_xref)